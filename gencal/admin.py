@@ -9,4 +9,10 @@ class GenericCalendarAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug', 'get_content_types')
     prepopulated_fields = {"slug": ("name", )}
 
+    def queryset(self, request):
+        # get_content_types lists each row's content types; fetch them all
+        # in one query rather than one per row.
+        return super(GenericCalendarAdmin, self).queryset(
+                request).prefetch_related('content_types')
+
 admin.site.register(GenericCalendar, GenericCalendarAdmin)
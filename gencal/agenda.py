@@ -0,0 +1,143 @@
+"""
+An agenda: a calendar's objects of every content type in date order, a
+page at a time.
+
+Each content type's objects are read in ``(date, pk)`` order, and the
+per-type results are merged with a heap. Pages are addressed with a
+cursor holding the ``(date, content type id, pk)`` of the last object
+shown, which every query filters on instead of using an offset, so a page
+far ahead costs the same as the first one.
+
+With ``USE_TZ`` on, dates and datetimes are compared as aware datetimes,
+dates standing for midnight in the agenda's time zone, and cursors hold
+UTC times.
+"""
+import datetime
+import heapq
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+from grid import get_timezone
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+def get_page_size():
+    return getattr(settings, 'CALENDAR_AGENDA_PAGE_SIZE', 20)
+
+def format_cursor(cursor):
+    """
+    Return the string form of a ``(datetime, content_type_id, pk)``
+    cursor, as used in urls. Aware datetimes are written in UTC.
+    """
+    when, ct_id, pk = cursor
+    if timezone.is_aware(when):
+        when = when.astimezone(timezone.utc)
+    return '%s-%d-%d' % (when.strftime(CURSOR_FORMAT), ct_id, pk)
+
+def parse_cursor(value, tz=None):
+    """
+    Return the ``(datetime, content_type_id, pk)`` cursor from
+    :func:`format_cursor`, as an aware (UTC) datetime if ``tz`` is given.
+    Raises ``ValueError`` if ``value`` isn't one.
+    """
+    when, ct_id, pk = value.split('-')
+    when = datetime.datetime.strptime(when, CURSOR_FORMAT)
+    if tz is not None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when, int(ct_id), int(pk)
+
+def as_datetime(value, tz=None):
+    """
+    Return ``value`` as a datetime, so dates and datetimes can be sorted
+    together; dates are taken as midnight, in ``tz`` if it's given.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    value = datetime.datetime.combine(value, datetime.time())
+    if tz is not None:
+        value = timezone.make_aware(value, tz)
+    return value
+
+def after_cursor(field, ct_id, cursor, tz=None):
+    """
+    Return a ``Q`` matching the objects of the content type ``ct_id``
+    that come after ``cursor`` in ``(date, content type id, pk)`` order,
+    where ``field`` is the model's date field. ``tz`` is the time zone
+    dates are midnight in, with ``USE_TZ`` on.
+    """
+    when, cursor_ct_id, cursor_pk = cursor
+    name = field.name
+    if isinstance(field, models.DateTimeField):
+        value = when
+    else:
+        if tz is not None:
+            when = when.astimezone(tz)
+        if when.time() != datetime.time():
+            # Dates sort as midnight, so the whole day is behind the cursor.
+            return Q(**{'%s__gt' % name: when.date()})
+        value = when.date()
+    if ct_id > cursor_ct_id:
+        return Q(**{'%s__gte' % name: value})
+    later = Q(**{'%s__gt' % name: value})
+    if ct_id == cursor_ct_id:
+        later |= Q(**{name: value, 'pk__gt': cursor_pk})
+    return later
+
+def get_agenda(calendar, start=None, after=None, limit=None, tz=None):
+    """
+    Return ``(objects, next_cursor)``: the first ``limit`` objects of
+    ``calendar`` dated on or after ``start``, and after the cursor
+    ``after`` if one is given, in ``(date, content type id, pk)`` order.
+    ``next_cursor`` is the cursor for the following page, or ``None`` if
+    there isn't one.
+
+    Each content type costs one query for at most ``limit + 1`` objects.
+
+    :arg calendar: The calendar to list.
+    :type calendar: :class:`gencal.models.GenericCalendar`.
+    :keyword start: First date to list. Defaults to today.
+    :type start: date.
+    :keyword after: Cursor of the last object on the previous page.
+    :type after: tuple.
+    :keyword limit: Objects per page. Defaults to the
+        ``CALENDAR_AGENDA_PAGE_SIZE`` setting (20).
+    :type limit: int.
+    :keyword tz: Time zone (or its name) dates start in, with ``USE_TZ``
+        on. Defaults to the current time zone.
+    :type tz: tzinfo/str.
+    """
+    from models import project_queryset, get_item_date
+
+    tz = get_timezone(tz)
+    if start is None:
+        if tz is None:
+            start = datetime.date.today()
+        else:
+            start = timezone.now().astimezone(tz).date()
+    if limit is None:
+        limit = get_page_size()
+
+    streams = []
+    for model, field in calendar.get_date_fields():
+        ct_id = ContentType.objects.get_for_model(model).id
+        lookup_start = start
+        if isinstance(field, models.DateTimeField):
+            lookup_start = as_datetime(start, tz)
+        queryset = model._default_manager.filter(**{
+            '%s__gte' % field.name: lookup_start})
+        if after is not None:
+            queryset = queryset.filter(after_cursor(field, ct_id, after, tz))
+        queryset = queryset.order_by(field.name, 'pk')[:limit + 1]
+        streams.append([(as_datetime(get_item_date(obj), tz), ct_id, obj.pk, obj)
+            for obj in project_queryset(queryset, field.name)])
+
+    entries = []
+    for entry in heapq.merge(*streams):
+        if len(entries) == limit:
+            return [obj for key, ct_id, pk, obj in entries], entries[-1][:3]
+        entries.append(entry)
+    return [obj for key, ct_id, pk, obj in entries], None
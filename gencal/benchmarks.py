@@ -0,0 +1,268 @@
+"""
+Rough timings for the calendar rendering pipeline.
+
+These are meant to be run by hand (see the ``gencal_benchmark``
+management command) to compare rendering strategies, not as part of
+the test suite.
+
+:func:`benchmark_pipeline` times each stage of rendering a
+:class:`gencal.models.GenericCalendar` against synthetic models and
+datasets in a test database (in memory, with SQLite), and returns plain
+dicts and lists that can be dumped as JSON and compared between commits.
+"""
+from calendar import Calendar
+import datetime
+import platform
+import sys
+import time
+
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models
+from django.utils.datastructures import SortedDict
+
+from buckets import DayBuckets
+from grid import get_first_weekday
+from templatetags.gencal import ListCalendar
+
+def sample_items(year, month, per_day=2):
+    """
+    Build a list of dicts with ``per_day`` items on every day of the
+    given month, suitable for passing to :class:`ListCalendar`.
+    """
+    items = []
+    day = datetime.date(year, month, 1)
+    while day.month == month:
+        for i in range(per_day):
+            items.append({'date': day, 'name': 'item %d' % i})
+        day += datetime.timedelta(days=1)
+    return items
+
+def time_formatmonth(cal_items, year, month, compiled, iterations=50,
+        slug='benchmark', calendar_class=ListCalendar):
+    """
+    Return the total number of seconds spent building and rendering the
+    given month ``iterations`` times.
+    """
+    start = time.time()
+    for i in range(iterations):
+        cal = calendar_class(cal_items, year, month, compiled=compiled)
+        cal.formatmonth(slug, year, month)
+    return time.time() - start
+
+def benchmark_formatmonth(year=2009, month=1, per_day=2, iterations=50,
+        slug='benchmark', calendar_class=ListCalendar):
+    """
+    Compare the chained ``format*.html`` rendering path with the
+    compiled single-template path.
+
+    :returns: A dict with the total seconds for each path and the speedup.
+    :rtype: dict.
+    """
+    cal_items = sample_items(year, month, per_day)
+    chained = time_formatmonth(cal_items, year, month, False, iterations,
+            slug, calendar_class)
+    compiled = time_formatmonth(cal_items, year, month, True, iterations,
+            slug, calendar_class)
+    return {'iterations': iterations, 'chained': chained,
+            'compiled': compiled,
+            'speedup': chained / compiled if compiled else None}
+
+def _sorteddict_buckets(cal_items, year, month, firstweekday):
+    # How ListCalendar used to bucket items: a SortedDict of lists keyed
+    # by date.
+    month_dict = SortedDict()
+    for week in Calendar(firstweekday).monthdatescalendar(year, month):
+        for date in week:
+            month_dict[date] = []
+    for item in cal_items:
+        month_dict[item['date']].append(item)
+    return month_dict
+
+def _day_buckets(cal_items, year, month, firstweekday):
+    weeks = Calendar(firstweekday).monthdatescalendar(year, month)
+    buckets = DayBuckets(weeks[0][0], len(weeks) * 7)
+    start_ordinal = buckets.start_ordinal
+    buckets.extend(cal_items,
+            [item['date'].toordinal() - start_ordinal for item in cal_items])
+    # Build the per-day index, as rendering would.
+    buckets.count(0)
+    return buckets
+
+def _sorteddict_size(month_dict):
+    size = sys.getsizeof(month_dict) + sys.getsizeof(month_dict.keyOrder)
+    for date, items in month_dict.items():
+        size += sys.getsizeof(date) + sys.getsizeof(items)
+    return size
+
+def _day_buckets_size(buckets):
+    size = sys.getsizeof(buckets) + sys.getsizeof(buckets.items)
+    for arr in (buckets.entry_days, buckets.entry_items, buckets._starts,
+            buckets._order):
+        size += sys.getsizeof(arr)
+    return size
+
+def benchmark_bucketing(year=2009, month=1, per_day=2, iterations=1000):
+    """
+    Compare bucketing a month's items into the old ``SortedDict`` of
+    per-date lists with :class:`DayBuckets`.
+
+    :returns: A dict with the total seconds spent building each structure
+        ``iterations`` times, and the approximate bytes used by one of
+        each (not counting the items themselves).
+    :rtype: dict.
+    """
+    cal_items = sample_items(year, month, per_day)
+    firstweekday = get_first_weekday()
+    result = {'iterations': iterations}
+    for name, build, sizeof in (
+            ('sorteddict', _sorteddict_buckets, _sorteddict_size),
+            ('buckets', _day_buckets, _day_buckets_size)):
+        start = time.time()
+        for i in range(iterations):
+            built = build(cal_items, year, month, firstweekday)
+        result[name] = time.time() - start
+        result['%s_bytes' % name] = sizeof(built)
+    return result
+
+# The synthetic datasets: how many content types the calendar has and how
+# each type's objects are spread over the month.
+DATASETS = SortedDict([
+    ('sparse', {'types': 2, 'layout': 'sparse'}),
+    ('dense', {'types': 2, 'layout': 'dense'}),
+    ('skewed', {'types': 2, 'layout': 'skewed'}),
+    ('many_types', {'types': 10, 'layout': 'dense'}),
+])
+
+def make_models(count):
+    """
+    Return ``count`` synthetic models, each with a title and an indexed
+    date. They're registered with the gencal app, so they get tables when
+    a test database is created after calling this.
+    """
+    benchmark_models = []
+    for i in range(count):
+        name = 'BenchmarkItem%d' % i
+        attrs = {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {'app_label': 'gencal'}),
+            'title': models.CharField(max_length=100),
+            'date': models.DateField(db_index=True),
+            '__unicode__': lambda self: self.title,
+        }
+        # Returns the registered model if it already exists.
+        benchmark_models.append(type(name, (models.Model,), attrs))
+    return benchmark_models
+
+def sample_dates(year, month, layout, per_day):
+    """
+    Return the dates of one content type's objects in the given month:
+    ``per_day`` on every day (``dense``), ``per_day`` on every fifth day
+    (``sparse``), or as many as ``dense`` all on the 15th (``skewed``).
+    """
+    days = []
+    day = datetime.date(year, month, 1)
+    while day.month == month:
+        days.append(day)
+        day += datetime.timedelta(days=1)
+    if layout == 'sparse':
+        days = days[::5]
+    elif layout == 'skewed':
+        return [datetime.date(year, month, 15)] * (per_day * len(days))
+    return [day for day in days for i in range(per_day)]
+
+def populate(slug, benchmark_models, layout, year, month, per_day):
+    """
+    Create a calendar ``slug`` showing ``benchmark_models``, replacing
+    their objects with the ``layout`` dataset.
+    """
+    from models import GenericCalendar
+    calendar = GenericCalendar.objects.create(name=slug, slug=slug)
+    dates = sample_dates(year, month, layout, per_day)
+    for model in benchmark_models:
+        model._default_manager.all().delete()
+        model._default_manager.bulk_create([model(title='item %d' % i, date=date)
+            for i, date in enumerate(dates)])
+        calendar.content_types.add(ContentType.objects.get_for_model(model))
+    return calendar
+
+def time_stage(func, iterations, setup=None):
+    """
+    Call ``func`` ``iterations`` times (with the result of ``setup()``, if
+    given, which isn't timed) and return the best and mean seconds taken
+    and the number of queries made by one call.
+    """
+    times = []
+    queries = 0
+    for i in range(iterations):
+        arg = setup() if setup else None
+        before = len(connection.queries)
+        start = time.time()
+        if setup:
+            func(arg)
+        else:
+            func()
+        times.append(time.time() - start)
+        queries = len(connection.queries) - before
+    return {'best': min(times), 'mean': sum(times) / len(times),
+            'queries': queries}
+
+def benchmark_dataset(calendar, year, month, iterations):
+    """
+    Time fetching, bucketing and rendering ``calendar``'s month.
+    """
+    from models import GenericListCalendar, get_item_date
+    slug = calendar.slug
+    objects = calendar.get_objects_for_date(year, month)
+    dicts = [{'date': get_item_date(obj), 'object': obj} for obj in objects]
+    stages = SortedDict()
+    stages['fetch'] = time_stage(
+            lambda: calendar.get_objects_for_date(year, month), iterations)
+    stages['bucket_list'] = time_stage(
+            lambda: ListCalendar(dicts, year, month), iterations)
+    stages['bucket_generic'] = time_stage(
+            lambda: GenericListCalendar(objects, year, month), iterations)
+    for name, compiled in (('render', False), ('render_compiled', True)):
+        stages[name] = time_stage(lambda cal: cal.formatmonth(slug, year, month),
+                iterations, lambda: GenericListCalendar(objects, year, month,
+                    compiled=compiled))
+    return {'items': len(objects),
+            'content_types': len(calendar.get_date_fields()),
+            'stages': stages}
+
+def benchmark_pipeline(datasets=None, year=2009, month=1, per_day=5,
+        iterations=10):
+    """
+    Time each stage of rendering a calendar month for each of the
+    synthetic ``datasets`` (names from :data:`DATASETS`; all of them by
+    default). A test database is created for the run, and destroyed
+    afterwards.
+
+    :returns: A dict describing the run, with the ``best`` and ``mean``
+        seconds and the ``queries`` of each stage of each dataset.
+    :rtype: dict.
+    """
+    if datasets is None:
+        datasets = DATASETS.keys()
+    benchmark_models = make_models(max([DATASETS[name]['types']
+        for name in datasets]))
+    old_name = connection.creation.create_test_db(verbosity=0)
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        results = SortedDict()
+        for name in datasets:
+            spec = DATASETS[name]
+            calendar = populate('benchmark-%s' % name,
+                    benchmark_models[:spec['types']], spec['layout'], year,
+                    month, per_day)
+            results[name] = benchmark_dataset(calendar, year, month,
+                    iterations)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    return {'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor, 'year': year, 'month': month,
+            'per_day': per_day, 'iterations': iterations,
+            'datasets': results}
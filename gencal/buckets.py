@@ -0,0 +1,142 @@
+"""
+Compact storage for the items shown on each day of a calendar grid.
+"""
+from array import array
+from bisect import bisect_left
+import datetime
+
+class DayBuckets(object):
+    """
+    Holds the items for a contiguous run of days, addressed by their
+    offset from the first day.
+
+    Items are stored once, in the order they were added, and each
+    (day offset, item index) entry goes into a pair of flat arrays. The
+    per-day grouping is only built, by sorting the entries, when a day is
+    read after items were added.
+
+    :arg start: The first day held.
+    :type start: date.
+    :arg days: The number of days held.
+    :type days: int.
+    """
+    __slots__ = ('start', 'start_ordinal', 'days', 'items', 'entry_days',
+            'entry_items', '_starts', '_order')
+
+    def __init__(self, start, days):
+        self.start = start
+        self.start_ordinal = start.toordinal()
+        self.days = days
+        self.items = []
+        self.entry_days = array('H')
+        self.entry_items = array('i')
+        self._starts = None
+        self._order = None
+
+    def offset(self, date):
+        """
+        Return the offset of ``date``, or ``None`` if it isn't held.
+        """
+        offset = date.toordinal() - self.start_ordinal
+        if 0 <= offset < self.days:
+            return offset
+        return None
+
+    def date(self, offset):
+        return self.start + datetime.timedelta(days=offset)
+
+    def add(self, item, offsets):
+        """
+        Add ``item`` to each of the days in ``offsets``.
+        """
+        index = len(self.items)
+        self.items.append(item)
+        for offset in offsets:
+            self.entry_days.append(offset)
+            self.entry_items.append(index)
+        self._starts = None
+
+    def extend(self, items, offsets):
+        """
+        Add each of ``items`` to the single day at the matching position
+        in ``offsets``.
+        """
+        base = len(self.items)
+        self.items.extend(items)
+        # Concatenating arrays is much cheaper than array.extend(list).
+        self.entry_items += array('i', range(base, len(self.items)))
+        self.entry_days += array('H', offsets)
+        self._starts = None
+
+    def _index(self):
+        if self._starts is None:
+            entry_days, entry_items = self.entry_days, self.entry_items
+            days = entry_days.tolist()
+            if days == sorted(days):
+                # Added in date order, which is the usual case.
+                order = array('i', entry_items)
+            else:
+                # A stable sort keeps each day's items in the order they
+                # were added.
+                entries = sorted(range(len(days)), key=days.__getitem__)
+                days = [days[e] for e in entries]
+                order = array('i', [entry_items[e] for e in entries])
+            self._order = order
+            self._starts = array('i', [bisect_left(days, offset)
+                for offset in range(self.days + 1)])
+        return self._starts, self._order
+
+    def count(self, offset):
+        starts, order = self._index()
+        return starts[offset + 1] - starts[offset]
+
+    def get(self, offset):
+        """
+        Return a list of the items on the day at ``offset``, in the order
+        they were added.
+        """
+        starts, order = self._index()
+        items = self.items
+        return [items[i] for i in order[starts[offset]:starts[offset + 1]]]
+
+class MonthDictView(object):
+    """
+    A read-only, dict-like view of :class:`DayBuckets` keyed by date, kept
+    for code that reads ``ListCalendar.month_dict``. Lists are built when
+    a day is looked up; appending to them doesn't change the calendar (use
+    :meth:`ListCalendar.add_item` instead).
+    """
+    __slots__ = ('buckets',)
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def __getitem__(self, date):
+        offset = self.buckets.offset(date)
+        if offset is None:
+            raise KeyError(date)
+        return self.buckets.get(offset)
+
+    def get(self, date, default=None):
+        try:
+            return self[date]
+        except KeyError:
+            return default
+
+    def __contains__(self, date):
+        return self.buckets.offset(date) is not None
+
+    def __len__(self):
+        return self.buckets.days
+
+    def keys(self):
+        return [self.buckets.date(i) for i in range(self.buckets.days)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        return [self.buckets.get(i) for i in range(self.buckets.days)]
+
+    def items(self):
+        return zip(self.keys(), self.values())
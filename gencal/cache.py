@@ -0,0 +1,235 @@
+"""
+Opt-in caching of rendered calendar months.
+
+When ``CALENDAR_CACHE`` is true, the HTML produced by
+:meth:`ListCalendar.formatmonth` through the ``{% gencal %}`` tag is
+stored in Django's cache, keyed on the calendar slug, year, month, first
+weekday, calendar class, time zone and filters. Saving or deleting an object of one of a
+:class:`GenericCalendar`'s content types invalidates only the month(s)
+showing any day from its start to its end (see
+:func:`gencal.models.get_end_field`), before and after the change.
+
+Each (slug, year, month) has a version token stored alongside the
+rendered months; invalidating a month just throws its token away, which
+orphans every cached variant of that month at once.
+"""
+import datetime
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from grid import add_months, months_showing
+
+CONTENT_TYPES_KEY = 'gencal:content_types'
+
+stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+def is_enabled():
+    return getattr(settings, 'CALENDAR_CACHE', False)
+
+def get_timeout():
+    return getattr(settings, 'CALENDAR_CACHE_TIMEOUT', None)
+
+def get_stats():
+    """
+    Return a copy of this process' hit/miss/invalidation counters.
+    """
+    return dict(stats)
+
+def reset_stats():
+    for key in stats:
+        stats[key] = 0
+
+def _version_key(slug, year, month):
+    return 'gencal:version:%s:%d:%02d' % (slug, year, month)
+
+def get_version(slug, year, month):
+    """
+    Return the current version token for a calendar month, creating one
+    if there isn't one yet.
+    """
+    key = _version_key(slug, year, month)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex[:12]
+        if not cache.add(key, version, get_timeout()):
+            version = cache.get(key, version)
+    return version
+
+def month_key(slug, year, month, firstweekday, calendar_class, tz_name='',
+        filter_key=''):
+    """
+    Return the cache key for a rendered month.
+
+    :arg slug: Slug of the calendar being rendered.
+    :type slug: str.
+    :arg calendar_class: The :class:`ListCalendar` subclass doing the rendering.
+    :type calendar_class: class.
+    :keyword tz_name: Name of the time zone the month is laid out in.
+    :type tz_name: str.
+    :keyword filter_key: :func:`gencal.filters.get_filter_key` of the
+        filters limiting the month's objects.
+    :type filter_key: str.
+    """
+    class_path = '%s.%s' % (calendar_class.__module__, calendar_class.__name__)
+    return 'gencal:month:%s:%d:%02d:%d:%s:%s:%s:%s' % (slug, year, month,
+            firstweekday, class_path, tz_name, filter_key,
+            get_version(slug, year, month))
+
+def get_rendered(key):
+    html = cache.get(key)
+    if html is None:
+        stats['misses'] += 1
+    else:
+        stats['hits'] += 1
+    return html
+
+def set_rendered(key, html):
+    cache.set(key, html, get_timeout())
+
+def invalidate_month(slug, year, month):
+    """
+    Drop every cached rendering of the given calendar month.
+    """
+    cache.delete(_version_key(slug, year, month))
+    stats['invalidations'] += 1
+
+def get_calendar_slugs():
+    """
+    Return a dict mapping content type ids to the slugs of the calendars
+    that include them.
+    """
+    from models import GenericCalendar
+    mapping = cache.get(CONTENT_TYPES_KEY)
+    if mapping is None:
+        mapping = {}
+        through = GenericCalendar.content_types.through
+        for ct_id, slug in through.objects.values_list('contenttype',
+                'genericcalendar__slug'):
+            mapping.setdefault(ct_id, []).append(slug)
+        cache.set(CONTENT_TYPES_KEY, mapping, get_timeout())
+    return mapping
+
+def get_slugs_and_field(sender):
+    """
+    Return the slugs of the calendars showing ``sender``'s objects and the
+    name of its date field, or ``(None, None)`` if no calendar does.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from models import get_date_attr_name
+    ct = ContentType.objects.get_for_model(sender)
+    slugs = get_calendar_slugs().get(ct.pk)
+    if not slugs:
+        return None, None
+    return slugs, get_date_attr_name(sender)
+
+def as_date(value):
+    if hasattr(value, 'date'):
+        return value.date()
+    return value
+
+def get_end_attr_name(sender):
+    from models import get_end_field
+    field = get_end_field(sender)
+    return field and field.attname
+
+def remember_old_date(sender, instance, **kwargs):
+    """
+    ``pre_save`` handler that records the date (and end) an object had
+    before it was changed, so the months it moved out of are invalidated
+    as well.
+    """
+    from metadata import get_calendar_models
+    if instance.pk is None:
+        return
+    # Connected for every model, so others are let go without a query.
+    if (sender._meta.concrete_model or sender) not in get_calendar_models():
+        return
+    slugs, field = get_slugs_and_field(sender)
+    if not field:
+        return
+    end = get_end_attr_name(sender)
+    old = sender._default_manager.filter(pk=instance.pk).values_list(
+            *[name for name in (field, end) if name])
+    if not old:
+        instance._gencal_old_span = None
+        return
+    instance._gencal_old_span = (old[0][0], end and old[0][1])
+
+def months_spanned(start, end=None):
+    """
+    Return the set of ``(year, month)`` pairs whose grid shows any day
+    from ``start`` to ``end`` (dates or datetimes). Aware datetimes may
+    fall on the day before or after in the time zone a month is laid
+    out in, so those days count too.
+    """
+    if not start:
+        return set()
+    if not end:
+        end = start
+    first, last = as_date(start), as_date(end)
+    if getattr(start, 'tzinfo', None) is not None:
+        first -= datetime.timedelta(days=1)
+    if getattr(end, 'tzinfo', None) is not None:
+        last += datetime.timedelta(days=1)
+    last = max(first, last)
+    months = set(months_showing(first)) | set(months_showing(last))
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        months.add((year, month))
+        year, month = add_months(year, month, 1)
+    return months
+
+def invalidate_for_instance(sender, instance, **kwargs):
+    """
+    ``post_save``/``post_delete`` handler that invalidates the cached
+    months an object appears, or appeared, in.
+    """
+    slugs, field = get_slugs_and_field(sender)
+    if not field:
+        return
+    end = get_end_attr_name(sender)
+    months = months_spanned(getattr(instance, field, None),
+            end and getattr(instance, end, None))
+    old_span = getattr(instance, '_gencal_old_span', None)
+    if old_span:
+        months.update(months_spanned(*old_span))
+    for slug in slugs:
+        for year, month in months:
+            invalidate_month(slug, year, month)
+
+def invalidate_content_types(sender, **kwargs):
+    """
+    Forget the content type to calendar mapping when a calendar changes.
+    """
+    cache.delete(CONTENT_TYPES_KEY)
+
+def connect_tracking_signals():
+    """
+    Hook up the handlers shared by the cache and :mod:`gencal.rollups`:
+    remembering objects' old dates and forgetting the content type
+    mapping when a calendar changes.
+    """
+    from models import GenericCalendar
+    pre_save.connect(remember_old_date, dispatch_uid='gencal.cache.pre_save')
+    post_save.connect(invalidate_content_types, sender=GenericCalendar,
+            dispatch_uid='gencal.cache.calendar_save')
+    post_delete.connect(invalidate_content_types, sender=GenericCalendar,
+            dispatch_uid='gencal.cache.calendar_delete')
+    m2m_changed.connect(invalidate_content_types,
+            sender=GenericCalendar.content_types.through,
+            dispatch_uid='gencal.cache.calendar_content_types')
+
+def connect_signals():
+    """
+    Hook the invalidation handlers up, if caching is enabled.
+    """
+    if not is_enabled():
+        return
+    connect_tracking_signals()
+    post_save.connect(invalidate_for_instance,
+            dispatch_uid='gencal.cache.post_save')
+    post_delete.connect(invalidate_for_instance,
+            dispatch_uid='gencal.cache.post_delete')
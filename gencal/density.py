@@ -0,0 +1,64 @@
+"""
+Per-day object counts for density ("heatmap") calendars.
+
+:func:`count_by_day` has the database group a content type's objects by
+day, so a year of a busy calendar costs one small query per content type
+rather than loading every object. Days of DateTimeFields are truncated
+by the database, so like the rollups they're counted in the database's
+time zone (UTC when ``USE_TZ`` is on).
+"""
+from __future__ import with_statement
+
+import datetime
+
+from django.db import connection, models
+from django.db.models import Count
+
+from instrumentation import measure
+
+def as_date(value):
+    """
+    Return the day of a truncated date from the database, which some
+    backends (SQLite) return as a string.
+    """
+    if isinstance(value, basestring):
+        return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+def count_by_day(queryset, field):
+    """
+    Return a dict mapping each day to the number of objects of
+    ``queryset`` whose ``field`` falls on it, with one ``GROUP BY`` query.
+    """
+    if isinstance(field, models.DateTimeField):
+        qn = connection.ops.quote_name
+        column = '%s.%s' % (qn(queryset.model._meta.db_table), qn(field.column))
+        queryset = queryset.extra(select={
+            'gencal_day': connection.ops.date_trunc_sql('day', column)})
+        name = 'gencal_day'
+    else:
+        name = field.name
+    rows = queryset.values(name).annotate(gencal_count=Count('pk')).order_by()
+    counts = {}
+    for row in rows:
+        day = as_date(row[name])
+        counts[day] = counts.get(day, 0) + row['gencal_count']
+    return counts
+
+def count_range(calendar, start, end, filters=()):
+    """
+    Return a dict mapping each day in the half-open range ``[start, end)``
+    that has objects of ``calendar`` (limited by ``filters``) to their
+    number, summed across content types.
+    """
+    from models import get_model_label
+    totals = {}
+    for model, field, queryset in calendar.get_querysets_for_range(start, end,
+            filters=filters):
+        with measure('query', model=get_model_label(model)) as counts:
+            for day, count in count_by_day(queryset, field).iteritems():
+                totals[day] = totals.get(day, 0) + count
+            counts['items'] = len(totals)
+    return totals
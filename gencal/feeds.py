@@ -0,0 +1,136 @@
+"""
+Machine-readable (JSON and iCalendar) versions of a calendar's objects.
+
+Objects are serialized straight from :meth:`GenericCalendar.get_objects_for_range`
+without any template rendering. :func:`get_feed_state` summarizes a range
+with one aggregate query per content type, so feed views can answer
+conditional requests without loading any objects.
+"""
+import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.utils import simplejson, timezone
+from django.utils.encoding import force_unicode
+from django.utils.hashcompat import md5_constructor
+
+from models import CalendarRow, get_item_date, get_model_label, get_modified_field
+
+def get_feed_state(calendar, start, end):
+    """
+    Return an ``(etag, last_modified)`` tuple describing the objects of
+    ``calendar`` in ``[start, end)``.
+
+    The ETag covers each content type's object count, largest primary key
+    and newest modification time (see
+    :func:`gencal.models.get_modified_field`), so it changes when objects
+    are added, removed or, for models with a modification field, edited.
+    ``last_modified`` is the newest modification time as an aware UTC
+    datetime (see :func:`as_utc`), or ``None`` if no content type records
+    one.
+    """
+    parts = [start.isoformat(), end.isoformat()]
+    last_modified = None
+    for model, field, queryset in calendar.get_querysets_for_range(start, end):
+        aggregates = {'count': Count('pk'), 'last_pk': Max('pk')}
+        modified_field = get_modified_field(model)
+        if modified_field:
+            aggregates['modified'] = Max(modified_field.name)
+        result = queryset.aggregate(**aggregates)
+        modified = result.get('modified')
+        parts.append('%s:%s:%s:%s' % (get_model_label(model), result['count'],
+            result['last_pk'], modified))
+        if modified:
+            modified = as_utc(modified)
+            if last_modified is None or modified > last_modified:
+                last_modified = modified
+    return md5_constructor('|'.join(parts)).hexdigest(), last_modified
+
+def as_utc(value):
+    """
+    Return the date or datetime ``value`` as an aware datetime in UTC.
+    Naive values (as stored without ``USE_TZ``) are taken to be in the
+    default time zone, and dates to start at midnight.
+    """
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return value.astimezone(timezone.utc)
+
+def serialize_item(item):
+    """
+    Return a dict describing a calendar object (or :class:`CalendarRow`).
+    """
+    if isinstance(item, CalendarRow):
+        model = item.model
+    else:
+        model = item.__class__
+    url = None
+    if hasattr(item, 'get_absolute_url'):
+        url = item.get_absolute_url()
+    return {'id': item.pk, 'type': model and get_model_label(model),
+            'date': get_item_date(item), 'title': force_unicode(item),
+            'url': url}
+
+def to_json(calendar, start, end, items):
+    """
+    Return the objects in ``items`` as a JSON document.
+    """
+    return simplejson.dumps({'calendar': calendar.slug, 'name': calendar.name,
+        'start': start, 'end': end,
+        'objects': [serialize_item(item) for item in items]},
+        cls=DjangoJSONEncoder)
+
+def _ics_escape(value):
+    return force_unicode(value).replace('\\', '\\\\').replace(';', '\\;'
+            ).replace(',', '\\,').replace('\n', '\\n')
+
+def _ics_fold(line):
+    # Lines longer than 75 octets are continued on lines starting with a space.
+    line = line.encode('utf-8')
+    folded = []
+    while len(line) > 75:
+        cut = 75
+        # Don't split a multi-byte character.
+        while cut and (ord(line[cut]) & 0xC0) == 0x80:
+            cut -= 1
+        folded.append(line[:cut])
+        line = ' ' + line[cut:]
+    folded.append(line)
+    return '\r\n'.join(folded)
+
+def _ics_date(name, value):
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            return '%s:%s' % (name, value.astimezone(timezone.utc).strftime(
+                '%Y%m%dT%H%M%SZ'))
+        return '%s:%s' % (name, value.strftime('%Y%m%dT%H%M%S'))
+    return '%s;VALUE=DATE:%s' % (name, value.strftime('%Y%m%d'))
+
+def to_ics(calendar, items, host, url_prefix=''):
+    """
+    Return the objects in ``items`` as an iCalendar (RFC 5545) document.
+    Dates become all-day events. Aware datetimes are written in UTC, naive
+    ones as floating times.
+
+    :arg host: Domain used to make each event's UID unique.
+    :type host: str.
+    :keyword url_prefix: Prepended to object URLs to make them absolute.
+    :type url_prefix: str.
+    """
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//django-gencal//EN',
+            'X-WR-CALNAME:%s' % _ics_escape(calendar.name)]
+    for item in items:
+        data = serialize_item(item)
+        lines += ['BEGIN:VEVENT',
+                'UID:%s-%s@%s' % (data['type'], data['id'], host),
+                'DTSTAMP:%s' % stamp,
+                _ics_date('DTSTART', data['date']),
+                'SUMMARY:%s' % _ics_escape(data['title'])]
+        if data['url']:
+            lines.append('URL:%s%s' % (url_prefix, data['url']))
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join([_ics_fold(line) for line in lines]) + '\r\n'
@@ -0,0 +1,171 @@
+"""
+Running a calendar's per-content-type queries concurrently.
+
+Each query runs in its own thread (with its own database connection), at
+most ``CALENDAR_FETCH_CONCURRENCY`` at a time. A query that hasn't
+finished ``CALENDAR_FETCH_TIMEOUT`` seconds after it started running is
+given up on: its content type shows no objects rather than failing the
+page. Its query is cancelled where the database driver supports it
+(psycopg2's ``cancel()``, SQLite's ``interrupt()``), its slot goes to the
+next query, and its thread closes its connections as soon as the query
+returns.
+
+Every thread opens a new database connection, so this doesn't work with
+an in-memory SQLite database.
+"""
+from __future__ import with_statement
+
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+def get_concurrency():
+    return getattr(settings, 'CALENDAR_FETCH_CONCURRENCY', 4)
+
+def get_timeout(label):
+    """
+    Return the timeout, in seconds, for the queries of the model
+    ``label`` (``"app_label.model"``). ``CALENDAR_FETCH_TIMEOUTS`` maps
+    labels to timeouts; other models use ``CALENDAR_FETCH_TIMEOUT`` (5
+    seconds by default). ``None`` means no timeout.
+    """
+    timeouts = getattr(settings, 'CALENDAR_FETCH_TIMEOUTS', {})
+    if label in timeouts:
+        return timeouts[label]
+    return getattr(settings, 'CALENDAR_FETCH_TIMEOUT', 5)
+
+class FetchThread(threading.Thread):
+    """
+    Calls ``func`` once a slot in ``slots`` is free, keeping its result
+    (or the exception it raised) and closing the thread's database
+    connections afterwards. Its ``deadline`` is ``timeout`` seconds after
+    the call started; ``changed`` is set when the call starts or ends.
+    """
+    def __init__(self, func, timeout, slots, changed):
+        super(FetchThread, self).__init__()
+        self.daemon = True
+        self.func = func
+        self.timeout = timeout
+        self.slots = slots
+        self.changed = changed
+        self.result = None
+        self.exc_info = None
+        self.deadline = None
+        self.databases = []
+        self.abandoned = False
+        self.holding = False
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def run(self):
+        self.slots.acquire()
+        with self.lock:
+            self.holding = True
+        self.databases = connections.all()
+        if self.timeout is not None:
+            self.deadline = time.time() + self.timeout
+        self.changed.set()
+        try:
+            self.result = self.func()
+        except:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.release()
+            for database in self.databases:
+                database.close()
+            self.finished.set()
+            self.changed.set()
+
+    def release(self):
+        with self.lock:
+            if self.holding:
+                self.holding = False
+                self.slots.release()
+
+    def abandon(self):
+        """
+        Give up on the call: free its slot and cancel its queries, if the
+        database driver can.
+        """
+        self.abandoned = True
+        self.release()
+        for database in self.databases:
+            raw = database.connection
+            cancel = getattr(raw, 'cancel', None) or getattr(raw,
+                    'interrupt', None)
+            if cancel is not None:
+                try:
+                    cancel()
+                except Exception:
+                    pass
+
+def wait_for(threads, changed):
+    """
+    Wait until each of ``threads`` has finished or passed its deadline,
+    abandoning the ones that passed it.
+    """
+    pending = list(threads)
+    while pending:
+        changed.clear()
+        now = time.time()
+        deadlines = []
+        for thread in pending[:]:
+            if thread.finished.is_set():
+                pending.remove(thread)
+            elif thread.deadline is None:
+                continue
+            elif thread.deadline <= now:
+                thread.abandon()
+                pending.remove(thread)
+            else:
+                deadlines.append(thread.deadline)
+        if pending:
+            if deadlines:
+                changed.wait(min(deadlines) - now)
+            else:
+                changed.wait()
+
+def fetch_concurrently(funcs, timeouts, concurrency=None):
+    """
+    Call each of ``funcs`` in a thread, running at most ``concurrency`` at
+    once, and return a list of their results in the same order. A call
+    still running ``timeouts[i]`` seconds after it started (not counting
+    the time it waited for a slot) gives ``None`` instead. Exceptions
+    raised by the calls are re-raised.
+
+    Without any timeouts, a concurrency of 1 or only one call simply
+    makes the calls in the current thread.
+
+    :arg funcs: Functions to call, without arguments.
+    :type funcs: list.
+    :arg timeouts: Timeout in seconds (or ``None``) for each function.
+    :type timeouts: list.
+    :keyword concurrency: Defaults to the ``CALENDAR_FETCH_CONCURRENCY``
+        setting.
+    :type concurrency: int.
+    """
+    if concurrency is None:
+        concurrency = get_concurrency()
+    untimed = timeouts.count(None) == len(timeouts)
+    if untimed and (concurrency <= 1 or len(funcs) <= 1):
+        return [func() for func in funcs]
+
+    slots = threading.BoundedSemaphore(max(1, concurrency))
+    changed = threading.Event()
+    threads = [FetchThread(func, timeout, slots, changed)
+            for func, timeout in zip(funcs, timeouts)]
+    for thread in threads:
+        thread.start()
+    wait_for(threads, changed)
+    results = []
+    for thread in threads:
+        if thread.abandoned:
+            results.append(None)
+            continue
+        if thread.exc_info:
+            raise thread.exc_info[0], thread.exc_info[1], thread.exc_info[2]
+        results.append(thread.result)
+    return results
@@ -0,0 +1,143 @@
+"""
+Filtering a calendar's objects with query string parameters.
+
+Each model declares the filters it supports, either with a
+``calendar_filters`` attribute or in the ``CALENDAR_FILTERS`` setting,
+which maps ``"app_label.model"`` to a dict of parameter names and the
+lookups they filter on::
+
+    CALENDAR_FILTERS = {
+        'events.event': {'category': 'category__slug',
+                         'owner': 'owner__username'},
+    }
+
+``?category=music`` then limits the calendar to the events in that
+category. Repeating a parameter matches any of its values
+(``?category=music&category=film``), and different parameters must all
+match. The filters become part of each content type's query. A content
+type that doesn't declare one of the requested filters is left out,
+since none of its objects can match it.
+
+The filters are normalized (see :func:`parse_filters`) so the same
+filters in any order, with duplicates, make the same cache key. Values
+the lookup can't take (``?count=many`` on an integer field) raise
+``Http404``.
+"""
+import hashlib
+import urllib
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import FieldDoesNotExist, OneToOneField
+from django.http import Http404
+
+# Maps model classes to their filter definitions, so each model is only
+# inspected once per process.
+_filter_registry = {}
+
+def get_filter_definitions(cls):
+    """
+    Return the dict of filter names and lookups ``cls`` declares, which
+    is empty if it doesn't declare any.
+    """
+    from models import get_concrete_class, get_model_label
+    cls = get_concrete_class(cls)
+    try:
+        return _filter_registry[cls]
+    except KeyError:
+        pass
+    definitions = getattr(cls, 'calendar_filters', None)
+    if definitions is None:
+        definitions = getattr(settings, 'CALENDAR_FILTERS', {}).get(
+                get_model_label(cls), {})
+    _filter_registry[cls] = definitions
+    return definitions
+
+def get_filter_names(calendar):
+    """
+    Return the set of filter names declared by any of ``calendar``'s
+    models.
+    """
+    names = set()
+    for model, field in calendar.get_date_fields():
+        names.update(get_filter_definitions(model))
+    return names
+
+def parse_filters(calendar, query):
+    """
+    Return the filters ``calendar`` supports that are given in ``query``
+    (a ``QueryDict``), normalized as a sorted tuple of ``(name,
+    values)`` pairs, where ``values`` is a sorted tuple without
+    duplicates. Other parameters are ignored.
+    """
+    filters = []
+    for name in sorted(get_filter_names(calendar)):
+        values = sorted(set([value for value in query.getlist(name) if value]))
+        if values:
+            filters.append((name, tuple(values)))
+    return tuple(filters)
+
+def format_filters(filters):
+    """
+    Return normalized ``filters`` as a query string, without the ``?``.
+    """
+    return urllib.urlencode([(name, value.encode('utf-8'))
+        for name, values in filters for value in values])
+
+def get_filter_key(filters):
+    """
+    Return a short string identifying ``filters`` in cache keys, which is
+    empty when there are none.
+    """
+    if not filters:
+        return ''
+    return hashlib.md5(format_filters(filters)).hexdigest()
+
+def is_multi_valued(model, lookup):
+    """
+    Return whether ``lookup`` on ``model`` follows a to-many relation (a
+    many-to-many field or a reverse foreign key), so an object can match
+    it more than once.
+    """
+    for name in lookup.split('__'):
+        try:
+            field, related_model, direct, m2m = \
+                    model._meta.get_field_by_name(name)
+        except FieldDoesNotExist:
+            # A lookup type such as "iexact" ends the path.
+            return False
+        if m2m or (not direct and
+                not isinstance(field.field, OneToOneField)):
+            return True
+        if not direct:
+            model = field.model
+        elif getattr(field, 'rel', None) is not None:
+            model = field.rel.to
+        else:
+            return False
+    return False
+
+def apply_filters(model, queryset, filters):
+    """
+    Return ``queryset`` (of ``model``) limited by ``filters``, or ``None``
+    if the model doesn't declare one of them. Raises ``Http404`` if a
+    value doesn't suit its lookup.
+    """
+    definitions = get_filter_definitions(model)
+    for name, values in filters:
+        try:
+            lookup = definitions[name]
+        except KeyError:
+            return None
+        try:
+            if len(values) == 1:
+                queryset = queryset.filter(**{lookup: values[0]})
+            else:
+                queryset = queryset.filter(**{'%s__in' % lookup: values})
+                if is_multi_valued(model, lookup):
+                    # Several values across a to-many relation can match
+                    # an object more than once.
+                    queryset = queryset.distinct()
+        except (ValueError, ValidationError):
+            raise Http404('Invalid value for the %s filter.' % name)
+    return queryset
@@ -0,0 +1,198 @@
+"""
+Helpers for working out which dates a month's calendar grid covers.
+
+A month's grid (its weeks of dates) depends only on the year, month and
+first weekday, so grids are worked out once and shared by every calendar
+and thread, in an LRU memo of ``CALENDAR_SKELETON_CACHE_SIZE`` (256)
+entries. :func:`memoize_skeleton` keeps other such pieces there too, like
+rendered week headers, keyed on the ``LC_TIME`` locale as well since it
+decides the day and month names.
+"""
+from __future__ import with_statement
+
+import datetime
+import locale
+import threading
+from calendar import Calendar
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import pytz
+except ImportError:
+    pytz = None
+
+def get_first_weekday():
+    """
+    Return the first day of the week used for calendars, from the
+    ``CALENDAR_FIRST_WEEKDAY`` setting (Sunday by default).
+    """
+    return getattr(settings, 'CALENDAR_FIRST_WEEKDAY', 6)
+
+class LRUCache(object):
+    """
+    A mapping of at most ``maxsize`` entries that drops the least recently
+    used one when full. It can be shared between threads.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_or_create(self, key, create):
+        """
+        Return the value for ``key``, calling ``create()`` (outside the
+        lock) to make it if there isn't one.
+        """
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.entries[key] = value
+                return value
+        value = create()
+        with self.lock:
+            # Another thread may have made it meanwhile; keep the first.
+            value = self.entries.setdefault(key, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+_skeletons = None
+
+def get_skeletons():
+    """
+    Return the shared :class:`LRUCache` of grid skeletons.
+    """
+    global _skeletons
+    if _skeletons is None:
+        _skeletons = LRUCache(getattr(settings,
+            'CALENDAR_SKELETON_CACHE_SIZE', 256))
+    return _skeletons
+
+def memoize_skeleton(key, create):
+    """
+    Return the value kept for ``key`` (a tuple) and the current ``LC_TIME``
+    locale in the shared memo, calling ``create()`` to make it the first
+    time. Only for values that depend on nothing else, and that won't be
+    changed by whoever gets them.
+    """
+    return get_skeletons().get_or_create(
+            key + (locale.setlocale(locale.LC_TIME),), create)
+
+def get_month_grid(year, month, firstweekday=None):
+    """
+    Return a month's grid: a tuple of weeks, each a tuple of ``(date,
+    weekday)`` tuples, including the leading and trailing days of the
+    neighbouring months.
+    """
+    if firstweekday is None:
+        firstweekday = get_first_weekday()
+    return get_skeletons().get_or_create(('grid', year, month, firstweekday),
+            lambda: tuple([tuple([(dt, dt.weekday()) for dt in week])
+                for week in Calendar(firstweekday).monthdatescalendar(year,
+                    month)]))
+
+def get_grid_window(year, month, firstweekday=None, months=1):
+    """
+    Return the half-open ``(start, end)`` date range shown by a month's
+    grid, including the leading and trailing days of the neighbouring
+    months.
+
+    :arg year: Year of the month.
+    :type year: int.
+    :arg month: Month to get the window for.
+    :type month: int.
+    :keyword firstweekday: Defaults to :func:`get_first_weekday`.
+    :type firstweekday: int.
+    :keyword months: Cover the grids of this many consecutive months,
+        starting with ``month``.
+    :type months: int.
+    :rtype: tuple(date, date)
+    """
+    first = get_month_grid(year, month, firstweekday)
+    last = get_month_grid(*add_months(year, month, months - 1) + (firstweekday,))
+    return first[0][0][0], last[-1][-1][0] + datetime.timedelta(days=1)
+
+def get_timezone(tz=None):
+    """
+    Return the time zone calendars are laid out in: ``tz`` (a tzinfo, or
+    a name, which needs pytz) or, by default, the current time zone. With
+    ``USE_TZ`` off, datetimes are naive and this is always ``None``.
+
+    Raises ``ValueError`` for an unknown time zone name.
+    """
+    if not getattr(settings, 'USE_TZ', False):
+        return None
+    if tz is None:
+        return timezone.get_current_timezone()
+    if isinstance(tz, basestring):
+        if pytz is None:
+            raise ValueError("Time zone names need pytz: %s" % tz)
+        try:
+            return pytz.timezone(tz)
+        except pytz.UnknownTimeZoneError:
+            raise ValueError("Unknown time zone: %s" % tz)
+    return tz
+
+def get_timezone_name(tz):
+    """
+    Return a name for ``tz`` suitable for cache keys, or ``''``.
+    """
+    if tz is None:
+        return ''
+    return getattr(tz, 'zone', None) or str(tz)
+
+def get_day_start(date, tz):
+    """
+    Return the aware UTC datetime at which ``date`` starts in ``tz``.
+    """
+    start = datetime.datetime.combine(date, datetime.time())
+    if hasattr(tz, 'localize'):
+        start = tz.localize(start)
+    else:
+        start = start.replace(tzinfo=tz)
+    return start.astimezone(timezone.utc)
+
+def get_day_boundaries(start, days, tz):
+    """
+    Return the naive UTC datetimes at which each of the ``days`` days from
+    ``start`` begins in ``tz``, followed by the end of the last one. An
+    aware datetime falls on day ``bisect_right(boundaries, utc) - 1``,
+    where ``utc`` is it in naive UTC, so a whole grid's items can be
+    bucketed without localizing each one.
+    """
+    return [get_day_start(start + datetime.timedelta(days=offset),
+        tz).replace(tzinfo=None) for offset in range(days + 1)]
+
+def add_months(year, month, months):
+    """
+    Return the ``(year, month)`` that is ``months`` months away from the
+    given one.
+    """
+    index = year * 12 + month - 1 + months
+    return index // 12, index % 12 + 1
+
+def months_showing(date, firstweekday=None):
+    """
+    Return the ``(year, month)`` pairs whose grid shows ``date``, which
+    can include the month before or after its own.
+    """
+    months = []
+    for offset in (-1, 0, 1):
+        year, month = add_months(date.year, date.month, offset)
+        start, end = get_grid_window(year, month, firstweekday)
+        if start <= date < end:
+            months.append((year, month))
+    return months
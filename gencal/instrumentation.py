@@ -0,0 +1,157 @@
+"""
+Optional instrumentation of calendar rendering.
+
+When ``CALENDAR_INSTRUMENTATION`` is true, the phases of a calendar
+render are timed and the ``measured`` signal is sent for each, with:
+
+* ``phase``: ``"query"`` (one per content type fetched), ``"bucket"``
+  (putting the objects on days), ``"render"`` (one per month) or
+  ``"view"`` (the rest of the view).
+* ``duration``: seconds spent in the phase itself, not counting the
+  phases inside it (e.g. a query run by a lazy object list while it's
+  being bucketed).
+* ``data``: a dict with whatever the phase counted: ``queries``,
+  ``items``, ``bytes``, ``model``...
+
+Queries are only counted while a :class:`Collector` is active, since
+counting them needs Django's debug cursor.
+
+The calendar views collect their measurements with a :class:`Collector`,
+keep it in ``request.gencal_metrics`` and, if
+``CALENDAR_INSTRUMENTATION_HEADER`` is true, summarize it in an
+``X-Gencal-Metrics`` response header. When instrumentation is off,
+:func:`measure` costs a settings lookup.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+
+measured = Signal(providing_args=['phase', 'duration', 'data'])
+
+_local = threading.local()
+
+def is_enabled():
+    return getattr(settings, 'CALENDAR_INSTRUMENTATION', False)
+
+def is_header_enabled():
+    return getattr(settings, 'CALENDAR_INSTRUMENTATION_HEADER', False)
+
+class Collector(object):
+    """
+    Keeps every measurement made in a thread while it's active (see
+    :func:`start`).
+    """
+    def __init__(self):
+        self.records = []
+
+    def add(self, phase, duration, data):
+        self.records.append((phase, duration, data))
+
+    def totals(self):
+        """
+        Return a dict mapping each phase to the sums of its durations and
+        counts.
+        """
+        totals = {}
+        for phase, duration, data in self.records:
+            total = totals.setdefault(phase, {'duration': 0.0})
+            total['duration'] += duration
+            for key, value in data.items():
+                if isinstance(value, (int, long)):
+                    total[key] = total.get(key, 0) + value
+        return totals
+
+    def summary(self):
+        """
+        Return the totals as one line of text, such as
+        ``query=3.1ms queries=2 items=40; render=8.0ms bytes=12250``.
+        """
+        parts = []
+        for phase, total in sorted(self.totals().items()):
+            counts = ['%s=%d' % (key, value) for key, value
+                    in sorted(total.items()) if key != 'duration']
+            parts.append(' '.join(['%s=%.1fms' % (phase,
+                total['duration'] * 1000)] + counts))
+        return '; '.join(parts)
+
+def start():
+    """
+    Start collecting this thread's measurements, returning the new
+    :class:`Collector`, or ``None`` if one is already active (the outer
+    one keeps collecting).
+    """
+    if getattr(_local, 'collector', None) is not None:
+        return None
+    collector = _local.collector = Collector()
+    _local.debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    return collector
+
+def stop():
+    """
+    Stop collecting and return the :class:`Collector`.
+    """
+    collector = getattr(_local, 'collector', None)
+    if collector is not None:
+        _local.collector = None
+        connection.use_debug_cursor = _local.debug_cursor
+    return collector
+
+class Measurement(object):
+    """
+    Context manager timing one phase; ``with`` gives the dict of counts
+    to fill in.
+    """
+    def __init__(self, phase, data):
+        self.phase = phase
+        self.data = data
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        # Time and queries spent in the phases inside this one.
+        stack.append([0.0, 0])
+        self.collector = getattr(_local, 'collector', None)
+        self.queries = len(connection.queries)
+        self.started = time.time()
+        return self.data
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.time() - self.started
+        queries = len(connection.queries) - self.queries
+        stack = _local.stack
+        inner_time, inner_queries = stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+            stack[-1][1] += queries
+        if self.collector is not None:
+            self.data['queries'] = queries - inner_queries
+            self.collector.add(self.phase, elapsed - inner_time, self.data)
+        measured.send(sender=None, phase=self.phase,
+                duration=elapsed - inner_time, data=self.data)
+
+class NullMeasurement(object):
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_measurement = NullMeasurement()
+
+def measure(phase, **data):
+    """
+    Return a context manager timing ``phase``, or one that does nothing
+    if instrumentation is off::
+
+        with measure('render') as counts:
+            html = render()
+            counts['bytes'] = len(html)
+    """
+    if not is_enabled():
+        return _null_measurement
+    return Measurement(phase, data)
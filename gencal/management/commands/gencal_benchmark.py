@@ -0,0 +1,66 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+
+from gencal.benchmarks import (DATASETS, benchmark_bucketing,
+        benchmark_formatmonth, benchmark_pipeline)
+
+class Command(BaseCommand):
+    help = "Times the month rendering paths and day bucketing structures."
+    option_list = BaseCommand.option_list + (
+        make_option('--iterations', type='int', dest='iterations', default=50,
+            help='Number of months to render with each path.'),
+        make_option('--per-day', type='int', dest='per_day', default=2,
+            help='Number of items placed on each day of the month.'),
+        make_option('--pipeline', action='store_true', dest='pipeline',
+            default=False, help='Also time fetching, bucketing and rendering '
+                'synthetic calendars in a test database.'),
+        make_option('--datasets', dest='datasets', default=None,
+            help='Comma separated datasets for --pipeline (default: %s).' %
+                ','.join(DATASETS.keys())),
+        make_option('--json', action='store_true', dest='json', default=False,
+            help='Print the results as JSON.'),
+    )
+
+    def handle(self, *args, **options):
+        results = {}
+        results['formatmonth'] = benchmark_formatmonth(
+                iterations=options['iterations'], per_day=options['per_day'])
+        results['bucketing'] = benchmark_bucketing(
+                iterations=options['iterations'] * 20,
+                per_day=options['per_day'])
+        if options['pipeline']:
+            datasets = None
+            if options['datasets']:
+                datasets = options['datasets'].split(',')
+                unknown = [name for name in datasets if name not in DATASETS]
+                if unknown:
+                    raise CommandError("Unknown dataset: %s" % ', '.join(unknown))
+            results['pipeline'] = benchmark_pipeline(datasets,
+                    per_day=options['per_day'],
+                    iterations=max(1, options['iterations'] // 5))
+
+        if options['json']:
+            self.stdout.write(simplejson.dumps(results, indent=2) + '\n')
+            return
+
+        result = results['formatmonth']
+        self.stdout.write("chained:  %.4fs\n" % result['chained'])
+        self.stdout.write("compiled: %.4fs\n" % result['compiled'])
+        self.stdout.write("speedup:  %.2fx\n" % result['speedup'])
+
+        result = results['bucketing']
+        self.stdout.write("SortedDict buckets: %.4fs, %d bytes\n" % (
+            result['sorteddict'], result['sorteddict_bytes']))
+        self.stdout.write("DayBuckets:         %.4fs, %d bytes\n" % (
+            result['buckets'], result['buckets_bytes']))
+
+        if 'pipeline' in results:
+            for name, result in results['pipeline']['datasets'].items():
+                self.stdout.write("%s (%d items, %d content types):\n" % (
+                    name, result['items'], result['content_types']))
+                for stage, timing in result['stages'].items():
+                    self.stdout.write("  %-16s %.5fs best, %.5fs mean, "
+                            "%d queries\n" % (stage, timing['best'],
+                                timing['mean'], timing['queries']))
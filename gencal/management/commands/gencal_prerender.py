@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gencal import cache, prerender
+from gencal.models import GenericCalendar
+
+class Command(BaseCommand):
+    args = '[calendar_slug ...]'
+    help = ("Renders the months around the current one of the given "
+            "calendars (or all of them) into the cache.")
+    option_list = BaseCommand.option_list + (
+        make_option('--before', type='int', dest='before', default=None,
+            help='Number of months before the current one to render.'),
+        make_option('--after', type='int', dest='after', default=None,
+            help='Number of months after the current one to render.'),
+        make_option('--processes', type='int', dest='processes', default=None,
+            help='Number of worker processes (defaults to the number of CPUs).'),
+        make_option('--force', action='store_true', dest='force', default=False,
+            help='Render months that are already cached again.'),
+    )
+
+    def handle(self, *args, **options):
+        if not cache.is_enabled():
+            raise CommandError("CALENDAR_CACHE is not enabled.")
+        slugs = None
+        if args:
+            slugs = list(args)
+            found = GenericCalendar.objects.filter(slug__in=slugs).count()
+            if found != len(set(slugs)):
+                raise CommandError("Unknown calendar slug in: %s" % ', '.join(args))
+        results = prerender.prerender(slugs, before=options['before'],
+                after=options['after'], processes=options['processes'],
+                force=options['force'])
+        for slug, year, month, rendered in results:
+            self.stdout.write("%s %d/%02d: %s\n" % (slug, year, month,
+                rendered and 'rendered' or 'already cached'))
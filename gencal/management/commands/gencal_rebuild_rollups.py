@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gencal import rollups
+from gencal.models import GenericCalendar
+
+class Command(BaseCommand):
+    args = '[calendar_slug ...]'
+    help = "Rebuilds the daily count rollups of the given calendars (or all of them)."
+
+    def handle(self, *args, **options):
+        calendars = GenericCalendar.objects.all()
+        if args:
+            calendars = calendars.filter(slug__in=args)
+            if len(calendars) != len(set(args)):
+                raise CommandError("Unknown calendar slug in: %s" % ', '.join(args))
+        for calendar in calendars:
+            rollups.rebuild(calendar)
+            self.stdout.write("Rebuilt %s (%d days)\n" % (calendar.slug,
+                calendar.daily_counts.count()))
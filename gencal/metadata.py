@@ -0,0 +1,144 @@
+"""
+Cached calendar metadata.
+
+Looking a calendar up by slug and working out its models and date fields
+costs a query for the calendar and another for its content types, on
+every request, for data that rarely changes. :func:`get_calendar`
+answers from two layers instead:
+
+* the shared cache holds every calendar's id, name, slug and content
+  type ids under one key, with a version token. It's rebuilt with two
+  queries when missing.
+* each process keeps the models and date fields resolved from that, for
+  as long as the shared version doesn't change.
+
+Saving or deleting a calendar, or changing its content types, deletes
+the shared entry, which every process notices on its next lookup.
+"""
+import threading
+import uuid
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from cache import get_timeout
+
+METADATA_KEY = 'gencal:metadata'
+
+_local = {'version': None, 'date_fields': {}, 'models': None}
+_lock = threading.Lock()
+
+def build_metadata():
+    """
+    Return the shared metadata: ``{'version': token, 'calendars': {slug:
+    (id, name, content type ids)}}``, read with two queries.
+    """
+    from models import GenericCalendar
+    calendars = {}
+    for calendar in GenericCalendar.objects.prefetch_related('content_types'):
+        calendars[calendar.slug] = (calendar.pk, calendar.name,
+                [ct.pk for ct in calendar.content_types.all()])
+    return {'version': uuid.uuid4().hex[:12], 'calendars': calendars}
+
+def get_metadata():
+    """
+    Return the shared metadata from the cache, building and storing it if
+    it isn't there.
+    """
+    metadata = cache.get(METADATA_KEY)
+    if metadata is None:
+        metadata = build_metadata()
+        cache.set(METADATA_KEY, metadata, get_timeout())
+    return metadata
+
+def get_date_fields(content_type_ids):
+    """
+    Return the ``(model, date_field)`` tuples for ``content_type_ids``,
+    skipping models without a date field, as
+    :meth:`GenericCalendar.get_date_fields` does. Content types that no
+    longer exist, or whose model isn't installed, are skipped too.
+    """
+    from models import get_date_field
+    date_fields = []
+    for ct_id in content_type_ids:
+        try:
+            model = ContentType.objects.get_for_id(ct_id).model_class()
+        except (ContentType.DoesNotExist, AttributeError):
+            # Django 1.4's get_for_id raises AttributeError while caching
+            # a content type whose model isn't installed.
+            continue
+        if model is None:
+            continue
+        field = get_date_field(model)
+        if field:
+            date_fields.append((model, field))
+    return date_fields
+
+def _check_version(metadata):
+    # Called with _lock held.
+    if _local['version'] != metadata['version']:
+        _local['version'] = metadata['version']
+        _local['date_fields'] = {}
+        _local['models'] = None
+
+def get_calendar_models():
+    """
+    Return the set of models (with a date field) shown by any calendar,
+    worked out once per version of the shared metadata. Checking a model
+    against it costs no query.
+    """
+    metadata = get_metadata()
+    with _lock:
+        _check_version(metadata)
+        models = _local['models']
+        if models is None:
+            content_type_ids = set()
+            for pk, name, ids in metadata['calendars'].values():
+                content_type_ids.update(ids)
+            models = _local['models'] = frozenset([model for model, field
+                in get_date_fields(content_type_ids)])
+    return models
+
+def get_calendar(slug):
+    """
+    Return the :class:`GenericCalendar` ``slug`` with its date fields
+    already worked out, usually without a query. The instance isn't read
+    from the database, so only its id, name and slug are set. Raises
+    ``GenericCalendar.DoesNotExist`` for unknown slugs.
+    """
+    from models import GenericCalendar
+    metadata = get_metadata()
+    try:
+        pk, name, content_type_ids = metadata['calendars'][slug]
+    except KeyError:
+        raise GenericCalendar.DoesNotExist("No calendar with slug %r." % slug)
+    with _lock:
+        _check_version(metadata)
+        date_fields = _local['date_fields'].get(slug)
+        if date_fields is None:
+            date_fields = _local['date_fields'][slug] = get_date_fields(
+                    content_type_ids)
+    calendar = GenericCalendar(pk=pk, name=name, slug=slug)
+    calendar._date_fields = date_fields
+    return calendar
+
+def invalidate(sender=None, **kwargs):
+    """
+    Forget the metadata of every calendar, here and in the shared cache.
+    """
+    cache.delete(METADATA_KEY)
+    with _lock:
+        _local['version'] = None
+        _local['date_fields'] = {}
+        _local['models'] = None
+
+def connect_signals():
+    from models import GenericCalendar
+    post_save.connect(invalidate, sender=GenericCalendar,
+            dispatch_uid='gencal.metadata.calendar_save')
+    post_delete.connect(invalidate, sender=GenericCalendar,
+            dispatch_uid='gencal.metadata.calendar_delete')
+    m2m_changed.connect(invalidate,
+            sender=GenericCalendar.content_types.through,
+            dispatch_uid='gencal.metadata.calendar_content_types')
@@ -1,10 +1,19 @@
+from __future__ import with_statement
+
 import datetime
-from django.core.exceptions import FieldError
+from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
-from django.template.loader import render_to_string
 
-from templatetags.gencal import ListCalendar
+import cache
+import density
+import fetch
+import filters as gencal_filters
+import metadata
+from instrumentation import measure
+import rollups
+from grid import get_day_start, get_grid_window, get_timezone, get_timezone_name
+from templatetags.gencal import ListCalendar, ScheduleCalendar
 #TODO: Would it make more sense for ListCalendar to be defined here?
 
 class GenericCalendar(models.Model):
@@ -22,10 +31,114 @@ class GenericCalendar(models.Model):
     def get_content_types(self):
         return "%s" % ', '.join([t.name for t in self.content_types.all()])
 
-    def get_objects_for_date(self, year=None, month=None, day=None):
+    def get_date_fields(self):
+        """
+        Return a list of ``(model, date_field)`` tuples for this
+        calendar's content types, skipping models without a date field
+        (or that aren't installed any more). The list is worked out once
+        and kept on the instance.
+        """
+        date_fields = getattr(self, '_date_fields', None)
+        if date_fields is None:
+            date_fields = []
+            for ct in self.content_types.all():
+                model = ct.model_class()
+                if model is None:
+                    continue
+                field = get_date_field(model)
+                if field:
+                    date_fields.append((model, field))
+            self._date_fields = date_fields
+        return date_fields
+
+    def get_querysets_for_range(self, start, end, tz=None, filters=()):
+        """
+        Return a list of ``(model, date_field, queryset)`` tuples, one per
+        content type, with each queryset limited to objects whose date
+        falls in the half-open range ``[start, end)``. The range filters
+        can use the date columns' indexes.
+
+        :arg start: First date to include.
+        :type start: date.
+        :arg end: First date not to include.
+        :type end: date.
+        :keyword tz: Time zone (or its name) the dates are in, for models
+            with a DateTimeField when ``USE_TZ`` is on. Defaults to the
+            current time zone.
+        :type tz: tzinfo/str.
+        :keyword filters: Normalized filters from
+            :func:`gencal.filters.parse_filters`. Content types that don't
+            declare all of them are left out.
+        :type filters: tuple.
+        """
+        tz = get_timezone(tz)
+        querysets = []
+        for model, field in self.get_date_fields():
+            lookup_start, lookup_end = start, end
+            if isinstance(field, models.DateTimeField):
+                if tz is None:
+                    lookup_start = datetime.datetime.combine(start, datetime.time())
+                    lookup_end = datetime.datetime.combine(end, datetime.time())
+                else:
+                    lookup_start = get_day_start(start, tz)
+                    lookup_end = get_day_start(end, tz)
+            queryset = model._default_manager.filter(**{
+                '%s__gte' % field.name: lookup_start,
+                '%s__lt' % field.name: lookup_end})
+            if filters:
+                queryset = gencal_filters.apply_filters(model, queryset, filters)
+                if queryset is None:
+                    continue
+            querysets.append((model, field, queryset))
+        return querysets
+
+    def get_objects_for_range(self, start, end, concurrent=False, tz=None,
+            filters=()):
+        """
+        Retrieve the objects of every content type whose date falls in
+        the half-open range ``[start, end)``, using one range query per
+        content type.
+
+        :arg start: First date to include.
+        :type start: date.
+        :arg end: First date not to include.
+        :type end: date.
+        :keyword concurrent: Run the queries concurrently, leaving out the
+            content types whose query times out (see :mod:`gencal.fetch`).
+        :type concurrent: bool.
+        :keyword tz: See :meth:`get_querysets_for_range`.
+        :type tz: tzinfo/str.
+        :keyword filters: See :meth:`get_querysets_for_range`.
+        :type filters: tuple.
+        """
+        querysets = self.get_querysets_for_range(start, end, tz, filters)
+        if concurrent:
+            with measure('query', model='concurrent') as counts:
+                results = fetch.fetch_concurrently(
+                        [make_fetch(queryset, field.name)
+                            for model, field, queryset in querysets],
+                        [fetch.get_timeout(get_model_label(model))
+                            for model, field, queryset in querysets])
+                counts['items'] = sum([len(objects or []) for objects in results])
+        else:
+            results = []
+            for model, field, queryset in querysets:
+                with measure('query', model=get_model_label(model)) as counts:
+                    objects = project_queryset(queryset, field.name)
+                    counts['items'] = len(objects)
+                results.append(objects)
+        obj_list = []
+        for objects in results:
+            if objects:
+                obj_list += objects
+        return obj_list
+
+    def get_objects_for_date(self, year=None, month=None, day=None, months=1,
+            concurrent=False, tz=None, filters=()):
         """
         This method retrieves all of the objects associated with 
-        content_types for the given date.
+        content_types that appear on the given month's calendar grid,
+        including the leading and trailing days of the adjacent months.
 
         #TODO: this currently ignores the day keyword. I'm still
         not sure if/how that should be handled.
@@ -34,48 +147,418 @@ class GenericCalendar(models.Model):
         :type year: int.
         :keyword month: The month to which objects are associated.
         :type: int.
+        :keyword months: Also cover the following ``months - 1`` months.
+        :type months: int.
+        :keyword concurrent: See :meth:`get_objects_for_range`.
+        :type concurrent: bool.
+        :keyword tz: Time zone (or its name) the grid is laid out in. See
+            :meth:`get_querysets_for_range`.
+        :type tz: tzinfo/str.
+        :keyword filters: See :meth:`get_querysets_for_range`.
+        :type filters: tuple.
         """
         today = datetime.date.today()
         if year is None: year = today.year
         if month is None: month = today.month
         #if day is None: day = today.day
+        start, end = get_grid_window(year, month, months=months)
+        return self.get_objects_for_range(start, end, concurrent=concurrent,
+                tz=tz, filters=filters)
+
+    def get_rollups_for_date(self, year=None, month=None, months=1):
+        """
+        Return the :class:`DailyCount` rollups covering the given month's
+        grid (see :meth:`get_objects_for_date`).
+        """
+        today = datetime.date.today()
+        if year is None: year = today.year
+        if month is None: month = today.month
+        start, end = get_grid_window(year, month, months=months)
+        return list(self.daily_counts.filter(date__gte=start, date__lt=end))
+
+    def get_day_counts_for_date(self, year=None, month=None, months=1, top=3,
+            filters=(), tz=None):
+        """
+        Like :meth:`get_rollups_for_date`, but work the rollups out from
+        the objects themselves (see :func:`gencal.rollups.count_range`),
+        keeping the ids of the first ``top`` objects of each day. Unlike
+        stored rollups, these can be limited by ``filters`` and count the
+        days of the time zone ``tz`` (see :meth:`get_querysets_for_range`).
+        """
+        today = datetime.date.today()
+        if year is None: year = today.year
+        if month is None: month = today.month
+        start, end = get_grid_window(year, month, months=months)
+        return rollups.count_range(self, start, end, top, filters, tz)
+
+    def get_density(self, year=None, filters=()):
+        """
+        Return a dict mapping each day on the grid of ``year``'s months
+        that has objects to their number, with one ``GROUP BY`` query per
+        content type (see :mod:`gencal.density`), limited by ``filters``
+        (see :meth:`get_querysets_for_range`).
+        """
+        if year is None: year = datetime.date.today().year
+        start, end = get_grid_window(year, 1, months=12)
+        return density.count_range(self, start, end, filters)
+
+    def get_objects_for_day(self, date, offset=0, tz=None, filters=()):
+        """
+        Return the objects on ``date``, by content type (in id order) and
+        then by date and id, which is the order
+        :class:`RollupListCalendar` shows them in, skipping the first
+        ``offset``. Skipped content types are only counted.
+
+        :arg date: The day to list.
+        :type date: date.
+        :keyword offset: How many objects to skip.
+        :type offset: int.
+        :keyword tz: See :meth:`get_querysets_for_range`.
+        :type tz: tzinfo/str.
+        :keyword filters: See :meth:`get_querysets_for_range`.
+        :type filters: tuple.
+        """
+        querysets = self.get_querysets_for_range(date,
+                date + datetime.timedelta(days=1), tz, filters)
+        querysets.sort(key=lambda (model, field, queryset):
+                ContentType.objects.get_for_model(model).id)
         obj_list = []
-        for ct in self.content_types.all():
-            try:
-                obj_list += list(ct.model_class().objects.filter(date__year=year, date__month=month))
-            except FieldError:
-                field_name = get_date_attr_name(ct.model_class())
-                if field_name:
-                    ykey = "%s__year" % field_name
-                    mkey = "%s__month" % field_name
-                    obj_list += list(ct.model_class().objects.complex_filter({ykey: year, mkey: month}))
-       
+        for model, field, queryset in querysets:
+            if offset:
+                count = queryset.count()
+                if offset >= count:
+                    offset -= count
+                    continue
+            queryset = queryset.order_by(field.name, 'pk')
+            if offset:
+                queryset = queryset[offset:]
+                offset = 0
+            obj_list += project_queryset(queryset, field.name)
         return obj_list
 
-def get_date_attr_name(cls):
+class DailyCount(models.Model):
+    """
+    A rollup of how many objects of one content type fall on one day of a
+    calendar, along with the ids of the first few of them. Maintained by
+    :mod:`gencal.rollups` when the ``CALENDAR_ROLLUPS`` setting is true.
+    """
+    calendar = models.ForeignKey(GenericCalendar, related_name='daily_counts')
+    content_type = models.ForeignKey(ContentType)
+    date = models.DateField(db_index=True)
+    count = models.PositiveIntegerField(default=0)
+    top_ids = models.CommaSeparatedIntegerField(max_length=255, blank=True)
+
+    class Meta:
+        unique_together = (('calendar', 'content_type', 'date'),)
+
+    def __unicode__(self):
+        return u'%s: %s on %s' % (self.calendar, self.count, self.date)
+
+    def get_top_ids(self):
+        return [int(pk) for pk in self.top_ids.split(',') if pk]
+
+class CalendarRow(object):
+    """
+    A lightweight stand-in for a model instance, built from a ``values()``
+    projection. It has just enough for ``gencal/formatday.html``: it
+    renders as its label and has a ``get_absolute_url`` method.
+    """
+    __slots__ = ('pk', 'date', 'label', 'url', 'model')
+
+    def __init__(self, pk, date, label, url=None, model=None):
+        self.pk = pk
+        self.date = date
+        self.label = label
+        self.url = url
+        self.model = model
+
+    def __unicode__(self):
+        return self.label
+
+    def get_absolute_url(self):
+        return self.url
+
+def get_projection(model):
+    """
+    Return the projection declared for ``model`` in the
+    ``CALENDAR_PROJECTIONS`` setting, or ``None``. The setting maps
+    ``"app_label.model"`` to a dict with either:
+
+    * ``only``: a list of field names to load with ``QuerySet.only()``.
+      Full (deferred) model instances are still returned.
+    * ``values``: a list of field names to load with ``QuerySet.values()``.
+      :class:`CalendarRow` objects are returned instead of model
+      instances. ``label`` is a ``%``-format string (or a field name)
+      used as the row's text, and ``url`` is a ``%``-format string, or a
+      callable taking the values dict, used as its URL.
+
+    For example::
+
+        CALENDAR_PROJECTIONS = {
+            'events.event': {'values': ('title', 'slug'),
+                'label': '%(title)s', 'url': '/events/%(slug)s/'},
+        }
+    """
+    projections = getattr(settings, 'CALENDAR_PROJECTIONS', {})
+    return projections.get(get_model_label(model))
+
+def project_queryset(queryset, date_field):
+    """
+    Evaluate ``queryset``, applying its model's projection, if it has one.
+
+    :arg queryset: Objects to load.
+    :type queryset: QuerySet.
+    :arg date_field: Name of the model's calendar date field, which is
+        always loaded.
+    :type date_field: str.
+    """
+    projection = get_projection(queryset.model)
+    if not projection:
+        return list(queryset)
+    if 'only' in projection:
+        return list(queryset.only(date_field, *projection['only']))
+
+    fields = list(projection['values'])
+    label = projection.get('label', fields[0])
+    if '%' not in label:
+        label = '%%(%s)s' % label
+    url = projection.get('url')
+    rows = []
+    for values in queryset.values('pk', date_field, *fields):
+        if callable(url):
+            row_url = url(values)
+        elif url:
+            row_url = url % values
+        else:
+            row_url = None
+        rows.append(CalendarRow(values['pk'], values[date_field],
+            label % values, row_url, queryset.model))
+    return rows
+
+def make_fetch(queryset, date_field):
+    """
+    Return a function evaluating :func:`project_queryset` for
+    ``queryset``, to be run in another thread.
+    """
+    return lambda: project_queryset(queryset, date_field)
+
+class LazyObjectList(object):
+    """
+    A sequence of the objects from :meth:`GenericCalendar.get_objects_for_date`
+    (or, with ``rollups=True``, :meth:`GenericCalendar.get_rollups_for_date`)
+    that isn't fetched until it's first used. This lets the ``{% gencal %}``
+    tag answer from the cache without ever touching the database.
+    With ``concurrent=True`` the objects are fetched concurrently (see
+    :meth:`GenericCalendar.get_objects_for_range`). With a ``day_limit``
+    (and no stored rollups), it holds
+    :meth:`GenericCalendar.get_day_counts_for_date` instead. ``tz`` is
+    the time zone the grid is laid out in, and ``filters`` the normalized
+    filters (see :mod:`gencal.filters`) limiting the objects, which the
+    ``{% gencal %}`` tag includes in its cache key. Stored rollups can't
+    be filtered, so ``rollups`` is ignored when there are filters. They
+    also count days in UTC (or, without ``USE_TZ``, the server's time),
+    so in any other time zone the counts are worked out from the objects
+    instead.
+    """
+    def __init__(self, calendar, year=None, month=None, months=1, rollups=False,
+            concurrent=False, day_limit=None, tz=None, filters=()):
+        self.calendar = calendar
+        self.year = year
+        self.month = month
+        self.months = months
+        self.rollups = rollups
+        self.concurrent = concurrent
+        self.day_limit = day_limit
+        self.tz = tz
+        self.filters = filters
+        self._objects = None
+
+    def _get_objects(self):
+        if self._objects is None:
+            stored = get_timezone_name(self.tz) in ('', 'UTC')
+            if self.rollups and not self.filters and stored:
+                self._objects = self.calendar.get_rollups_for_date(self.year,
+                        self.month, months=self.months)
+            elif self.day_limit is not None or (self.rollups and
+                    not self.filters):
+                self._objects = self.calendar.get_day_counts_for_date(self.year,
+                        self.month, months=self.months,
+                        top=self.day_limit or rollups.get_top_count(),
+                        filters=self.filters, tz=self.tz)
+            else:
+                self._objects = self.calendar.get_objects_for_date(self.year,
+                        self.month, months=self.months,
+                        concurrent=self.concurrent, tz=self.tz,
+                        filters=self.filters)
+        return self._objects
+
+    def __iter__(self):
+        return iter(self._get_objects())
+
+    def __len__(self):
+        return len(self._get_objects())
+
+    def __getitem__(self, index):
+        return self._get_objects()[index]
+
+    def __nonzero__(self):
+        return bool(self._get_objects())
+
+def get_day_limit():
+    return getattr(settings, 'CALENDAR_DAY_LIMIT', None)
+
+# Maps model classes to their calendar date field (or None), so each
+# model is only inspected once per process.
+_date_field_registry = {}
+# Likewise for the field holding when an object was last changed.
+_modified_field_registry = {}
+# And for the field holding when an object ends.
+_end_field_registry = {}
+
+def get_concrete_class(cls):
+    """
+    Return the model a deferred class from ``QuerySet.only()``/``defer()``
+    was made for, or ``cls`` itself.
     """
-    Given a subclass of django.db.models.Model, this function
-    inspects its fields to if it contains a DateField. If so,
-    the field's name is returned. If the class does not contain
-    a DateField, this function looks for a DateTimeField and 
-    returns its name, instead.
+    while getattr(cls, '_deferred', False):
+        cls = cls.__bases__[0]
+    return cls
+
+def get_model_label(cls):
+    """
+    Return ``"app_label.model"`` for a model class, as used by the
+    ``CALENDAR_*`` settings.
+    """
+    opts = get_concrete_class(cls)._meta
+    return '%s.%s' % (opts.app_label, opts.object_name.lower())
+
+def get_item_date(item):
+    """
+    Return the calendar date (or datetime) of a model instance or
+    :class:`CalendarRow`.
+    """
+    if isinstance(item, CalendarRow):
+        return item.date
+    return getattr(item, get_date_attr_name(item.__class__), None)
+
+def get_modified_field(cls):
+    """
+    Return the field recording when instances of a model were last
+    changed, or ``None``. Like :func:`get_date_field`, this can be named
+    with a ``calendar_modified_field`` attribute or the
+    ``CALENDAR_MODIFIED_FIELDS`` setting; otherwise the first
+    DateTimeField with ``auto_now`` is used.
+    """
+    cls = get_concrete_class(cls)
+    try:
+        return _modified_field_registry[cls]
+    except KeyError:
+        pass
+
+    opts = cls._meta
+    name = getattr(cls, 'calendar_modified_field', None)
+    if name is None:
+        name = getattr(settings, 'CALENDAR_MODIFIED_FIELDS', {}).get(
+                get_model_label(cls))
+    if name is not None:
+        field = opts.get_field(name)
+    else:
+        field = None
+        for f in opts.fields:
+            if isinstance(f, models.DateTimeField) and f.auto_now:
+                field = f
+                break
+    _modified_field_registry[cls] = field
+    return field
+
+def get_date_field(cls):
+    """
+    Return the field a model is placed on the calendar by, or ``None``.
+
+    The field can be named explicitly, either with a ``calendar_date_field``
+    attribute on the model or in the ``CALENDAR_DATE_FIELDS`` setting,
+    which maps ``"app_label.model"`` to a field name. Otherwise, the
+    model's first DateField (or subclass) is used and, failing that, its
+    first DateTimeField.
+
+    The result is remembered for the life of the process.
 
-    Caveat: This function will return the FIRST DateField 
-    (or DateTimeField) found, which may not be the correct field.
-    
     :param cls: A Class to inspect for a DateField or DateTimeField.
     :type cls: class.
     """
-    for f in cls._meta.fields:
-        if f.__class__.__name__ == "DateField":
-            return f.name
+    cls = get_concrete_class(cls)
+    try:
+        return _date_field_registry[cls]
+    except KeyError:
+        pass
+
+    opts = cls._meta
+    name = getattr(cls, 'calendar_date_field', None)
+    if name is None:
+        name = getattr(settings, 'CALENDAR_DATE_FIELDS', {}).get(
+                get_model_label(cls))
+    if name is not None:
+        field = opts.get_field(name)
+    else:
+        dates = [f for f in opts.fields if isinstance(f, models.DateField)]
+        field = None
+        for f in dates:
+            if not isinstance(f, models.DateTimeField):
+                field = f
+                break
+        else:
+            # if there's no DateField, try a DateTimeField
+            if dates:
+                field = dates[0]
+    _date_field_registry[cls] = field
+    return field
+
+def get_end_field(cls):
+    """
+    Return the DateTimeField holding when instances of a model end, or
+    ``None``. It's named with a ``calendar_end_field`` attribute on the
+    model or in the ``CALENDAR_END_FIELDS`` setting; there's no default.
+    """
+    cls = get_concrete_class(cls)
+    try:
+        return _end_field_registry[cls]
+    except KeyError:
+        pass
+
+    name = getattr(cls, 'calendar_end_field', None)
+    if name is None:
+        name = getattr(settings, 'CALENDAR_END_FIELDS', {}).get(
+                get_model_label(cls))
+    field = None
+    if name is not None:
+        field = cls._meta.get_field(name)
+    _end_field_registry[cls] = field
+    return field
+
+def get_item_end(item):
+    """
+    Return when a model instance ends (see :func:`get_end_field`), or
+    ``None``.
+    """
+    if isinstance(item, CalendarRow):
+        return None
+    field = get_end_field(item.__class__)
+    if field is None:
+        return None
+    return getattr(item, field.attname)
 
-    # if there's no DateField, try a DateTimeField
-    for f in cls._meta.fields:
-        if f.__class__.__name__ == "DateTimeField":
-            return f.name
+def get_date_attr_name(cls):
+    """
+    Return the name of the field returned by :func:`get_date_field`, or
+    ``None`` if the class doesn't have one.
 
-    return None
+    :param cls: A Class to inspect for a DateField or DateTimeField.
+    :type cls: class.
+    """
+    field = get_date_field(cls)
+    if field is None:
+        return None
+    return field.name
 
 class GenericListCalendar(ListCalendar):
     """
@@ -88,44 +571,171 @@ class GenericListCalendar(ListCalendar):
     :type year: int.
     :keyword month: Month to render.
     :type month: int.
+    :keyword day_limit: Show at most this many objects in each day, with a
+        count of the rest and a link to the day's page. Defaults to the
+        ``CALENDAR_DAY_LIMIT`` setting (no limit).
+    :type day_limit: int.
     """
     def __init__(self, cal_items, year=None, month=None, *args, **kwargs):
         """
         Make sure month_dict contains the correct objects. To do this, it needs
-        to call "get_date_attr_name" to so it looks at the correct field
+        to call "get_date_attr_name" to so it looks at the correct field.
+        The field names are memoized, so this is a dict lookup per item.
         """
+        self.day_limit = kwargs.pop('day_limit', get_day_limit())
+        # Filters the objects were fetched with, kept for the "more" links.
+        self.filters = getattr(cal_items, 'filters', ())
         # Pass the parent __init__ an empty list, since we'll fill in the correct values below.
         super(GenericListCalendar, self).__init__([], year, month, *args, **kwargs)
 
-        for item in cal_items:
-            date_attr = get_date_attr_name(item.__class__)
-            date = getattr(item, date_attr, None)
-            if type(date) == datetime.datetime:
-                date = date.date()
-            if date:
-                self.month_dict[date].append(item)
+        with measure('bucket') as counts:
+            self.add_iterable(cal_items, get_item_date)
+            counts['items'] = len(self.buckets.items)
 
-    def formatday(self, day, weekday, template='gencal/formatday.html'):
+    def get_day_context(self, day, weekday):
         """
-        Return a day as a table cell.
+        Return the context for a day cell, including the objects that
+        fall on that day.
 
         :arg day: A day to be formatted.
         :type day: date object.
         :arg weekday: Weekday of given day.
         :type weekday: int.
         """
-        if day.month == self.month:
-            day_num = day.day
-        else:
-            day_num = 0
-        if day in self.month_dict:
-            object_list = [obj for obj in self.month_dict[day]]
-        else:
-            object_list = []
-        return render_to_string(template,
-                {'link': self.get_link(day), 'day': day_num,
-                    'today': day == self.today, 'object_list': object_list,
-                    'weekday': weekday})
+        context = super(GenericListCalendar, self).get_day_context(day, weekday)
+        items = self.get_day_items(day)
+        count = self.get_day_count(day)
+        if self.day_limit is not None:
+            items = items[:self.day_limit]
+        more = count - len(items)
+        more_link = None
+        if more and self.slug:
+            more_link = '%s?offset=%d' % (self.get_day_url(self.slug, day),
+                    len(items))
+            if self.filters:
+                more_link += '&' + gencal_filters.format_filters(self.filters)
+        context.update({'object_list': items, 'weekday': weekday,
+            'count': count, 'more': more, 'more_link': more_link})
+        return context
+
+    def get_day_count(self, day):
+        """
+        Return how many objects fall on ``day``.
+        """
+        offset = self.buckets.offset(day)
+        if offset is None:
+            return 0
+        return self.buckets.count(offset)
 
     def get_link(self, dt):
         return None
+
+    def get_month_links(self, slug, theyear, themonth):
+        """
+        Return the previous and next month links, keeping the filters.
+        """
+        links = super(GenericListCalendar, self).get_month_links(slug,
+                theyear, themonth)
+        if not self.filters:
+            return links
+        query = '?' + gencal_filters.format_filters(self.filters)
+        return tuple([link + query for link in links])
+
+class RollupListCalendar(GenericListCalendar):
+    """
+    A :class:`GenericListCalendar` built from the :class:`DailyCount`
+    rollups returned by :meth:`GenericCalendar.get_rollups_for_date` (or
+    :meth:`GenericCalendar.get_day_counts_for_date`) instead of every
+    object. Each day shows the rollups' top objects (fetched with one
+    query per content type, with the model's projection, see
+    :func:`get_projection`) and an "N more" link to the day's page.
+
+    The day's page lists the rest of its objects from an offset into
+    :meth:`GenericCalendar.get_objects_for_day`'s order, so a cell stops
+    at the first content type whose rollup doesn't hold all of that
+    type's objects: later types' top objects would come after the ones it
+    leaves out.
+
+    :param cal_items: A list of :class:`DailyCount` objects.
+    :type cal_items: list.
+    """
+    def __init__(self, cal_items, year=None, month=None, *args, **kwargs):
+        super(RollupListCalendar, self).__init__([], year, month, *args, **kwargs)
+
+        with measure('bucket') as counts:
+            # Content types in id order, as GenericCalendar.get_objects_for_day
+            # lists them.
+            rollups = sorted([r for r in cal_items
+                if self.buckets.offset(r.date) is not None],
+                key=lambda r: (r.date, r.content_type_id))
+            self.counts = [0] * self.buckets.days
+            ids, shown, cut = {}, [], set()
+            for rollup in rollups:
+                self.counts[self.buckets.offset(rollup.date)] += rollup.count
+                if rollup.date in cut:
+                    continue
+                top_ids = rollup.get_top_ids()
+                if rollup.count > len(top_ids):
+                    cut.add(rollup.date)
+                shown.append((rollup, top_ids))
+                ids.setdefault(rollup.content_type_id, []).extend(top_ids)
+            objects = {}
+            for ct_id, pks in ids.items():
+                model = ContentType.objects.get_for_id(ct_id).model_class()
+                queryset = model._default_manager.filter(pk__in=pks)
+                with measure('query', model=get_model_label(model)) as query_counts:
+                    objects[ct_id] = dict([(obj.pk, obj) for obj in
+                        project_queryset(queryset, get_date_field(model).name)])
+                    query_counts['items'] = len(objects[ct_id])
+
+            items, dates = [], []
+            for rollup, top_ids in shown:
+                for pk in top_ids:
+                    obj = objects[rollup.content_type_id].get(pk)
+                    if obj is not None:
+                        items.append(obj)
+                        dates.append(rollup.date)
+            self.add_items(items, dates)
+            counts['items'] = len(items)
+
+    def get_day_count(self, day):
+        offset = self.buckets.offset(day)
+        if offset is None:
+            return 0
+        return self.counts[offset]
+
+class GenericScheduleCalendar(ScheduleCalendar):
+    """
+    A :class:`ScheduleCalendar` of the objects returned by
+    :meth:`GenericCalendar.get_objects_for_range`, each placed by its
+    model's date field and, if it has one, end field (see
+    :func:`get_end_field`).
+    """
+    def __init__(self, cal_items, start, days=7, *args, **kwargs):
+        super(GenericScheduleCalendar, self).__init__([], start, days, *args,
+                **kwargs)
+
+        with measure('bucket') as counts:
+            items, dates = [], []
+            for item in cal_items:
+                date = get_item_date(item)
+                if not date:
+                    continue
+                end = get_item_end(item)
+                if end:
+                    self.add_item(item, date, end)
+                else:
+                    items.append(item)
+                    dates.append(date)
+            self.add_items(items, dates)
+            counts['items'] = len(self.buckets.items)
+
+    def get_item_times(self, item):
+        return get_item_date(item), get_item_end(item)
+
+    def get_link(self, dt):
+        return self.get_day_url(self.slug, dt) + 'hours/'
+
+cache.connect_signals()
+rollups.connect_signals()
+metadata.connect_signals()
@@ -0,0 +1,108 @@
+"""
+Rendering calendar months into the cache ahead of the first request.
+
+Each month is rendered with the calendar class the views use and stored
+under the key the ``{% gencal %}`` tag reads, so the views find it. The
+months are shared out between a pool of processes, which means the cache
+backend must be shared between processes (e.g. memcached) for this to be
+of any use.
+"""
+import datetime
+import multiprocessing
+
+from django.conf import settings
+from django.db import connection
+
+import cache
+from grid import add_months
+
+def get_window():
+    """
+    Return how many months ``(before, after)`` the current one to
+    pre-render, from the ``CALENDAR_PRERENDER_MONTHS`` setting (by
+    default the previous month and the next three).
+    """
+    return getattr(settings, 'CALENDAR_PRERENDER_MONTHS', (1, 3))
+
+def get_months(before, after, today=None):
+    """
+    Return the ``(year, month)`` pairs from ``before`` months before the
+    month of ``today`` to ``after`` months after it.
+    """
+    if today is None:
+        today = datetime.date.today()
+    return [add_months(today.year, today.month, offset)
+            for offset in range(-before, after + 1)]
+
+def render_month(job):
+    """
+    Render one month of a calendar into the cache, unless it's already
+    there. ``job`` is a ``(slug, year, month, force)`` tuple; with
+    ``force`` the month is invalidated and rendered again. Returns
+    ``(slug, year, month, rendered)``.
+
+    This is the worker function run by :func:`prerender`'s process pool.
+    """
+    from metadata import get_calendar
+    from grid import get_first_weekday, get_timezone, get_timezone_name
+    from views import get_calendar_class, get_object_list
+
+    slug, year, month, force = job
+    cal_class = get_calendar_class()
+    tz = get_timezone()
+    if force:
+        cache.invalidate_month(slug, year, month)
+    # The key the {% gencal %} tag reads. It's checked with the backend
+    # directly, so pre-rendering doesn't count as hits or misses in
+    # cache.get_stats().
+    key = cache.month_key(slug, year, month, get_first_weekday(), cal_class,
+            get_timezone_name(tz))
+    if not force and cache.cache.get(key) is not None:
+        return slug, year, month, False
+    calendar = get_calendar(slug)
+    cache.set_rendered(key, cal_class(get_object_list(calendar, year, month),
+        year, month, tz=tz).formatmonth(slug, year, month))
+    return slug, year, month, True
+
+def prerender(slugs=None, before=None, after=None, processes=None,
+        force=False):
+    """
+    Render the months around the current one of every calendar (or just
+    those in ``slugs``) into the cache, returning the results of
+    :func:`render_month`.
+
+    :keyword slugs: Calendars to render. Defaults to all of them.
+    :type slugs: list.
+    :keyword before: Months before the current one to render. Defaults to
+        :func:`get_window`.
+    :type before: int.
+    :keyword after: Months after the current one to render.
+    :type after: int.
+    :keyword processes: Size of the process pool. Defaults to the number of
+        CPUs; with 1, the months are rendered in this process.
+    :type processes: int.
+    :keyword force: Render months that are already cached again.
+    :type force: bool.
+    """
+    from models import GenericCalendar
+
+    default_before, default_after = get_window()
+    if before is None:
+        before = default_before
+    if after is None:
+        after = default_after
+    if slugs is None:
+        slugs = GenericCalendar.objects.values_list('slug', flat=True)
+    jobs = [(slug, year, month, force) for slug in slugs
+            for year, month in get_months(before, after)]
+
+    if processes == 1 or len(jobs) <= 1:
+        return map(render_month, jobs)
+    # Don't let the workers share this process' database connection.
+    connection.close()
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(render_month, jobs)
+    finally:
+        pool.close()
+        pool.join()
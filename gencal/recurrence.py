@@ -0,0 +1,122 @@
+"""
+Expansion of multi-day and recurring items onto a calendar grid.
+
+Occurrences are found by arithmetic on the recurrence's interval, so
+only the occurrences that can touch the visible window are ever built,
+however far back the item started.
+"""
+import calendar
+import datetime
+
+from grid import add_months
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+class Recurrence(object):
+    """
+    Describes how an item repeats.
+
+    :arg freq: One of ``'daily'``, ``'weekly'`` or ``'monthly'``.
+    :type freq: str.
+    :keyword interval: Repeat every ``interval`` days, weeks or months.
+    :type interval: int.
+    :keyword until: Last date an occurrence may start on.
+    :type until: date.
+    :keyword count: Maximum number of occurrences, including the first.
+    :type count: int.
+    :keyword exceptions: Dates on which an occurrence is skipped.
+    :type exceptions: iterable of dates.
+
+    Monthly occurrences of an item starting on a day that a month doesn't
+    have (e.g. the 31st) fall on that month's last day.
+    """
+    def __init__(self, freq, interval=1, until=None, count=None, exceptions=()):
+        if freq not in (DAILY, WEEKLY, MONTHLY):
+            raise ValueError("Unknown recurrence frequency: %r" % freq)
+        if interval < 1:
+            raise ValueError("Recurrence interval must be at least 1.")
+        self.freq = freq
+        self.interval = interval
+        self.until = _as_date(until)
+        self.count = count
+        self.exceptions = frozenset([_as_date(d) for d in exceptions])
+
+    @classmethod
+    def from_value(cls, value):
+        """
+        Return a :class:`Recurrence` for ``value``, which may already be
+        one, a dict of keyword arguments, or ``None``.
+        """
+        if value is None or isinstance(value, cls):
+            return value
+        return cls(**dict((str(k), v) for k, v in value.items()))
+
+    def _nth(self, origin, n):
+        if self.freq == MONTHLY:
+            year, month = add_months(origin.year, origin.month, n * self.interval)
+            day = min(origin.day, calendar.monthrange(year, month)[1])
+            return datetime.date(year, month, day)
+        step = self.interval * (7 if self.freq == WEEKLY else 1)
+        return origin + datetime.timedelta(days=n * step)
+
+    def _first_index(self, origin, start):
+        if self.freq == MONTHLY:
+            months = (start.year - origin.year) * 12 + start.month - origin.month
+            return max(0, months // self.interval)
+        step = self.interval * (7 if self.freq == WEEKLY else 1)
+        return max(0, (start - origin).days // step)
+
+    def occurrences(self, origin, start, end):
+        """
+        Yield the start dates of the occurrences in ``[start, end)``.
+
+        :arg origin: Date of the first occurrence.
+        :type origin: date.
+        """
+        n = self._first_index(origin, start)
+        while self.count is None or n < self.count:
+            date = self._nth(origin, n)
+            if date >= end or (self.until and date > self.until):
+                break
+            if date >= start and date not in self.exceptions:
+                yield date
+            n += 1
+
+def occurrence_days(first, last, start, end, recurrence=None):
+    """
+    Yield each day in ``[start, end)`` covered by an item that runs from
+    ``first`` to ``last`` (inclusive) and repeats per ``recurrence``.
+
+    :arg first: First day of the item.
+    :type first: date.
+    :arg last: Last day of the item, or ``None`` for a one-day item.
+    :type last: date.
+    :keyword recurrence: How the item repeats, if it does.
+    :type recurrence: :class:`Recurrence`.
+    """
+    first = _as_date(first)
+    last = _as_date(last) or first
+    duration = last - first
+    if recurrence is None:
+        starts = [first]
+    else:
+        # An occurrence starting up to ``duration`` days before the window
+        # still shows up in it.
+        starts = recurrence.occurrences(first, start - duration, end)
+    one_day = datetime.timedelta(days=1)
+    seen = set()
+    for occurrence in starts:
+        day = max(occurrence, start)
+        stop = min(occurrence + duration, end - one_day)
+        while day <= stop:
+            if day not in seen:
+                seen.add(day)
+                yield day
+            day += one_day
@@ -0,0 +1,186 @@
+"""
+Optional per-day rollups of a calendar's objects.
+
+When ``CALENDAR_ROLLUPS`` is true, a :class:`gencal.models.DailyCount`
+row is kept for every (calendar, content type, day) that has objects,
+holding the number of objects and the ids of the first
+``CALENDAR_ROLLUP_TOP`` of them (by date, then id). Saving or deleting
+an object recomputes just the day(s) it was and is on; the
+``gencal_rebuild_rollups`` management command rebuilds everything.
+:class:`gencal.models.RollupListCalendar` renders a month from them.
+"""
+from __future__ import with_statement
+
+import datetime
+
+from django.conf import settings
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from cache import as_date, connect_tracking_signals, get_slugs_and_field
+from grid import get_day_start
+from instrumentation import measure
+
+def is_enabled():
+    return getattr(settings, 'CALENDAR_ROLLUPS', False)
+
+def get_top_count():
+    return getattr(settings, 'CALENDAR_ROLLUP_TOP', 3)
+
+def _day_filter(field, date):
+    # Rollups count days in UTC under USE_TZ, as rebuild() does, so the
+    # bounds are aware; naive ones would be read in TIME_ZONE.
+    start, end = date, date + datetime.timedelta(days=1)
+    if isinstance(field, models.DateTimeField):
+        if getattr(settings, 'USE_TZ', False):
+            start = get_day_start(start, timezone.utc)
+            end = get_day_start(end, timezone.utc)
+        else:
+            start = datetime.datetime.combine(start, datetime.time())
+            end = datetime.datetime.combine(end, datetime.time())
+    return {'%s__gte' % field.name: start, '%s__lt' % field.name: end}
+
+def _utc_date(value):
+    if getattr(value, 'tzinfo', None) is not None:
+        value = value.astimezone(timezone.utc)
+    return as_date(value)
+
+def _store(calendar_ids, ct, date, count, top_ids):
+    from django.db import IntegrityError, transaction
+    from models import DailyCount
+    rollups = DailyCount.objects.filter(calendar__in=calendar_ids,
+            content_type=ct, date=date)
+    if not count:
+        rollups.delete()
+        return
+    top_ids = ','.join([str(pk) for pk in top_ids])
+    rollups.update(count=count, top_ids=top_ids)
+    existing = set(rollups.values_list('calendar', flat=True))
+    for calendar_id in calendar_ids:
+        if calendar_id in existing:
+            continue
+        # Another save on the same day may have inserted the row since
+        # the update; the savepoint keeps its unique conflict from
+        # breaking the surrounding transaction, and the row is updated
+        # instead.
+        sid = transaction.savepoint()
+        try:
+            DailyCount.objects.create(calendar_id=calendar_id,
+                    content_type=ct, date=date, count=count, top_ids=top_ids)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            DailyCount.objects.filter(calendar=calendar_id, content_type=ct,
+                    date=date).update(count=count, top_ids=top_ids)
+        else:
+            transaction.savepoint_commit(sid)
+
+def update_day(model, date):
+    """
+    Recompute the rollups for ``model``'s objects on ``date``, for every
+    calendar that includes the model.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from models import GenericCalendar, get_date_field
+    field = get_date_field(model)
+    if field is None:
+        return
+    ct = ContentType.objects.get_for_model(model)
+    calendar_ids = list(GenericCalendar.objects.filter(content_types=ct
+        ).values_list('pk', flat=True))
+    if not calendar_ids:
+        return
+    queryset = model._default_manager.filter(**_day_filter(field, date))
+    count = queryset.count()
+    top_ids = queryset.order_by(field.name, 'pk').values_list('pk',
+            flat=True)[:get_top_count()]
+    _store(calendar_ids, ct, date, count, list(top_ids))
+
+def count_days(calendar, ct, queryset, field, top, tz=None):
+    """
+    Return unsaved :class:`gencal.models.DailyCount` rollups for the
+    objects in ``queryset`` (of the content type ``ct``), streaming just
+    their dates and ids. Aware datetimes are counted on their day in
+    ``tz``, if it's given.
+    """
+    from models import DailyCount
+    counts, top_ids, days = {}, {}, []
+    rows = queryset.order_by(field.name, 'pk').values_list(
+            field.name, 'pk').iterator()
+    for value, pk in rows:
+        if value is None:
+            continue
+        if tz is not None and getattr(value, 'tzinfo', None) is not None:
+            value = value.astimezone(tz)
+        date = as_date(value)
+        if date not in counts:
+            days.append(date)
+            counts[date] = 0
+            top_ids[date] = []
+        counts[date] += 1
+        if len(top_ids[date]) < top:
+            top_ids[date].append(str(pk))
+    return [DailyCount(calendar=calendar, content_type=ct, date=date,
+        count=counts[date], top_ids=','.join(top_ids[date])) for date in days]
+
+def count_range(calendar, start, end, top, filters=(), tz=None):
+    """
+    Work out (without storing them) the rollups of ``calendar`` for the
+    half-open range ``[start, end)``, keeping the ids of the first ``top``
+    objects of each day. This costs one query per content type that
+    reads just dates and ids, however busy the days are. ``filters`` and
+    ``tz`` are as for
+    :meth:`gencal.models.GenericCalendar.get_querysets_for_range`.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from models import get_model_label
+    rollups = []
+    for model, field, queryset in calendar.get_querysets_for_range(start, end,
+            tz, filters):
+        ct = ContentType.objects.get_for_model(model)
+        with measure('query', model=get_model_label(model)) as counts:
+            days = count_days(calendar, ct, queryset, field, top, tz)
+            counts['items'] = sum([rollup.count for rollup in days])
+        rollups += days
+    return rollups
+
+def rebuild(calendar):
+    """
+    Throw away and recompute every rollup of ``calendar``, with one
+    query per content type that streams just the dates and ids.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from models import DailyCount
+    top = get_top_count()
+    calendar.daily_counts.all().delete()
+    for model, field in calendar.get_date_fields():
+        ct = ContentType.objects.get_for_model(model)
+        DailyCount.objects.bulk_create(count_days(calendar, ct,
+            model._default_manager.all(), field, top))
+
+def update_for_instance(sender, instance, **kwargs):
+    """
+    ``post_save``/``post_delete`` handler that recomputes the days (in
+    UTC, for aware datetimes) an object was and is on.
+    """
+    slugs, field = get_slugs_and_field(sender)
+    if not field:
+        return
+    old_span = getattr(instance, '_gencal_old_span', None)
+    dates = set([_utc_date(getattr(instance, field, None)),
+        old_span and _utc_date(old_span[0])])
+    for date in dates:
+        if date:
+            update_day(sender, date)
+
+def connect_signals():
+    """
+    Hook the rollup handlers up, if rollups are enabled.
+    """
+    if not is_enabled():
+        return
+    connect_tracking_signals()
+    post_save.connect(update_for_instance,
+            dispatch_uid='gencal.rollups.post_save')
+    post_delete.connect(update_for_instance,
+            dispatch_uid='gencal.rollups.post_delete')
@@ -1,16 +1,31 @@
-from calendar import HTMLCalendar
-from datetime import datetime
+from __future__ import absolute_import, with_statement
+
+from bisect import bisect_left, bisect_right
+from calendar import HTMLCalendar, day_abbr, month_abbr
+from datetime import datetime, timedelta
 
 from django import template
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.template.loader import render_to_string
-from django.utils.datastructures import SortedDict
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from gencal import cache
+from gencal.buckets import DayBuckets, MonthDictView
+from gencal.filters import get_filter_key
+from gencal.grid import (add_months, get_day_boundaries, get_first_weekday,
+        get_grid_window, get_month_grid, memoize_skeleton,
+        get_timezone, get_timezone_name)
+from gencal.instrumentation import measure
+from gencal.recurrence import Recurrence, occurrence_days
+from gencal.timeline import Slot, layout
 
 register = template.Library()
 
 @register.simple_tag
-def gencal(obj_list, slug=None, year=None, month=None, calendar_class=None):
+def gencal(obj_list, slug=None, year=None, month=None, calendar_class=None,
+        tz=None):
     """
     Renders a simple calendar of the given month and year if none are
     specified. Accomplishes this by passing the arguments to
@@ -21,25 +36,164 @@ def gencal(obj_list, slug=None, year=None, month=None, calendar_class=None):
       {% gencal queryset %}
 
       {% gencal queryset 1983 12 %}
-      
 
-    :param obj_list: A list of objects to render on the calendar.
-    :type obj_list: list.
+    If the ``CALENDAR_CACHE`` setting is true and a ``slug`` is given, the
+    rendered month is cached (see :mod:`gencal.cache`) and ``obj_list`` is
+    not evaluated on a cache hit. The cache key includes the ``filters``
+    of ``obj_list`` if it has any (see :class:`gencal.models.LazyObjectList`).
+
+    :param obj_list: The objects to render on the calendar: a list or any
+        iterable, such as ``QuerySet.iterator()``.
+    :type obj_list: iterable.
     :keyword year: Year to render.
     :type year: int.
     :keyword month: Month to render.
     :type month: int.
+    :keyword tz: Time zone (or its name) to lay the month out in. Defaults
+        to the current time zone.
+    :type tz: tzinfo/str.
+    :returns: calendar as HTML
+    :rtype: str.
+    """
+    today = datetime.today()
+    if not year:
+        year = today.year
+    if not month:
+        month = today.month
+    if not calendar_class:
+        calendar_class = ListCalendar
+    tz = get_timezone(tz)
+    key = None
+    if slug and cache.is_enabled():
+        key = cache.month_key(slug, year, month, get_first_weekday(),
+                calendar_class, get_timezone_name(tz),
+                get_filter_key(getattr(obj_list, 'filters', ())))
+        html = cache.get_rendered(key)
+        if html is not None:
+            return html
+    html = calendar_class(obj_list, year, month, tz=tz).formatmonth(slug,
+            year, month)
+    if key:
+        cache.set_rendered(key, html)
+    return html
+
+@register.simple_tag
+def gencal_range(obj_list, slug=None, year=None, month=None, months=12,
+        calendar_class=None, tz=None):
+    """
+    Renders ``months`` consecutive months starting with the given one
+    (January of the current year if none is given), by way of
+    :meth:`ListCalendar.formatrange`.
+
+    ::
+
+      {% gencal_range queryset slug 2009 1 12 %}
+
+    :param obj_list: A list of objects covering every month rendered.
+    :type obj_list: list.
+    :keyword months: Number of months to render.
+    :type months: int.
+    :keyword tz: See ``{% gencal %}``.
+    :type tz: tzinfo/str.
     :returns: calendar as HTML
     :rtype: str.
     """
     today = datetime.today()
+    if not year:
+        year = today.year
+    if not month:
+        month = 1
+    if not calendar_class:
+        calendar_class = ListCalendar
+    months = int(months)
+    return calendar_class(obj_list, year, month, months=months,
+            tz=tz).formatrange(slug, year, month, months)
+
+@register.simple_tag
+def gencal_density(counts, year=None):
+    """
+    Renders a year of daily counts as a density calendar, by way of
+    :meth:`DensityCalendar.formatdensity`.
+
+    ::
+
+      {% gencal_density counts 2009 %}
+
+    :param counts: A dict mapping days to counts, such as
+        :meth:`gencal.models.GenericCalendar.get_density` returns.
+    :type counts: dict.
+    :keyword year: Year to render. Defaults to the current one.
+    :type year: int.
+    """
+    return DensityCalendar(counts, year).formatdensity()
+
+def iter_gencal(obj_list, slug=None, year=None, month=None, calendar_class=None,
+        tz=None):
+    """
+    Like the ``{% gencal %}`` tag, but yields the month in pieces (see
+    :meth:`ListCalendar.iterformatmonth`) so it can be streamed. A cached
+    month is yielded whole, and a freshly rendered one is cached once the
+    last piece has been produced.
+    """
+    today = datetime.today()
     if not year:
         year = today.year
     if not month:
         month = today.month
     if not calendar_class:
         calendar_class = ListCalendar
-    return calendar_class(obj_list, year, month).formatmonth(slug, year, month)
+    tz = get_timezone(tz)
+    key = None
+    if slug and cache.is_enabled():
+        key = cache.month_key(slug, year, month, get_first_weekday(),
+                calendar_class, get_timezone_name(tz),
+                get_filter_key(getattr(obj_list, 'filters', ())))
+        html = cache.get_rendered(key)
+        if html is not None:
+            yield html
+            return
+    chunks = []
+    for chunk in calendar_class(obj_list, year, month, tz=tz).iterformatmonth(
+            slug, year, month):
+        if key:
+            chunks.append(chunk)
+        yield chunk
+    if key:
+        cache.set_rendered(key, mark_safe(''.join(chunks)))
+
+def iter_gencal_range(obj_list, slug=None, year=None, month=None, months=12,
+        calendar_class=None, tz=None):
+    """
+    Like the ``{% gencal_range %}`` tag, but yields the months in pieces
+    (see :meth:`ListCalendar.iterformatrange`) so they can be streamed.
+    """
+    today = datetime.today()
+    if not year:
+        year = today.year
+    if not month:
+        month = 1
+    if not calendar_class:
+        calendar_class = ListCalendar
+    months = int(months)
+    cal = calendar_class(obj_list, year, month, months=months, tz=tz)
+    for chunk in cal.iterformatrange(slug, year, month, months):
+        yield chunk
+
+def split_rendered(template_name, loop_var, context):
+    """
+    Render ``template_name`` with two markers standing in for the items
+    of ``loop_var``, and return the ``(head, between, tail)`` text around
+    them. Rendering real items ``a, b, c`` through the template then gives
+    ``head + a + between + b + between + c + tail``, which lets the items
+    be produced (and sent) one at a time.
+    """
+    markers = [mark_safe('<!--gencal:%d-->' % i) for i in (0, 1)]
+    context = dict(context)
+    context[loop_var] = markers
+    rendered = render_to_string(template_name, context)
+    head, rest = rendered.split(markers[0], 1)
+    between, tail = rest.split(markers[1], 1)
+    return head, between, tail
 
 class ListCalendar(HTMLCalendar):
     """
@@ -48,8 +202,14 @@ class ListCalendar(HTMLCalendar):
     calendar with links on the days that are present in the list,
     using ``date_field`` as the lookup.
 
-    It's assumed that the provided list is valid for the given month,
-    ie: contains no outside dates.
+    The list can be any iterable (a generator, ``QuerySet.iterator()``)
+    and can hold items from outside the month: each is read once and put
+    on its day of the grid, and items off the grid are left out.
+
+    Items are kept in ``self.buckets`` (a
+    :class:`gencal.buckets.DayBuckets` indexed by day offset from the
+    start of the grid). ``self.month_dict`` is a read-only, dict-like view
+    of it keyed by date.
 
     Usage::
 
@@ -71,18 +231,59 @@ class ListCalendar(HTMLCalendar):
         <tr><td><a href="/items/2009/1/26">26</a></td><td><a href="/items/2009/1/27">27</a></td><td><a href="/items/2009/1/28">28</a></td><td><a href="/items/2009/1/29">29</a></td><td><a href="/items/2009/1/30">30</a></td><td><a href="/items/2009/1/31">31</a></td><td><a href="/items/2009/2/1">1</a></td></tr>
         </table>
 
-    :param cal_items: A list of items to put in the calendar.
-    :type cal_items: list.
+    :param cal_items: Items to put in the calendar: a list, or any iterable
+        (a generator, ``QuerySet.iterator()``...), which is read in chunks
+        of ``chunk_size`` items so only the items on the grid are kept.
+        Items off the grid are left out.
+    :type cal_items: iterable.
     :keyword year: Year to render.
     :type year: int.
     :keyword month: Month to render.
     :type month: int.
+    :keyword months: Number of consecutive months, starting with ``month``,
+        to hold items for. See :meth:`formatrange`.
+    :type months: int.
+    :keyword date_field: Key or attribute holding each item's date.
+    :type date_field: str.
+    :keyword end_field: Key or attribute holding the last day of
+        multi-day items.
+    :type end_field: str.
+    :keyword recurrence_field: Key or attribute holding a
+        :class:`gencal.recurrence.Recurrence` (or a dict of its arguments)
+        for repeating items.
+    :type recurrence_field: str.
+    :keyword compiled: Render the month in a single template pass. Defaults
+        to the ``CALENDAR_COMPILED`` setting.
+    :type compiled: bool.
+    :keyword tz: Time zone (or its name) to put aware datetimes on days in.
+        Defaults to the current time zone; ignored when ``USE_TZ`` is off.
+    :type tz: tzinfo/str.
+    :keyword window: Half-open ``(start, end)`` range of dates to hold
+        items for, instead of the month grid's.
+    :type window: tuple(date, date)
+    :keyword sorted_by_date: ``cal_items`` come in date order, so reading
+        can stop at the first item past the grid.
+    :type sorted_by_date: bool.
     """
+    # How many items of cal_items are read at a time.
+    chunk_size = 1000
+
+    # Calendar classes are passed around in template contexts (see the
+    # ``cal_class`` argument of the ``{% gencal %}`` tag); don't let the
+    # template engine try to instantiate them.
+    do_not_call_in_templates = True
 
-    def __init__(self, cal_items, year=None, month=None, *args, **kwargs):
-        firstweekday = getattr(settings, 'CALENDAR_FIRST_WEEKDAY', 6)
+    def __init__(self, cal_items, year=None, month=None, months=1, *args, **kwargs):
+        firstweekday = get_first_weekday()
+
+        self.tz = get_timezone(kwargs.pop('tz', None))
+        # Day boundaries in UTC, built by get_day_boundaries when the first
+        # aware datetime is bucketed.
+        self._boundaries = None
 
         today = datetime.today()
+        if self.tz is not None:
+            today = datetime.utcnow().replace(tzinfo=timezone.utc).astimezone(self.tz)
         self.today = today.date()
 
         if year == None:
@@ -94,31 +295,233 @@ class ListCalendar(HTMLCalendar):
         self.month = month
 
         self.date_field = kwargs.pop('date_field', 'date')
+        self.end_field = kwargs.pop('end_field', None)
+        self.recurrence_field = kwargs.pop('recurrence_field', None)
+        self.compiled = kwargs.pop('compiled',
+                getattr(settings, 'CALENDAR_COMPILED', False))
+        window = kwargs.pop('window', None)
+        self.sorted_by_date = kwargs.pop('sorted_by_date', False)
+        # Slug of the calendar being rendered, set by formatmonth.
+        self.slug = None
 
         super(ListCalendar, self).__init__(firstweekday=firstweekday, *args, **kwargs)
 
-        cal_arr = self.monthdatescalendar(year, month)
-        month_dict = SortedDict()
-        for week in cal_arr:
-            for date in week:
-                month_dict[date] = []
+        # Reversed calendar URLs by slug, and links and URLs built in one
+        # go for every day and item on the grid (see get_day_links and
+        # get_day_objects).
+        self._url_prefixes = {}
+        self._day_links = None
+        self._object_urls = None
+        self.months = months
+        if window is None:
+            first = self.monthdates2calendar(year, month)
+            last = self.monthdates2calendar(*add_months(year, month, months - 1))
+            # Half-open range of the dates shown on the grid.
+            window = (first[0][0][0], last[-1][-1][0] + timedelta(days=1))
+        self.window = window
+        self.buckets = DayBuckets(self.window[0],
+                (self.window[1] - self.window[0]).days)
+        self.month_dict = MonthDictView(self.buckets)
+
+        with measure('bucket') as counts:
+            if self.end_field or self.recurrence_field:
+                days = self.buckets.days
+                for item in cal_items:
+                    possible_date = self.get_item_value(item, self.date_field)
+                    if possible_date:
+                        if (self.sorted_by_date and
+                                self.get_offsets([possible_date])[0] >= days):
+                            break
+                        end = recurrence = None
+                        if self.end_field:
+                            end = self.get_item_value(item, self.end_field)
+                        if self.recurrence_field:
+                            recurrence = Recurrence.from_value(self.get_item_value(
+                                item, self.recurrence_field))
+                        self.add_item(item, possible_date, end, recurrence)
+            else:
+                self.add_iterable(cal_items,
+                        lambda item: self.get_item_value(item, self.date_field))
+            counts['items'] = len(self.buckets.items)
+
+    def get_item_value(self, item, field):
+        """
+        Return the value of ``field`` for ``item``, which may be a dict or
+        an object.
+        """
+        if isinstance(item, dict):
+            return item.get(field)
+        return getattr(item, field)
+
+    def add_item(self, item, date, end=None, recurrence=None):
+        """
+        Put ``item`` on every visible day it falls on.
+
+        :arg date: The day the item starts on.
+        :type date: date/datetime
+        :keyword end: The last day of a multi-day item.
+        :type end: date/datetime
+        :keyword recurrence: How the item repeats, if it does.
+        :type recurrence: :class:`gencal.recurrence.Recurrence`
+        """
+        buckets = self.buckets
+        if end is None and recurrence is None:
+            self.add_items([item], [date])
+            return
+        start, stop = self.window
+        if self.tz is not None:
+            date = self.get_local_date(date)
+            if end is not None:
+                end = self.get_local_date(end)
+        buckets.add(item, [buckets.offset(day) for day in
+            occurrence_days(date, end, start, stop, recurrence)])
+
+    def add_items(self, items, dates):
+        """
+        Put each of ``items`` on the single day at the matching position in
+        ``dates``. This is the fast path used for items without an end or
+        a recurrence.
+
+        :arg items: Items to add.
+        :type items: list.
+        :arg dates: The day (or datetime) each item falls on.
+        :type dates: list.
+        """
+        if not items:
+            return
+        self.add_offsets(items, self.get_offsets(dates))
+
+    def add_offsets(self, items, offsets):
+        """
+        Put each of ``items`` on the day at the matching position in
+        ``offsets`` (see :meth:`get_offsets`), leaving out the items off
+        the grid.
+        """
+        days = self.buckets.days
+        if min(offsets) < 0 or max(offsets) >= days:
+            kept = [(item, offset) for item, offset in zip(items, offsets)
+                    if 0 <= offset < days]
+            items = [item for item, offset in kept]
+            offsets = [offset for item, offset in kept]
+        self.buckets.extend(items, offsets)
 
+    def iter_dated(self, cal_items, get_date):
+        """
+        Yield ``(items, dates)`` lists of at most :attr:`chunk_size` of
+        ``cal_items`` and their dates, from ``get_date(item)``, skipping
+        the items without a date.
+        """
+        chunk_size = self.chunk_size
+        items, dates = [], []
         for item in cal_items:
-            if isinstance(item, dict):
-                possible_date = item.get(self.date_field)
+            date = get_date(item)
+            if date:
+                items.append(item)
+                dates.append(date)
+                if len(items) == chunk_size:
+                    yield items, dates
+                    items, dates = [], []
+        if items:
+            yield items, dates
+
+    def add_iterable(self, cal_items, get_date):
+        """
+        Put each of ``cal_items`` (any iterable) on the day
+        ``get_date(item)`` falls on, a chunk at a time, so only the items
+        on the grid are held on to. With :attr:`sorted_by_date`, reading
+        stops at the first chunk that runs past the grid.
+        """
+        days = self.buckets.days
+        for items, dates in self.iter_dated(cal_items, get_date):
+            offsets = self.get_offsets(dates)
+            if self.sorted_by_date and offsets[-1] >= days:
+                cut = bisect_left(offsets, days)
+                if cut:
+                    self.add_offsets(items[:cut], offsets[:cut])
+                break
+            self.add_offsets(items, offsets)
+
+    def get_offsets(self, dates):
+        """
+        Return the day offset of each of ``dates`` from the start of the
+        grid. Aware datetimes are placed by the calendar's time zone, by
+        looking them up in the day boundaries computed once for the grid
+        (see :func:`gencal.grid.get_day_boundaries`) rather than
+        localizing each one.
+
+        :arg dates: Dates, naive datetimes or aware datetimes.
+        :type dates: list.
+        """
+        start_ordinal = self.buckets.start_ordinal
+        if self.tz is None:
+            return [date.toordinal() - start_ordinal for date in dates]
+        boundaries = self.get_day_boundaries()
+        offsets = []
+        for date in dates:
+            if isinstance(date, datetime) and date.tzinfo is not None:
+                utc = date.replace(tzinfo=None) - date.utcoffset()
+                offsets.append(bisect_right(boundaries, utc) - 1)
             else:
-                possible_date = getattr(item, self.date_field)
-            if type(possible_date) == datetime:
-                # transform possible_date to a date, not a datetime
-                possible_date = possible_date.date()
-            if possible_date:
-                month_dict[possible_date].append(item)
-        self.month_dict = month_dict
+                offsets.append(date.toordinal() - start_ordinal)
+        return offsets
+
+    def get_day_boundaries(self):
+        """
+        Return :func:`gencal.grid.get_day_boundaries` for the grid, built
+        once per calendar.
+        """
+        if self._boundaries is None:
+            self._boundaries = get_day_boundaries(self.buckets.start,
+                    self.buckets.days, self.tz)
+        return self._boundaries
+
+    def get_local_date(self, value):
+        """
+        Return the day ``value`` falls on in the calendar's time zone.
+        """
+        if not isinstance(value, datetime) or value.tzinfo is None:
+            return value
+        offset = self.get_offsets([value])[0]
+        if 0 <= offset < self.buckets.days:
+            return self.buckets.date(offset)
+        return value.astimezone(self.tz).date()
+
+    def get_day_items(self, day):
+        """
+        Return a list of the items on ``day``, which is empty if the day
+        isn't on the grid.
+        """
+        offset = self.buckets.offset(day)
+        if offset is None:
+            return []
+        return self.buckets.get(offset)
 
     def formatday(self, day, weekday, template='gencal/formatday.html'):
         """
         Return a day as a table cell.
 
+        :arg day: A day to be formatted.
+        :type day: date object.
+        :arg weekday: Weekday of given day.
+        :type weekday: int.
+        """
+        return render_to_string(template, self._cell_context(day, weekday))
+
+    def _cell_context(self, day, weekday):
+        """
+        :meth:`get_day_context`, with the day's ``objects`` paired with
+        their URLs for the templates.
+        """
+        context = self.get_day_context(day, weekday)
+        if 'object_list' in context and 'objects' not in context:
+            context['objects'] = self.get_day_objects(context['object_list'])
+        return context
+
+    def get_day_context(self, day, weekday):
+        """
+        Return the context used to render a single day cell, both by
+        :meth:`formatday` and by the compiled month template.
+
         :arg day: A day to be formatted.
         :type day: date object.
         :arg weekday: Weekday of given day.
@@ -128,9 +531,12 @@ class ListCalendar(HTMLCalendar):
             day_num = day.day
         else:
             day_num = 0
-        return render_to_string(template,
-                {'link': self.get_link(day), 'day': day_num,
-                    'today': day == self.today})
+        offset = self.buckets.offset(day)
+        if offset is None:
+            link = self.get_link(day)
+        else:
+            link = self.get_day_links()[offset]
+        return {'link': link, 'day': day_num, 'today': day == self.today}
 
     def get_link(self, dt):
         """
@@ -141,6 +547,88 @@ class ListCalendar(HTMLCalendar):
         """
         return None
 
+    def get_links(self, dates):
+        """
+        Return a list with the url (or ``None``) for each of ``dates``.
+        It's called once, with every day on the grid, so subclasses can
+        build all the links in one go (see :meth:`get_day_url`) rather
+        than per day. By default it calls :meth:`get_link` for each date.
+
+        :arg dates: dates to turn into urls
+        :type dates: list.
+        """
+        return [self.get_link(dt) for dt in dates]
+
+    def get_day_links(self):
+        """
+        Return :meth:`get_links` for every day on the grid, indexed by
+        day offset. Built once per calendar.
+        """
+        if self._day_links is None:
+            buckets = self.buckets
+            self._day_links = self.get_links([buckets.date(offset)
+                for offset in range(buckets.days)])
+        return self._day_links
+
+    def get_url_prefix(self, slug):
+        """
+        Return the url of the calendar ``slug``, which month and day urls
+        are built from by appending ``YYYY/MM/`` or ``YYYY/MM/DD/``. It's
+        only reversed once per calendar.
+        """
+        if slug not in self._url_prefixes:
+            self._url_prefixes[slug] = reverse('genericcalendar-default',
+                    args=[slug])
+        return self._url_prefixes[slug]
+
+    def get_day_url(self, slug, dt):
+        """
+        Return the url of the page for ``dt`` in the calendar ``slug``.
+        """
+        return '%s%d/%02d/%02d/' % (self.get_url_prefix(slug), dt.year,
+                dt.month, dt.day)
+
+    def get_object_urls(self, objects):
+        """
+        Return a list with the url (or ``None``) for each of ``objects``.
+        It's called once, with every item on the grid, so subclasses can
+        build the urls in one go. By default each object's
+        ``get_absolute_url`` (or the ``get_absolute_url`` key of a dict)
+        is used, as the templates used to do.
+
+        :arg objects: items to turn into urls
+        :type objects: list.
+        """
+        urls = []
+        for obj in objects:
+            if isinstance(obj, dict):
+                url = obj.get('get_absolute_url')
+            else:
+                url = getattr(obj, 'get_absolute_url', None)
+            if callable(url):
+                url = url()
+            urls.append(url)
+        return urls
+
+    def get_day_objects(self, objects):
+        """
+        Return an ``(object, url)`` pair for each of ``objects``, the items
+        shown on a day, with the urls from :meth:`get_object_urls`.
+        """
+        if self._object_urls is None:
+            items = self.buckets.items
+            self._object_urls = dict(zip(map(id, items),
+                self.get_object_urls(items)))
+        known = self._object_urls
+        missing = [obj for obj in objects if id(obj) not in known]
+        if missing:
+            # Not bucketed by the calendar, so not kept alive by it either;
+            # don't remember them by id.
+            extra = dict(zip(map(id, missing), self.get_object_urls(missing)))
+            return [(obj, known.get(id(obj), extra.get(id(obj))))
+                    for obj in objects]
+        return [(obj, known[id(obj)]) for obj in objects]
+
     def monthdates2calendar(self, year, month):
         """
         Function returns a list containing a list of tuples
@@ -152,6 +640,9 @@ class ListCalendar(HTMLCalendar):
         have monthdatescalendar, monthdayscalendar,
         monthdays2calendar, but no monthdates2calendar.
 
+        The grid is shared with every other calendar (see
+        :func:`gencal.grid.get_month_grid`), so it mustn't be changed.
+
         :keyword year: Year to render.
         :type year: int.
         :keyword month: Month to render.
@@ -159,7 +650,7 @@ class ListCalendar(HTMLCalendar):
         :returns: Tuple of (datetime, weekday).
         :rtype: tuple(datetime, int)
         """
-        return [[(dt, dt.weekday()) for dt in week] for week in self.monthdatescalendar(year, month)]
+        return get_month_grid(year, month, self.firstweekday)
 
     def formatweek(self, theweek, template='gencal/formatweek.html'):
         """
@@ -172,9 +663,14 @@ class ListCalendar(HTMLCalendar):
         """
         Return a weekday name as a table header.
         """
+        return render_to_string(template, self.get_weekday_context(day))
+
+    def get_weekday_context(self, day):
+        """
+        Return the context used to render a weekday header cell.
+        """
         from calendar import day_abbr
-        return render_to_string(template,
-                {'class': self.cssclasses[day], 'weekday': day_abbr[day]})
+        return {'class': self.cssclasses[day], 'weekday': day_abbr[day]}
 
     def formatweekheader(self, template='gencal/formatweekheader.html'):
         """
@@ -184,19 +680,64 @@ class ListCalendar(HTMLCalendar):
         return render_to_string(template,
                 {'weekdays': weekdays})
 
+    def get_week_header(self):
+        """
+        Return :meth:`formatweekheader`, rendered once per calendar class,
+        first weekday and locale (see :func:`gencal.grid.memoize_skeleton`).
+        """
+        return memoize_skeleton(('week_header', type(self), self.firstweekday),
+                self.formatweekheader)
+
+    def get_weekdays(self):
+        """
+        Return :meth:`get_weekday_context` for each day of the week, in
+        order, worked out once per calendar class, first weekday and
+        locale.
+        """
+        return memoize_skeleton(('weekdays', type(self), self.firstweekday),
+                lambda: tuple([self.get_weekday_context(i)
+                    for i in self.iterweekdays()]))
+
+    def get_month_header(self, theyear, themonth, withyear=True):
+        """
+        Return :meth:`formatmonthname`, rendered once per calendar class,
+        month and locale. It's shared by every calendar showing the month,
+        so it's rendered without the month links; ``gencal/formatmonth.html``
+        gets those itself.
+        """
+        return memoize_skeleton(('month_header', type(self), theyear,
+            themonth, withyear), lambda: self.formatmonthname(theyear,
+                themonth, withyear=withyear))
+
     def formatmonthname(self, theyear, themonth, withyear=True, prev='',
             next='', template='gencal/formatmonthname.html'):
         """
         Return a month name as a table row.
         """
+        return render_to_string(template,
+                {'month_name': self.get_month_name(theyear, themonth, withyear),
+                    'prev_month_link': prev, 'next_month_link': next})
+
+    def get_month_name(self, theyear, themonth, withyear=True):
+        """
+        Return the text shown in the month header.
+        """
         from calendar import month_name
         if withyear:
-            s = '%s %s' % (month_name[themonth], theyear)
-        else:
-            s = '%s' % month_name[themonth]
-        return render_to_string(template,
-                {'month_name': s, 'prev_month_link': prev,
-                    'next_month_link': next})
+            return '%s %s' % (month_name[themonth], theyear)
+        return '%s' % month_name[themonth]
+
+    def get_month_links(self, slug, theyear, themonth):
+        """
+        Return a ``(prev_month_link, next_month_link)`` tuple for the
+        given month.
+        """
+        prefix = self.get_url_prefix(slug)
+        prev_month_link = '%s%d/%02d/' % ((prefix,) +
+                add_months(theyear, themonth, -1))
+        next_month_link = '%s%d/%02d/' % ((prefix,) +
+                add_months(theyear, themonth, 1))
+        return prev_month_link, next_month_link
 
     def formatmonth(self, slug, theyear, themonth, withyear=True,
             template='gencal/formatmonth.html'):
@@ -206,6 +747,50 @@ class ListCalendar(HTMLCalendar):
         Overridden so weeks will use monthdates2calendar, so we have
         access to full date objects, rather than numbers.
 
+        If the calendar was created with ``compiled=True`` (or the
+        ``CALENDAR_COMPILED`` setting is true), the month is rendered by
+        :meth:`formatmonth_compiled` instead.
+
+        :arg theyear: Year of calendar to render.
+        :type theyear: int.
+        :arg themonth: Month of calendar to render
+        :type themonth: int.
+        :keyword withyear: If true, it will show the year in the header.
+        :type withyear: bool.
+        """
+        self.slug = slug
+        with measure('render') as counts:
+            if self.compiled:
+                html = self.formatmonth_compiled(slug, theyear, themonth,
+                        withyear=withyear)
+            else:
+                weeks = [self.formatweek(week) for week in
+                        self.monthdates2calendar(theyear, themonth)]
+                prev_month_link, next_month_link = self.get_month_links(slug,
+                        theyear, themonth)
+                html = render_to_string(template,
+                        {'month_name': self.get_month_header(theyear, themonth,
+                            withyear=withyear),
+                            'week_header': self.get_week_header(),
+                            'weeks': weeks, 'prev_month_link': prev_month_link,
+                            'next_month_link': next_month_link})
+            counts['bytes'] = len(html)
+        return html
+
+    def formatmonth_compiled(self, slug, theyear, themonth, withyear=True,
+            template='gencal/month.html'):
+        """
+        Return a formatted month as a table, rendered in a single template
+        pass.
+
+        Instead of rendering ``gencal/formatday.html`` once per day,
+        ``gencal/formatweek.html`` once per week and so on, the week/day
+        structure is built up front from :meth:`get_day_context` and
+        :meth:`get_weekday_context` and handed to ``gencal/month.html``.
+        The default templates produce the same output as
+        :meth:`formatmonth`; overrides of :meth:`formatday` or the
+        ``format*.html`` templates are not used by this path.
+
         :arg theyear: Year of calendar to render.
         :type theyear: int.
         :arg themonth: Month of calendar to render
@@ -213,17 +798,307 @@ class ListCalendar(HTMLCalendar):
         :keyword withyear: If true, it will show the year in the header.
         :type withyear: bool.
         """
-        weeks = [self.formatweek(week) for week in
-                self.monthdates2calendar(theyear, themonth)]
-        prev_month_link = '%s%d/%02d/' % (reverse('genericcalendar-default',
-            args=[slug]), theyear if themonth - 1 >= 1 else theyear - 1,
-            themonth - 1 if themonth - 1 >= 1 else 12)
-        next_month_link = '%s%d/%02d/' % (reverse('genericcalendar-default',
-            args=[slug]), theyear if themonth + 1 <= 12 else theyear + 1,
-            themonth + 1 if themonth + 1 <= 12 else 1)
+        self.slug = slug
+        weeks = [[self._cell_context(d, wd) for (d, wd) in week]
+                for week in self.monthdates2calendar(theyear, themonth)]
+        weekdays = self.get_weekdays()
+        prev_month_link, next_month_link = self.get_month_links(slug,
+                theyear, themonth)
         return render_to_string(template,
-                {'month_name': self.formatmonthname(theyear, themonth,
-                    withyear=withyear, prev=prev_month_link,
-                    next=next_month_link), 'week_header': self.formatweekheader(),
-                    'weeks': weeks, 'prev_month_link': prev_month_link,
+                {'month_name': self.get_month_name(theyear, themonth, withyear),
+                    'weekdays': weekdays, 'weeks': weeks,
+                    'prev_month_link': prev_month_link,
+                    'next_month_link': next_month_link})
+
+    def formatrange(self, slug, theyear, themonth, months=None, withyear=True,
+            template='gencal/formatrange.html'):
+        """
+        Return ``months`` consecutive formatted months, starting with
+        ``themonth``.
+
+        The items are bucketed once for the whole range, and the weekday
+        header is rendered once and shared by every month. The calendar
+        must have been created with at least as many ``months``.
+
+        :arg theyear: Year of the first month to render.
+        :type theyear: int.
+        :arg themonth: First month to render.
+        :type themonth: int.
+        :keyword months: Number of months to render. Defaults to the number
+            the calendar was created with.
+        :type months: int.
+        """
+        if months is None:
+            months = self.months
+        rendered = [self.formatmonth(slug, year, month, withyear=withyear)
+                for year, month in self.itermonths(theyear, themonth, months)]
+        return render_to_string(template, {'months': rendered})
+
+    def itermonths(self, theyear, themonth, months):
+        """
+        Yield ``(year, month)`` for ``months`` consecutive months, with
+        ``self.year`` and ``self.month`` pointing at the month being
+        yielded, since :meth:`get_day_context` uses them to mark days
+        outside the month.
+        """
+        year, month = self.year, self.month
+        try:
+            for i in range(months):
+                self.year, self.month = add_months(theyear, themonth, i)
+                yield self.year, self.month
+        finally:
+            self.year, self.month = year, month
+
+    def iterformatmonth(self, slug, theyear, themonth, withyear=True,
+            template='gencal/formatmonth.html'):
+        """
+        Yield a formatted month in pieces: everything up to the first week,
+        then each week's row as it is rendered, then the rest of the
+        table. Joined together, the pieces are the same as the output of
+        :meth:`formatmonth` (when not compiled).
+
+        :arg theyear: Year of calendar to render.
+        :type theyear: int.
+        :arg themonth: Month of calendar to render
+        :type themonth: int.
+        :keyword withyear: If true, it will show the year in the header.
+        :type withyear: bool.
+        """
+        self.slug = slug
+        prev_month_link, next_month_link = self.get_month_links(slug,
+                theyear, themonth)
+        head, between, tail = split_rendered(template, 'weeks',
+                {'month_name': self.get_month_header(theyear, themonth,
+                    withyear=withyear), 'week_header': self.get_week_header(),
+                    'prev_month_link': prev_month_link,
                     'next_month_link': next_month_link})
+        yield head
+        for i, week in enumerate(self.monthdates2calendar(theyear, themonth)):
+            if i:
+                yield between
+            yield self.formatweek(week)
+        yield tail
+
+    def iterformatrange(self, slug, theyear, themonth, months=None,
+            withyear=True, template='gencal/formatrange.html'):
+        """
+        Yield :meth:`formatrange` in pieces, streaming each month with
+        :meth:`iterformatmonth`.
+        """
+        if months is None:
+            months = self.months
+        head, between, tail = split_rendered(template, 'months', {})
+        yield head
+        for i, (year, month) in enumerate(self.itermonths(theyear, themonth,
+                months)):
+            if i:
+                yield between
+            for chunk in self.iterformatmonth(slug, year, month,
+                    withyear=withyear):
+                yield chunk
+        yield tail
+
+class ScheduleCalendar(ListCalendar):
+    """
+    A :class:`ListCalendar` of ``days`` consecutive days from ``start``
+    (a week, or a single day), with the items that have a time laid out
+    in hour slots, side by side where they overlap (see
+    :mod:`gencal.timeline`), and the rest listed as all-day items.
+
+    Items are bucketed as by :class:`ListCalendar`. With an ``end_field``,
+    items run until that datetime; otherwise they last
+    ``CALENDAR_SCHEDULE_DURATION`` minutes (60). ``CALENDAR_SCHEDULE_HOURS``
+    sets the ``(first, last)`` hours shown, ``(0, 24)`` by default.
+
+    :param cal_items: A list of items to put in the calendar.
+    :type cal_items: list.
+    :param start: The first day shown.
+    :type start: date.
+    :keyword days: Number of days shown.
+    :type days: int.
+    """
+    def __init__(self, cal_items, start, days=7, *args, **kwargs):
+        self.start = start
+        self.days = days
+        kwargs['window'] = (start, start + timedelta(days=days))
+        super(ScheduleCalendar, self).__init__(cal_items, start.year,
+                start.month, *args, **kwargs)
+
+    def get_hours(self):
+        return getattr(settings, 'CALENDAR_SCHEDULE_HOURS', (0, 24))
+
+    def get_default_duration(self):
+        return getattr(settings, 'CALENDAR_SCHEDULE_DURATION', 60)
+
+    def get_item_times(self, item):
+        """
+        Return the ``(start, end)`` of ``item``. Items whose start is a
+        date rather than a datetime are all-day items; ``end`` may be
+        ``None``.
+        """
+        end = None
+        if self.end_field:
+            end = self.get_item_value(item, self.end_field)
+        return self.get_item_value(item, self.date_field), end
+
+    def get_minute(self, day, value):
+        """
+        Return how many minutes after the start of ``day`` the datetime
+        ``value`` is, in the calendar's time zone.
+        """
+        if self.tz is not None and value.tzinfo is not None:
+            value = value.astimezone(self.tz)
+        return ((value.date() - day).days * 24 * 60 + value.hour * 60 +
+                value.minute)
+
+    def get_day_schedule(self, day):
+        """
+        Return ``(all_day, slots)`` for ``day``: ``(item, url)`` pairs for
+        the items without a time, and the laid out
+        :class:`gencal.timeline.Slot` of the others, cut to the day.
+        """
+        all_day, slots = [], []
+        for item, url in self.get_day_objects(self.get_day_items(day)):
+            start, end = self.get_item_times(item)
+            if not isinstance(start, datetime):
+                all_day.append((item, url))
+                continue
+            start_minute = self.get_minute(day, start)
+            if isinstance(end, datetime):
+                end_minute = self.get_minute(day, end)
+            else:
+                end_minute = start_minute + self.get_default_duration()
+            if end_minute <= 0 or start_minute >= 24 * 60:
+                continue
+            slots.append(Slot(item, max(start_minute, 0),
+                min(end_minute, 24 * 60), url))
+        return all_day, layout(slots)
+
+    def get_schedule_links(self, slug):
+        """
+        Return a ``(prev_link, next_link)`` tuple for the previous and
+        next ``days`` days.
+        """
+        suffix = self.days == 7 and 'week/' or 'hours/'
+        step = timedelta(days=self.days)
+        return (self.get_day_url(slug, self.start - step) + suffix,
+                self.get_day_url(slug, self.start + step) + suffix)
+
+    def formatschedule(self, slug, template='gencal/schedule.html'):
+        """
+        Return the days as a table with a column per day, the all-day
+        items in the first row and the timed items positioned (with
+        percentages) within their day's hours in the second.
+        """
+        self.slug = slug
+        first_hour, last_hour = self.get_hours()
+        first_minute, last_minute = first_hour * 60, last_hour * 60
+        links = self.get_day_links()
+        days = []
+        with measure('render') as counts:
+            for offset in range(self.days):
+                day = self.start + timedelta(days=offset)
+                all_day, slots = self.get_day_schedule(day)
+                positioned = []
+                for slot in slots:
+                    if slot.end <= first_minute or slot.start >= last_minute:
+                        continue
+                    top, height, left, width = slot.get_position(first_minute,
+                            last_minute)
+                    # Formatted here, as the floatformat filter localizes.
+                    positioned.append({'item': slot.item, 'url': slot.url,
+                        'top': '%.3f' % top, 'height': '%.3f' % height,
+                        'left': '%.3f' % left, 'width': '%.3f' % width,
+                        'start': '%02d:%02d' % divmod(slot.start, 60)})
+                days.append({'date': day, 'link': links[offset],
+                    'today': day == self.today, 'all_day': all_day,
+                    'slots': positioned})
+            span = float(last_hour - first_hour)
+            hours = [{'label': '%02d:00' % hour,
+                'top': '%.3f' % ((hour - first_hour) * 100 / span)}
+                for hour in range(first_hour, last_hour)]
+            prev_link, next_link = self.get_schedule_links(slug)
+            html = render_to_string(template, {'days': days, 'hours': hours,
+                'hour_count': last_hour - first_hour, 'prev_link': prev_link,
+                'next_link': next_link})
+            counts['bytes'] = len(html)
+        return html
+
+class DensityCalendar(ListCalendar):
+    """
+    A year of per-day counts on the grid of its months, rendered as a
+    compact table with a column per week and a cell per day, shaded by
+    the day's count relative to the busiest day's. The cells are built in
+    one pass without a template render each, and there are no items to
+    bucket, only a count per day.
+
+    :param counts: A dict mapping days to counts. Days outside ``year``
+        are left out.
+    :type counts: dict.
+    :keyword year: Year to render.
+    :type year: int.
+    """
+    # Number of shades; a day's cell gets the class ``d0`` (no objects) up
+    # to ``d<levels>`` (the busiest days).
+    levels = 4
+
+    def __init__(self, counts, year=None, *args, **kwargs):
+        if not year:
+            year = datetime.today().year
+        kwargs['window'] = get_grid_window(year, 1, months=12)
+        super(DensityCalendar, self).__init__([], year, 1, *args, **kwargs)
+        buckets = self.buckets
+        self.counts = [0] * buckets.days
+        for day, count in counts.iteritems():
+            offset = buckets.offset(day)
+            if offset is not None and day.year == year:
+                self.counts[offset] += count
+
+    def get_level(self, count, top):
+        """
+        Return the shade (``0`` to :attr:`levels`) of a day with ``count``
+        objects when the busiest day has ``top``.
+        """
+        if not count:
+            return 0
+        return min(self.levels, -(-count * self.levels // top))
+
+    def formatdensity(self):
+        """
+        Return the year as a table: a header row of month names, then a
+        row per weekday. Each day's cell has a ``title`` giving its count.
+        """
+        with measure('render') as counts:
+            year, buckets = self.year, self.buckets
+            weeks = buckets.days // 7
+            top = max(self.counts) or 1
+            months = []
+            for week in range(weeks):
+                day = buckets.date(week * 7 + 6)
+                month = day.year == year and day.month or None
+                if months and months[-1][0] == month:
+                    months[-1][1] += 1
+                else:
+                    months.append([month, 1])
+            parts = ['<table class="density">\n<tr><th></th>']
+            for month, span in months:
+                parts.append('<th colspan="%d">%s</th>' % (span,
+                    month and month_abbr[month] or ''))
+            parts.append('</tr>\n')
+            for row in range(7):
+                parts.append('<tr><th>%s</th>' % day_abbr[
+                    (self.firstweekday + row) % 7])
+                for week in range(weeks):
+                    offset = week * 7 + row
+                    day = buckets.date(offset)
+                    if day.year != year:
+                        parts.append('<td></td>')
+                        continue
+                    count = self.counts[offset]
+                    parts.append('<td class="d%d" title="%s: %d"></td>' % (
+                        self.get_level(count, top), day.isoformat(), count))
+                parts.append('</tr>\n')
+            parts.append('</table>\n')
+            html = mark_safe(''.join(parts))
+            counts['bytes'] = len(html)
+        return html
@@ -1,6 +1,38 @@
-from templatetags.gencal import ListCalendar
-import unittest
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.http import QueryDict
+from django.test import TestCase
+from django.utils import simplejson
+from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db.models.query_utils import deferred_class_factory
+
+import agenda
+import cache
+import density
+import feeds
+import filters
+import fetch
+import instrumentation
+import metadata
+import prerender
+import rollups
+from buckets import DayBuckets, MonthDictView
+from models import CalendarRow, DailyCount, GenericCalendar, GenericListCalendar
+from models import RollupListCalendar
+from models import get_date_attr_name
+from grid import LRUCache, get_grid_window, months_showing
+from prerender import get_months
+from recurrence import Recurrence
+from templatetags.gencal import DensityCalendar, ListCalendar, ScheduleCalendar, gencal
+from timeline import Slot, layout
 import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
 
 class GencalBasicTest(unittest.TestCase):
     def setUp(self):
@@ -18,9 +50,907 @@ class GencalBasicTest(unittest.TestCase):
 
     def test_it(self):
         today = datetime.date.today()
-        calendar = ''.join(self.list_cal.formatmonth(today.year, today.month))
+        calendar = ''.join(self.list_cal.formatmonth('test', today.year, today.month))
         self.assertEqual(3, calendar.count("/home/"))
-        
+
+class CompiledMonthTest(unittest.TestCase):
+    def setUp(self):
+        class ObjectListCalendar(ListCalendar):
+            def get_day_context(self, day, weekday):
+                context = super(ObjectListCalendar, self).get_day_context(day, weekday)
+                context['object_list'] = self.month_dict[day]
+                return context
+        self.cal_class = ObjectListCalendar
+        self.obj_list = [{'date': datetime.date(2009, 1, 1), 'name': 'first'},
+                         {'date': datetime.date(2009, 1, 1), 'name': '<second>'},
+                         {'date': datetime.date(2009, 1, 20), 'name': 'third'}]
+
+    def test_compiled_matches_chained(self):
+        chained = self.cal_class(self.obj_list, 2009, 1).formatmonth('test', 2009, 1)
+        compiled = self.cal_class(self.obj_list, 2009, 1,
+                compiled=True).formatmonth('test', 2009, 1)
+        self.assertEqual(chained, compiled)
+        self.assertTrue('&lt;second&gt;' in compiled)
+
+
+class MonthCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.old_setting = getattr(settings, 'CALENDAR_CACHE', False)
+        settings.CALENDAR_CACHE = True
+        cache.reset_stats()
+        cache.invalidate_month('cached', 2009, 1)
+        cache.reset_stats()
+
+    def tearDown(self):
+        settings.CALENDAR_CACHE = self.old_setting
+
+    def test_hit_skips_object_list(self):
+        class Unfetchable(object):
+            def __iter__(self):
+                raise AssertionError("object list evaluated on a cache hit")
+        first = gencal([{'date': datetime.date(2009, 1, 5)}], 'cached', 2009, 1)
+        self.assertEqual(first, gencal(Unfetchable(), 'cached', 2009, 1))
+        self.assertEqual({'hits': 1, 'misses': 1, 'invalidations': 0},
+                cache.get_stats())
+
+    def test_invalidate_month(self):
+        gencal([], 'cached', 2009, 1)
+        cache.invalidate_month('cached', 2009, 1)
+        gencal([], 'cached', 2009, 1)
+        self.assertEqual({'hits': 0, 'misses': 2, 'invalidations': 1},
+                cache.get_stats())
+
+    def test_invalidates_every_month_an_object_spans(self):
+        calendar = make_calendar('spans', Meeting)
+        cache.invalidate_content_types(None)
+        try:
+            meeting = Meeting.objects.create(title='Conference',
+                    starts=datetime.datetime(2009, 3, 10),
+                    ends=datetime.datetime(2009, 5, 20))
+            self.assertTrue(Meeting in metadata.get_calendar_models())
+            reminder = Reminder.objects.create(title='Unrelated',
+                    when=datetime.datetime(2009, 3, 10))
+            cache.remember_old_date(Reminder, reminder)
+            self.assertFalse(hasattr(reminder, '_gencal_old_span'))
+            reminder.delete()
+            months = [(2009, month) for month in range(1, 10)]
+            versions = [cache.get_version('spans', *month) for month in months]
+            cache.remember_old_date(Meeting, meeting)
+            meeting.starts = datetime.datetime(2009, 7, 10)
+            meeting.ends = datetime.datetime(2009, 7, 12)
+            meeting.save()
+            cache.invalidate_for_instance(Meeting, meeting)
+            changed = [month for month, version in zip(months, versions)
+                    if cache.get_version('spans', *month) != version]
+            # The old span, March to May, and the new one in July.
+            self.assertEqual([(2009, month) for month in (3, 4, 5, 7)],
+                    changed)
+        finally:
+            calendar.delete()
+            Meeting.objects.all().delete()
+            cache.invalidate_content_types(None)
+
+class GridWindowTest(unittest.TestCase):
+    def test_window_covers_leading_and_trailing_days(self):
+        self.assertEqual((datetime.date(2008, 12, 28), datetime.date(2009, 2, 1)),
+                get_grid_window(2009, 1, firstweekday=6))
+
+    def test_prerender_months(self):
+        self.assertEqual([(2008, 12), (2009, 1), (2009, 2)],
+                get_months(1, 1, datetime.date(2009, 1, 15)))
+
+    def test_months_showing(self):
+        self.assertEqual([(2008, 12), (2009, 1)],
+                months_showing(datetime.date(2008, 12, 30), firstweekday=6))
+        self.assertEqual([(2009, 1)],
+                months_showing(datetime.date(2009, 1, 15), firstweekday=6))
+
+class CalendarRowTest(unittest.TestCase):
+    def test_rows_are_bucketed_and_rendered(self):
+        row = CalendarRow(1, datetime.date(2009, 1, 5), u'Party', '/events/1/')
+        cal = GenericListCalendar([row], 2009, 1)
+        self.assertEqual([row], cal.month_dict[datetime.date(2009, 1, 5)])
+        html = cal.formatmonth('test', 2009, 1)
+        self.assertTrue('<a href="/events/1/">Party</a>' in html)
+
+class TimestampField(models.DateTimeField):
+    pass
+
+class Stamped(models.Model):
+    created = TimestampField()
+    published = models.DateField()
+
+class Scheduled(Stamped):
+    calendar_date_field = 'starts'
+    starts = TimestampField()
+
+class Meeting(models.Model):
+    calendar_end_field = 'ends'
+    title = models.CharField(max_length=100)
+    starts = models.DateTimeField()
+    ends = models.DateTimeField()
+
+class Appointment(models.Model):
+    title = models.CharField(max_length=100)
+    day = models.DateField()
+
+    def __unicode__(self):
+        return self.title
+
+class Reminder(models.Model):
+    title = models.CharField(max_length=100)
+    when = models.DateTimeField()
+
+    def __unicode__(self):
+        return self.title
+
+def make_calendar(slug, *calendar_models):
+    """
+    Create a calendar ``slug`` showing ``calendar_models``.
+    """
+    calendar = GenericCalendar.objects.create(name=slug, slug=slug)
+    for model in calendar_models:
+        calendar.content_types.add(ContentType.objects.get_for_model(model))
+    return calendar
+
+class DateFieldRegistryTest(unittest.TestCase):
+    def test_prefers_date_over_datetime_subclass(self):
+        self.assertEqual('published', get_date_attr_name(Stamped))
+
+    def test_explicit_field(self):
+        self.assertEqual('starts', get_date_attr_name(Scheduled))
+
+    def test_deferred_class_uses_model(self):
+        deferred = deferred_class_factory(Stamped, ['created'])
+        self.assertEqual('published', get_date_attr_name(deferred))
+
+class RecurrenceTest(unittest.TestCase):
+    def days(self, cal):
+        return [d.day for d, items in cal.month_dict.items()
+                if items and d.month == cal.month]
+
+    def test_old_daily_recurrence(self):
+        items = [{'date': datetime.date(1990, 1, 1),
+            'repeat': {'freq': 'daily', 'interval': 10}}]
+        cal = ListCalendar(items, 2009, 1, recurrence_field='repeat')
+        self.assertEqual([1, 11, 21, 31], self.days(cal))
+
+    def test_weekly_until_and_exceptions(self):
+        repeat = Recurrence('weekly', until=datetime.date(2009, 1, 25),
+                exceptions=[datetime.date(2009, 1, 13)])
+        items = [{'date': datetime.date(2009, 1, 6), 'repeat': repeat}]
+        cal = ListCalendar(items, 2009, 1, recurrence_field='repeat')
+        self.assertEqual([6, 20], self.days(cal))
+
+    def test_monthly_clamps_to_month_end(self):
+        repeat = Recurrence('monthly', count=3)
+        self.assertEqual([datetime.date(2009, 2, 28)],
+                list(repeat.occurrences(datetime.date(2009, 1, 31),
+                    datetime.date(2009, 2, 1), datetime.date(2009, 3, 1))))
+
+    def test_multi_day_item(self):
+        items = [{'date': datetime.date(2008, 12, 30), 'end': datetime.date(2009, 1, 2)}]
+        cal = ListCalendar(items, 2009, 1, end_field='end')
+        self.assertEqual([1, 2], self.days(cal))
+        self.assertEqual(items, cal.month_dict[datetime.date(2008, 12, 30)])
+
+class TimezoneBucketingTest(unittest.TestCase):
+    def setUp(self):
+        self.old_setting = getattr(settings, 'USE_TZ', False)
+        settings.USE_TZ = True
+
+    def tearDown(self):
+        settings.USE_TZ = self.old_setting
+
+    def test_aware_datetimes_land_on_local_days(self):
+        from django.utils.timezone import utc
+        from django.utils.tzinfo import FixedOffset
+        items = [{'date': datetime.datetime(2009, 1, 12, 3, tzinfo=utc)},
+                 {'date': datetime.datetime(2009, 2, 1, 3, tzinfo=utc)},
+                 {'date': datetime.date(2009, 1, 20)}]
+        cal = ListCalendar(items, 2009, 1, tz=FixedOffset(-300))
+        self.assertEqual([items[0]], cal.month_dict[datetime.date(2009, 1, 11)])
+        self.assertEqual([items[1]], cal.month_dict[datetime.date(2009, 1, 31)])
+        self.assertEqual([items[2]], cal.month_dict[datetime.date(2009, 1, 20)])
+        self.assertEqual(datetime.datetime(2008, 12, 28, 5),
+                cal.get_day_boundaries()[0])
+
+class RangeCalendarTest(unittest.TestCase):
+    def test_range_matches_single_months(self):
+        items = [{'date': datetime.date(2009, 1, 31)}, {'date': datetime.date(2009, 2, 1)},
+                 {'date': datetime.date(2009, 3, 15)}]
+        cal = ListCalendar(items, 2009, 1, months=3)
+        self.assertEqual([items[2]], cal.month_dict[datetime.date(2009, 3, 15)])
+        html = cal.formatrange('test', 2009, 1)
+        for month in (1, 2, 3):
+            month_items = [i for i in items if i['date'].month == month]
+            single = ListCalendar(month_items, 2009, month).formatmonth('test', 2009, month)
+            self.assertTrue(single in html)
+        self.assertEqual(1, cal.month)
+
+class LinkBatchTest(unittest.TestCase):
+    def test_links_and_urls_are_built_once(self):
+        calls = []
+        class BatchCalendar(GenericListCalendar):
+            def get_links(self, dates):
+                calls.append(len(dates))
+                return [self.get_day_url(self.slug, dt) for dt in dates]
+            def get_object_urls(self, objects):
+                calls.append(len(objects))
+                return ['/rows/%d/' % obj.pk for obj in objects]
+        rows = [CalendarRow(1, datetime.date(2009, 1, 5), u'one'),
+                CalendarRow(2, datetime.date(2009, 1, 6), u'two')]
+        cal = BatchCalendar(rows, 2009, 1, date_field='date')
+        html = cal.formatmonth('test', 2009, 1)
+        self.assertEqual([35, 2], calls)
+        self.assertTrue('href="/rows/2/"' in html)
+        prefix = cal.get_url_prefix('test')
+        self.assertTrue('href="%s2009/01/05/"' % prefix in html)
+        self.assertEqual(('%s2008/12/' % prefix, '%s2009/02/' % prefix),
+                cal.get_month_links('test', 2009, 1))
+
+class DayLimitTest(unittest.TestCase):
+    def test_cell_shows_limit_and_links_to_the_rest(self):
+        rows = [CalendarRow(pk, datetime.date(2009, 1, 5), u'row%d' % pk)
+                for pk in range(5)]
+        cal = GenericListCalendar(rows, 2009, 1, day_limit=2)
+        html = cal.formatmonth('test', 2009, 1)
+        self.assertTrue('row1' in html)
+        self.assertFalse('row2' in html)
+        self.assertTrue('%s?offset=2">3 more' % cal.get_day_url('test',
+            datetime.date(2009, 1, 5)) in html)
+
+    def test_rollup_cells_are_a_prefix_of_the_day_listing(self):
+        calendar = make_calendar('limited', Appointment, Reminder)
+        day = datetime.date(2009, 1, 5)
+        try:
+            objects = [Appointment.objects.create(title='a%d' % i, day=day)
+                    for i in range(5)]
+            objects += [Reminder.objects.create(title='r%d' % i,
+                when=datetime.datetime(2009, 1, 5, 9 + i)) for i in range(2)]
+            # Sorted by content type id, as get_objects_for_day lists them.
+            objects.sort(key=lambda obj: ContentType.objects.get_for_model(
+                obj).pk)
+            rollups.rebuild(calendar)
+            for day_limit in (3, 5):
+                cal = RollupListCalendar(calendar.get_rollups_for_date(2009, 1),
+                        2009, 1, day_limit=day_limit)
+                context = cal.get_day_context(day, day.weekday())
+                shown = list(context['object_list'])
+                rest = calendar.get_objects_for_day(day, offset=len(shown))
+                self.assertEqual(len(rest), context['more'])
+                self.assertEqual(objects, shown + rest)
+        finally:
+            calendar.delete()
+            Appointment.objects.all().delete()
+            Reminder.objects.all().delete()
+
+class StreamingTest(unittest.TestCase):
+    def test_pieces_match_buffered_output(self):
+        items = [{'date': datetime.date(2009, 1, 5)}, {'date': datetime.date(2009, 2, 10)}]
+        cal = ListCalendar(items, 2009, 1, months=2)
+        self.assertEqual(cal.formatmonth('test', 2009, 1),
+                ''.join(cal.iterformatmonth('test', 2009, 1)))
+        self.assertEqual(cal.formatrange('test', 2009, 1),
+                ''.join(cal.iterformatrange('test', 2009, 1)))
+        # head, four weeks, three separators and the tail
+        self.assertEqual(9, len(list(cal.iterformatmonth('test', 2009, 2))))
+
+class DayBucketsTest(unittest.TestCase):
+    def test_days_keep_insertion_order(self):
+        buckets = DayBuckets(datetime.date(2009, 1, 1), 3)
+        buckets.extend(['c', 'a'], [2, 0])
+        buckets.add('span', [0, 1])
+        buckets.extend(['b'], [0])
+        self.assertEqual(['a', 'span', 'b'], buckets.get(0))
+        self.assertEqual(['span'], buckets.get(1))
+        self.assertEqual(1, buckets.count(2))
+        self.assertEqual(None, buckets.offset(datetime.date(2009, 1, 4)))
+
+    def test_month_dict_view(self):
+        view = MonthDictView(DayBuckets(datetime.date(2009, 1, 1), 2))
+        self.assertEqual([datetime.date(2009, 1, 1), datetime.date(2009, 1, 2)],
+                view.keys())
+        self.assertFalse(datetime.date(2009, 1, 3) in view)
+        self.assertRaises(KeyError, view.__getitem__, datetime.date(2008, 12, 31))
+
+class FeedTest(unittest.TestCase):
+    def test_ics_escapes_and_folds(self):
+        calendar = GenericCalendarStub()
+        row = CalendarRow(7, datetime.date(2009, 1, 5), u'Lunch; with, friends ' * 5,
+                '/events/7/', Stamped)
+        ics = feeds.to_ics(calendar, [row], 'example.com')
+        self.assertTrue('UID:gencal.stamped-7@example.com\r\n' in ics)
+        self.assertTrue('DTSTART;VALUE=DATE:20090105\r\n' in ics)
+        self.assertTrue('SUMMARY:Lunch\\; with\\, friends' in ics)
+        for line in ics.split('\r\n'):
+            self.assertTrue(len(line) <= 75)
+
+    def test_aware_times_are_written_in_utc(self):
+        from django.utils.timezone import utc
+        from django.utils.tzinfo import FixedOffset
+        calendar = GenericCalendarStub()
+        rows = [CalendarRow(1, datetime.datetime(2009, 1, 5, 22, 30,
+                    tzinfo=FixedOffset(-300)), u'Late', None, Stamped),
+                CalendarRow(2, datetime.datetime(2009, 1, 5, 9), u'Floating',
+                    None, Stamped)]
+        ics = feeds.to_ics(calendar, rows, 'example.com')
+        self.assertTrue('DTSTART:20090106T033000Z\r\n' in ics)
+        self.assertTrue('DTSTART:20090105T090000\r\n' in ics)
+        self.assertEqual(datetime.datetime(2009, 1, 6, 3, 30, tzinfo=utc),
+                feeds.as_utc(datetime.datetime(2009, 1, 5, 22, 30,
+                    tzinfo=FixedOffset(-300))))
+        self.assertEqual(utc, feeds.as_utc(datetime.date(2009, 1, 5)).tzinfo)
+
+class ConcurrentFetchTest(unittest.TestCase):
+    def test_results_keep_order_and_slow_calls_time_out(self):
+        release = threading.Event()
+        def slow():
+            release.wait(5)
+            return ['slow']
+        try:
+            results = fetch.fetch_concurrently([lambda: ['a'], slow, lambda: ['b']],
+                    [None, 0.05, None], concurrency=2)
+        finally:
+            release.set()
+        self.assertEqual([['a'], None, ['b']], results)
+
+    def test_timeouts_start_when_the_call_does(self):
+        def slow():
+            time.sleep(0.1)
+            return ['slow']
+        results = fetch.fetch_concurrently([slow, lambda: ['b']],
+                [None, 0.05], concurrency=1)
+        self.assertEqual([['slow'], ['b']], results)
+
+    def test_timed_out_calls_give_up_their_slot(self):
+        release = threading.Event()
+        def stuck():
+            release.wait(5)
+            return ['stuck']
+        try:
+            results = fetch.fetch_concurrently([stuck, lambda: ['b']],
+                    [0.05, 1], concurrency=1)
+        finally:
+            release.set()
+        self.assertEqual([None, ['b']], results)
+
+    def test_errors_are_raised(self):
+        def broken():
+            raise ValueError
+        self.assertRaises(ValueError, fetch.fetch_concurrently,
+                [lambda: [], broken], [1, 1], concurrency=2)
+
+class AgendaCursorTest(unittest.TestCase):
+    def setUp(self):
+        self.calendar = make_calendar('agenda', Appointment, Reminder)
+
+    def tearDown(self):
+        self.calendar.delete()
+        Appointment.objects.all().delete()
+        Reminder.objects.all().delete()
+
+    def pages(self, limit, **kwargs):
+        objects, after = [], None
+        # More pages than objects means the cursor isn't advancing.
+        for i in range(10):
+            page, after = agenda.get_agenda(self.calendar,
+                    datetime.date(2009, 1, 1), after, limit, **kwargs)
+            objects += page
+            if after is None:
+                return objects
+            after = agenda.parse_cursor(agenda.format_cursor(after),
+                    kwargs.get('tz'))
+        self.fail('Pagination did not advance: %r' % objects)
+
+    def test_round_trip(self):
+        cursor = (datetime.datetime(2009, 1, 5, 13, 30, 0, 250000), 12, 345)
+        self.assertEqual('20090105133000250000-12-345',
+                agenda.format_cursor(cursor))
+        self.assertEqual(cursor,
+                agenda.parse_cursor('20090105133000250000-12-345'))
+        self.assertRaises(ValueError, agenda.parse_cursor, '2009-01-05')
+
+    def test_sub_second_times_advance(self):
+        reminders = [Reminder.objects.create(title='m%d' % i,
+            when=datetime.datetime(2009, 1, 5, 10, 0, 0, (i + 1) * 100000))
+            for i in range(6)]
+        self.assertEqual(reminders, self.pages(2))
+
+    def test_dates_and_aware_datetimes(self):
+        from django.utils.timezone import utc
+        from django.utils.tzinfo import FixedOffset
+        old_setting = settings.USE_TZ
+        settings.USE_TZ = True
+        try:
+            tz = FixedOffset(-300)
+            # 03:00 UTC on the 6th is still the 5th in UTC-5.
+            late = Reminder.objects.create(title='late',
+                    when=datetime.datetime(2009, 1, 6, 3, tzinfo=utc))
+            first = Appointment.objects.create(title='first',
+                    day=datetime.date(2009, 1, 5))
+            second = Appointment.objects.create(title='second',
+                    day=datetime.date(2009, 1, 6))
+            self.assertEqual([first, late, second], self.pages(1, tz=tz))
+        finally:
+            settings.USE_TZ = old_setting
+
+class DayCountTimeZoneTest(unittest.TestCase):
+    def setUp(self):
+        self.calendar = make_calendar('counts', Reminder)
+        self.old_setting = settings.USE_TZ
+        settings.USE_TZ = True
+
+    def tearDown(self):
+        settings.USE_TZ = self.old_setting
+        self.calendar.delete()
+        Reminder.objects.all().delete()
+
+    def test_counts_use_local_days(self):
+        from django.utils.timezone import utc
+        from django.utils.tzinfo import FixedOffset
+        for hour in (1, 2, 3, 16):
+            Reminder.objects.create(title='r%d' % hour,
+                    when=datetime.datetime(2009, 1, 6, hour, tzinfo=utc))
+        # The first three are still on the 5th in UTC-5.
+        counts = self.calendar.get_day_counts_for_date(2009, 1, top=2,
+                tz=FixedOffset(-300))
+        self.assertEqual([(datetime.date(2009, 1, 5), 3),
+                          (datetime.date(2009, 1, 6), 1)],
+                [(rollup.date, rollup.count) for rollup in counts])
+        self.assertEqual(2, len(counts[0].top_ids.split(',')))
+        counts = self.calendar.get_day_counts_for_date(2009, 1, top=2,
+                tz=utc)
+        self.assertEqual([(datetime.date(2009, 1, 6), 4)],
+                [(rollup.date, rollup.count) for rollup in counts])
+
+class RollupTest(unittest.TestCase):
+    def setUp(self):
+        self.was_enabled = rollups.is_enabled()
+        settings.CALENDAR_ROLLUPS = True
+        rollups.connect_signals()
+        self.calendar = make_calendar('rollups', Appointment)
+
+    def tearDown(self):
+        if not self.was_enabled:
+            post_save.disconnect(dispatch_uid='gencal.rollups.post_save')
+            post_delete.disconnect(dispatch_uid='gencal.rollups.post_delete')
+        settings.CALENDAR_ROLLUPS = self.was_enabled
+        self.calendar.delete()
+        Appointment.objects.all().delete()
+        Reminder.objects.all().delete()
+
+    def add(self, title, day):
+        return Appointment.objects.create(title=title,
+                day=datetime.date(2009, 1, day))
+
+    def stored(self):
+        return sorted([(rollup.date.day, rollup.count, rollup.top_ids)
+            for rollup in self.calendar.daily_counts.all()])
+
+    def test_counts_follow_saves_moves_and_deletes(self):
+        first, second, third = [self.add(title, day)
+                for title, day in (('a', 5), ('b', 5), ('c', 6))]
+        self.assertEqual([(5, 2, '%s,%s' % (first.pk, second.pk)),
+                          (6, 1, str(third.pk))], self.stored())
+        second.day = datetime.date(2009, 1, 7)
+        second.save()
+        self.assertEqual([(5, 1, str(first.pk)), (6, 1, str(third.pk)),
+                          (7, 1, str(second.pk))], self.stored())
+        third.delete()
+        self.assertEqual([(5, 1, str(first.pk)), (7, 1, str(second.pk))],
+                self.stored())
+
+    def test_store_tolerates_a_concurrent_insert(self):
+        appointment = self.add('a', 5)
+        self.calendar.daily_counts.all().delete()
+        ct = ContentType.objects.get_for_model(Appointment)
+        inserted = []
+        def insert_first(sender, instance, **kwargs):
+            # Another process stores the day between the update and the
+            # insert.
+            pre_save.disconnect(insert_first, sender=DailyCount)
+            inserted.append(instance.date)
+            DailyCount.objects.bulk_create([DailyCount(calendar=self.calendar,
+                content_type=ct, date=appointment.day, count=9, top_ids='1')])
+        pre_save.connect(insert_first, sender=DailyCount)
+        try:
+            rollups._store([self.calendar.pk], ct, appointment.day, 1,
+                    [appointment.pk])
+        finally:
+            pre_save.disconnect(insert_first, sender=DailyCount)
+        self.assertEqual([appointment.day], inserted)
+        self.assertEqual([(5, 1, str(appointment.pk))], self.stored())
+
+    def test_rebuild_matches_live_counts(self):
+        for title, day in (('a', 5), ('b', 5), ('c', 5), ('d', 5), ('e', 20)):
+            self.add(title, day)
+        self.calendar.daily_counts.update(count=0)
+        rollups.rebuild(self.calendar)
+        live = self.calendar.get_day_counts_for_date(2009, 1,
+                top=rollups.get_top_count())
+        self.assertEqual(sorted([(rollup.date.day, rollup.count,
+            rollup.top_ids) for rollup in live]), self.stored())
+
+    def test_saves_count_utc_days_with_use_tz(self):
+        from django.utils import timezone
+        from django.utils.timezone import utc
+        old_settings = settings.USE_TZ, settings.TIME_ZONE
+        settings.USE_TZ, settings.TIME_ZONE = True, 'America/New_York'
+        timezone._localtime = None
+        try:
+            self.calendar.content_types.add(
+                    ContentType.objects.get_for_model(Reminder))
+            early = Reminder.objects.create(title='early',
+                    when=datetime.datetime(2009, 1, 6, 2, tzinfo=utc))
+            self.assertEqual([(6, 1, str(early.pk))], self.stored())
+            late = Reminder.objects.create(title='late',
+                    when=datetime.datetime(2009, 1, 6, 20, tzinfo=utc))
+            saved = self.stored()
+            self.assertEqual([(6, 2, '%s,%s' % (early.pk, late.pk))], saved)
+            rollups.rebuild(self.calendar)
+            self.assertEqual(saved, self.stored())
+        finally:
+            settings.USE_TZ, settings.TIME_ZONE = old_settings
+            timezone._localtime = None
+
+    def test_rollup_calendar_applies_projections(self):
+        old_setting = getattr(settings, 'CALENDAR_PROJECTIONS', {})
+        settings.CALENDAR_PROJECTIONS = {'gencal.appointment': {
+            'values': ('title',), 'url': '/appointments/%(pk)s/'}}
+        try:
+            appointment = self.add('a', 5)
+            cal = RollupListCalendar(self.calendar.get_rollups_for_date(2009,
+                1), 2009, 1)
+            rows = cal.get_day_items(datetime.date(2009, 1, 5))
+            self.assertEqual([CalendarRow], [row.__class__ for row in rows])
+            self.assertEqual((appointment.pk, u'a',
+                '/appointments/%s/' % appointment.pk),
+                (rows[0].pk, unicode(rows[0]), rows[0].url))
+        finally:
+            settings.CALENDAR_PROJECTIONS = old_setting
+
+    def test_rollup_calendar_matches_generic_calendar(self):
+        for title, day in (('a', 5), ('b', 5), ('c', 5), ('d', 5), ('e', 20)):
+            self.add(title, day)
+        top = rollups.get_top_count()
+        generic = GenericListCalendar(self.calendar.get_objects_for_date(2009,
+            1), 2009, 1, day_limit=top)
+        rollup = RollupListCalendar(self.calendar.get_rollups_for_date(2009,
+            1), 2009, 1, day_limit=top)
+        self.assertEqual(generic.formatmonth('rollups', 2009, 1),
+                rollup.formatmonth('rollups', 2009, 1))
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.old_setting = getattr(settings, 'CALENDAR_INSTRUMENTATION', False)
+        settings.CALENDAR_INSTRUMENTATION = True
+
+    def tearDown(self):
+        settings.CALENDAR_INSTRUMENTATION = self.old_setting
+
+    def test_phases_are_collected(self):
+        phases = []
+        def receiver(sender, phase, **kwargs):
+            phases.append(phase)
+        instrumentation.measured.connect(receiver)
+        collector = instrumentation.start()
+        try:
+            cal = ListCalendar([{'date': datetime.date(2009, 1, 5)}], 2009, 1)
+            html = cal.formatmonth('test', 2009, 1)
+        finally:
+            instrumentation.stop()
+            instrumentation.measured.disconnect(receiver)
+        self.assertEqual(['bucket', 'render'], phases)
+        totals = collector.totals()
+        self.assertEqual(1, totals['bucket']['items'])
+        self.assertEqual(len(html), totals['render']['bytes'])
+        self.assertTrue(collector.summary().startswith('bucket='))
+
+    def test_disabled_is_a_no_op(self):
+        settings.CALENDAR_INSTRUMENTATION = False
+        self.assertTrue(instrumentation.measure('render') is
+                instrumentation.measure('bucket'))
+
+class ScheduleLayoutTest(unittest.TestCase):
+    def test_overlapping_slots_share_columns(self):
+        # 9:00-10:00 and 9:30-11:00 overlap, 10:00-10:30 reuses the first
+        # column; 12:00 starts a new group.
+        slots = layout([Slot('c', 600, 630), Slot('a', 540, 600),
+            Slot('b', 570, 660), Slot('d', 720, 780)])
+        self.assertEqual(['a', 'b', 'c', 'd'], [slot.item for slot in slots])
+        self.assertEqual([0, 1, 0, 0], [slot.column for slot in slots])
+        self.assertEqual([2, 2, 2, 1], [slot.columns for slot in slots])
+        self.assertEqual((25.0, 75.0, 50.0, 50.0),
+                slots[1].get_position(540, 660))
+
+    def test_week_schedule(self):
+        items = [{'date': datetime.datetime(2009, 1, 13, 9, 0),
+                  'end': datetime.datetime(2009, 1, 13, 10, 30)},
+                 {'date': datetime.date(2009, 1, 14)}]
+        cal = ScheduleCalendar(items, datetime.date(2009, 1, 12),
+                end_field='end')
+        all_day, slots = cal.get_day_schedule(datetime.date(2009, 1, 13))
+        self.assertEqual([], all_day)
+        self.assertEqual([(540, 630)], [(s.start, s.end) for s in slots])
+        all_day, slots = cal.get_day_schedule(datetime.date(2009, 1, 14))
+        self.assertEqual([(items[1], None)], all_day)
+        self.assertEqual([], slots)
+
+class CalendarMetadataTest(unittest.TestCase):
+    def setUp(self):
+        self.calendar = GenericCalendar.objects.create(name='Meta',
+                slug='meta')
+
+    def tearDown(self):
+        self.calendar.delete()
+
+    def test_lookup_and_invalidation(self):
+        calendar = metadata.get_calendar('meta')
+        self.assertEqual((self.calendar.pk, 'Meta'), (calendar.pk, calendar.name))
+        self.assertEqual([], calendar.get_date_fields())
+        self.calendar.content_types.add(
+                ContentType.objects.get_for_model(DailyCount))
+        self.assertEqual([(DailyCount, DailyCount._meta.get_field('date'))],
+                metadata.get_calendar('meta').get_date_fields())
+        self.assertRaises(GenericCalendar.DoesNotExist, metadata.get_calendar,
+                'missing')
+
+    def test_missing_models_are_skipped(self):
+        gone = ContentType.objects.create(name='ghost', app_label='gone',
+                model='ghost')
+        date_ct = ContentType.objects.get_for_model(DailyCount)
+        try:
+            self.calendar.content_types.add(gone, date_ct)
+            date_fields = [(DailyCount, DailyCount._meta.get_field('date'))]
+            self.assertEqual(date_fields,
+                    metadata.get_calendar('meta').get_date_fields())
+            self.assertEqual(date_fields, GenericCalendar.objects.get(
+                pk=self.calendar.pk).get_date_fields())
+            self.assertEqual(date_fields, metadata.get_date_fields(
+                [gone.pk + 1000, date_ct.pk]))
+        finally:
+            gone.delete()
+
+class IterableIngestionTest(unittest.TestCase):
+    def test_items_off_the_grid_are_left_out(self):
+        items = ({'date': datetime.date(2008, 12, 1) + datetime.timedelta(days=n)}
+                for n in range(120))
+        cal = ListCalendar(items, 2009, 1)
+        self.assertEqual(cal.buckets.days, len(cal.buckets.items))
+
+    def test_sorted_input_stops_past_the_grid(self):
+        def endless():
+            day = datetime.date(2008, 12, 1)
+            while True:
+                yield {'date': day}
+                day += datetime.timedelta(days=1)
+        cal = ListCalendar(endless(), 2009, 1, sorted_by_date=True)
+        self.assertEqual(cal.buckets.days, len(cal.buckets.items))
+
+class DensityTest(unittest.TestCase):
+    def test_count_by_day(self):
+        calendar = GenericCalendar.objects.create(name='Dense', slug='dense')
+        try:
+            for model, day in ((DailyCount, 5), (GenericCalendar, 5),
+                    (DailyCount, 6)):
+                DailyCount.objects.create(calendar=calendar, date=datetime.date(
+                    2009, 1, day), content_type=ContentType.objects.get_for_model(model))
+            self.assertEqual({datetime.date(2009, 1, 5): 2,
+                datetime.date(2009, 1, 6): 1}, density.count_by_day(
+                    calendar.daily_counts.all(),
+                    DailyCount._meta.get_field('date')))
+        finally:
+            calendar.delete()
+
+    def test_year_of_cells(self):
+        cal = DensityCalendar({datetime.date(2009, 1, 5): 4,
+            datetime.date(2009, 1, 6): 1, datetime.date(2010, 1, 1): 9}, 2009)
+        html = cal.formatdensity()
+        self.assertEqual(365, html.count('<td class="d'))
+        self.assertTrue('<td class="d4" title="2009-01-05: 4">' in html)
+        self.assertTrue('<td class="d1" title="2009-01-06: 1">' in html)
+
+class SkeletonMemoTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        memo = LRUCache(2)
+        memo.get_or_create('a', lambda: 1)
+        memo.get_or_create('b', lambda: 2)
+        memo.get_or_create('a', lambda: None)
+        memo.get_or_create('c', lambda: 3)
+        self.assertEqual(['a', 'c'], list(memo.entries))
+        self.assertEqual(1, memo.get_or_create('a', lambda: None))
+
+    def test_grids_are_shared(self):
+        first = ListCalendar([], 2009, 1)
+        second = ListCalendar([], 2009, 1)
+        self.assertTrue(first.monthdates2calendar(2009, 1) is
+                second.monthdates2calendar(2009, 1))
+        self.assertTrue(first.get_week_header() is second.get_week_header())
+
+    def test_month_headers_are_shared_across_calendars(self):
+        calls = []
+        class CountingCalendar(ListCalendar):
+            def formatmonthname(self, *args, **kwargs):
+                calls.append(args)
+                return super(CountingCalendar, self).formatmonthname(*args,
+                        **kwargs)
+        # Different slugs give different month links, but the same header.
+        CountingCalendar([], 2031, 3).formatmonth('first', 2031, 3)
+        CountingCalendar([], 2031, 3).formatmonth('second', 2031, 3)
+        self.assertEqual([(2031, 3)], calls)
+
+class CalendarFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.old_setting = getattr(settings, 'CALENDAR_FILTERS', {})
+        settings.CALENDAR_FILTERS = {'gencal.dailycount': {'count': 'count',
+            'type': 'content_type__model'}}
+        filters._filter_registry.clear()
+
+    def tearDown(self):
+        settings.CALENDAR_FILTERS = self.old_setting
+        filters._filter_registry.clear()
+
+    def test_filters_are_normalized(self):
+        calendar = GenericCalendarStub()
+        calendar.get_date_fields = lambda: [(DailyCount,
+            DailyCount._meta.get_field('date'))]
+        parsed = filters.parse_filters(calendar,
+                QueryDict('type=b&count=2&type=a&type=b&tz=UTC'))
+        self.assertEqual((('count', (u'2',)), ('type', (u'a', u'b'))), parsed)
+        self.assertEqual(parsed, filters.parse_filters(calendar,
+            QueryDict('count=2&type=a&type=b')))
+        self.assertEqual('count=2&type=a&type=b', filters.format_filters(parsed))
+        self.assertEqual('', filters.get_filter_key(()))
+
+    def test_filters_are_pushed_down(self):
+        queryset = filters.apply_filters(DailyCount, DailyCount.objects.all(),
+                (('count', ('2',)),))
+        self.assertTrue('"count" = 2' in str(queryset.query))
+        self.assertEqual(None, filters.apply_filters(GenericCalendar,
+            GenericCalendar.objects.all(), (('count', ('2',)),)))
+
+    def test_distinct_only_across_to_many_relations(self):
+        queryset = filters.apply_filters(DailyCount, DailyCount.objects.all(),
+                (('type', ('a', 'b')),))
+        self.assertFalse(queryset.query.distinct)
+        self.assertTrue(filters.is_multi_valued(GenericCalendar,
+            'content_types__model'))
+        self.assertTrue(filters.is_multi_valued(GenericCalendar,
+            'daily_counts__count'))
+        self.assertFalse(filters.is_multi_valued(DailyCount,
+            'calendar__slug__iexact'))
+
+    def test_invalid_values_are_not_found(self):
+        from django.http import Http404
+        self.assertRaises(Http404, filters.apply_filters, DailyCount,
+                DailyCount.objects.all(), (('count', ('many',)),))
+        self.assertRaises(Http404, filters.apply_filters, DailyCount,
+                DailyCount.objects.all(), (('count', ('1', 'many')),))
+
+class CalendarViewTest(TestCase):
+    urls = 'gencal.urls'
+
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        for name, source in (('base.html', '{% block head %}{% endblock %}'
+                    '{% block content %}{% endblock %}'),
+                ('404.html', 'Not found')):
+            template = open(os.path.join(self.template_dir, name), 'w')
+            template.write(source)
+            template.close()
+        self.old_dirs = settings.TEMPLATE_DIRS
+        settings.TEMPLATE_DIRS = (self.template_dir,)
+        self.calendar = make_calendar('views', Appointment, Reminder)
+        Appointment.objects.create(title='Lunch', day=datetime.date(2009, 1, 5))
+        Reminder.objects.create(title='Call',
+                when=datetime.datetime(2009, 1, 6, 10))
+
+    def tearDown(self):
+        settings.TEMPLATE_DIRS = self.old_dirs
+        shutil.rmtree(self.template_dir)
+
+    def assertShows(self, url, *titles):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        for title in titles:
+            self.assertTrue(title in response.content, title)
+        return response
+
+    def test_month(self):
+        self.assertShows('/views/2009/01/', 'Lunch', 'Call')
+
+    def test_range(self):
+        self.assertShows('/views/2009/', 'Lunch', 'Call')
+        self.assertShows('/views/2008/12/?months=2', 'Lunch')
+        self.assertEqual(404,
+                self.client.get('/views/2009/01/?months=0').status_code)
+
+    def test_day(self):
+        self.assertShows('/views/2009/01/05/', 'Lunch')
+
+    def test_json(self):
+        response = self.assertShows('/views/2009/01/json/')
+        data = simplejson.loads(response.content)
+        self.assertEqual(['Lunch', 'Call'],
+                [item['title'] for item in data['objects']])
+        self.assertEqual(304, self.client.get('/views/2009/01/json/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+
+    def test_ics(self):
+        response = self.assertShows('/views/2009/01/ics/', 'SUMMARY:Lunch',
+                'DTSTART:20090106T100000')
+        self.assertEqual('text/calendar; charset=utf-8',
+                response['Content-Type'])
+
+    def test_agenda(self):
+        self.assertShows('/views/agenda/?start=2009-01-01', 'Lunch', 'Call')
+        self.assertEqual(404, self.client.get(
+            '/views/agenda/?after=yesterday').status_code)
+        old_settings = settings.USE_TZ, getattr(settings,
+                'CALENDAR_AGENDA_PAGE_SIZE', 20)
+        settings.USE_TZ, settings.CALENDAR_AGENDA_PAGE_SIZE = True, 1
+        try:
+            response = self.assertShows('/views/agenda/?start=2009-01-01'
+                    '&tz=America/New_York', 'Lunch')
+            self.assertTrue('?start=2009-01-01&amp;tz=America/New_York&amp;'
+                    'after=' in response.content)
+        finally:
+            settings.USE_TZ, settings.CALENDAR_AGENDA_PAGE_SIZE = old_settings
+
+    def test_week_and_hours(self):
+        self.assertShows('/views/2009/01/05/week/', 'Lunch', 'Call')
+        self.assertShows('/views/2009/01/06/hours/', 'Call')
+
+    def test_prerendered_month_is_a_cache_hit(self):
+        old_setting = getattr(settings, 'CALENDAR_CACHE', False)
+        settings.CALENDAR_CACHE = True
+        try:
+            cache.invalidate_month('views', 2009, 1)
+            cache.reset_stats()
+            self.assertEqual(('views', 2009, 1, True),
+                    prerender.render_month(('views', 2009, 1, False)))
+            self.assertEqual(('views', 2009, 1, False),
+                    prerender.render_month(('views', 2009, 1, False)))
+            self.assertEqual({'hits': 0, 'misses': 0, 'invalidations': 0},
+                    cache.get_stats())
+            self.assertShows('/views/2009/01/', 'Lunch')
+            self.assertEqual({'hits': 1, 'misses': 0, 'invalidations': 0},
+                    cache.get_stats())
+        finally:
+            settings.CALENDAR_CACHE = old_setting
+
+    def test_delegated_views_are_measured_once(self):
+        old_setting = getattr(settings, 'CALENDAR_INSTRUMENTATION', False)
+        settings.CALENDAR_INSTRUMENTATION = True
+        phases = []
+        def receiver(sender, phase, **kwargs):
+            phases.append(phase)
+        instrumentation.measured.connect(receiver)
+        try:
+            self.assertShows('/views/2009/01/05/', 'Lunch')
+            self.assertShows('/views/2009/01/?months=2', 'Lunch')
+        finally:
+            instrumentation.measured.disconnect(receiver)
+            settings.CALENDAR_INSTRUMENTATION = old_setting
+        self.assertEqual(2, phases.count('view'))
+
+    def test_density(self):
+        self.assertShows('/views/2009/density/')
+
+    def test_unknown_calendars_and_time_zones(self):
+        self.assertEqual(404, self.client.get('/missing/2009/01/').status_code)
+        old_setting = settings.USE_TZ
+        settings.USE_TZ = True
+        try:
+            self.assertEqual(404, self.client.get(
+                '/views/2009/01/?tz=Nowhere/Special').status_code)
+        finally:
+            settings.USE_TZ = old_setting
+
+class GenericCalendarStub(object):
+    name = 'Stub'
+    slug = 'stub'
 
 
 if __name__ == "__main__":
@@ -0,0 +1,69 @@
+"""
+Laying timed items out in a day's hour slots.
+
+Items that overlap in time are placed side by side: each gets a
+``column`` and the number of ``columns`` shared by the group of items
+it overlaps with (directly or through other items), so it can be drawn
+``1 / columns`` wide. :func:`layout` does this with one sweep over the
+items in start order, keeping the running items and the free columns in
+heaps, in O(n log n).
+"""
+import heapq
+
+class Slot(object):
+    """
+    An item placed on a day from ``start`` to ``end``, both in minutes
+    from the start of the day.
+    """
+    __slots__ = ('item', 'start', 'end', 'column', 'columns', 'url')
+
+    def __init__(self, item, start, end, url=None):
+        self.item = item
+        self.start = start
+        # Zero length items still take up a minute.
+        self.end = max(end, start + 1)
+        self.column = 0
+        self.columns = 1
+        self.url = url
+
+    def get_position(self, first_minute=0, last_minute=24 * 60):
+        """
+        Return ``(top, height, left, width)`` percentages placing the slot
+        in a box showing ``[first_minute, last_minute)`` of the day.
+        """
+        span = float(last_minute - first_minute)
+        start = min(max(self.start, first_minute), last_minute)
+        end = min(max(self.end, first_minute), last_minute)
+        return ((start - first_minute) * 100 / span, (end - start) * 100 / span,
+                self.column * 100.0 / self.columns, 100.0 / self.columns)
+
+def layout(slots):
+    """
+    Give each of ``slots`` a ``column`` and ``columns``, and return them
+    sorted by start (then end) time.
+
+    :arg slots: The slots of one day.
+    :type slots: list of :class:`Slot`.
+    """
+    slots = sorted(slots, key=lambda slot: (slot.start, slot.end))
+    running = []  # (end, column) of the slots still running
+    free = []     # columns freed within the current group
+    group, columns = [], 0
+    for slot in slots:
+        while running and running[0][0] <= slot.start:
+            heapq.heappush(free, heapq.heappop(running)[1])
+        if not running:
+            # Nothing overlaps this slot from before, so the group is done.
+            for member in group:
+                member.columns = columns
+            group, columns, free = [], 0, []
+        if free:
+            slot.column = heapq.heappop(free)
+        else:
+            slot.column = columns
+            columns += 1
+        heapq.heappush(running, (slot.end, slot.column))
+        group.append(slot)
+    for member in group:
+        member.columns = columns
+    return slots
@@ -1,9 +1,17 @@
 from django.conf.urls.defaults import *
 
 urlpatterns = patterns('gencal.views',
+    url(r'^(?P<calslug>.*)/(?P<year>\d{4})/(?P<month>\d{2})/json/$', 'calendar_json', name="genericcalendar-json-month"),
+    url(r'^(?P<calslug>.*)/(?P<year>\d{4})/(?P<month>\d{2})/ics/$', 'calendar_ics', name="genericcalendar-ics-month"),
+    url(r'^(?P<calslug>.*)/json/$', 'calendar_json', name="genericcalendar-json"),
+    url(r'^(?P<calslug>.*)/ics/$', 'calendar_ics', name="genericcalendar-ics"),
+    url(r'^(?P<calslug>.*)/agenda/$', 'calendar_agenda', name="genericcalendar-agenda"),
+    url(r'^(?P<calslug>.*)/(?P<year>\d{4})/(?P<month>\d{2})/(?P<day>\d{2})/week/$', 'calendar_schedule', {'days': 7}, name="genericcalendar-week"),
+    url(r'^(?P<calslug>.*)/(?P<year>\d{4})/(?P<month>\d{2})/(?P<day>\d{2})/hours/$', 'calendar_schedule', {'days': 1}, name="genericcalendar-hours"),
     url(r'^(?P<calslug>.*)/(?P<year>\d{4})/(?P<month>\d{2})/(?P<day>\d{2})/$', 'calendar', name="genericcalendar-date"),
     url(r'^(?P<calslug>.*)/(?P<year>\d{4})/(?P<month>\d{2})/$', 'calendar', name="genericcalendar-month"),
-    url(r'^(?P<calslug>.*)/(?P<year>\d{4})/$', 'calendar', name="genericcalendar-year"),
+    url(r'^(?P<calslug>.*)/(?P<year>\d{4})/density/$', 'calendar_density', name="genericcalendar-density"),
+    url(r'^(?P<calslug>.*)/(?P<year>\d{4})/$', 'calendar_range', name="genericcalendar-year"),
     url(r'^(?P<calslug>.*)/$', 'calendar', name="genericcalendar-default"),
     url(r'^$', 'calendar_list', name="genericcalendar-list"),
 )
@@ -1,15 +1,156 @@
+from __future__ import with_statement
+
 import datetime
+from functools import wraps
 
-from django.core.exceptions import FieldError
+from django.conf import settings
 from django.db.models import Q
 from django.http import HttpResponse, HttpResponseRedirect, Http404
-from django.shortcuts import render_to_response, get_object_or_404
+from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
 from django.views.generic import list_detail
 
-from models import GenericCalendar, GenericListCalendar
+import agenda
+import feeds
+import filters as gencal_filters
+import instrumentation
+import metadata
+import rollups as gencal_rollups
+from grid import add_months, get_first_weekday, get_timezone
+from models import GenericCalendar, GenericListCalendar, LazyObjectList, RollupListCalendar
+from models import GenericScheduleCalendar
+from models import get_day_limit, get_item_date
+from templatetags.gencal import DensityCalendar, iter_gencal, iter_gencal_range
+
+MAX_RANGE_MONTHS = 24
+
+def is_streaming(stream=None):
+    if stream is None:
+        return getattr(settings, 'CALENDAR_STREAMING', False)
+    return stream
+
+def render_streaming(request, template_name, d, chunks):
+    """
+    Render ``template_name`` around the calendar pieces in ``chunks``,
+    returning a response that sends the page up to ``{{ calendar }}``
+    straight away and each piece of the calendar as it's produced.
+
+    Middleware that reads ``response.content`` (e.g. GZipMiddleware or
+    ETags) will buffer the response again.
+    """
+    marker = mark_safe('<!--gencal:calendar-->')
+    d = dict(d, calendar=marker)
+    page = render_to_string(template_name, d,
+            context_instance=RequestContext(request))
+    head, tail = page.split(marker, 1)
+    def content():
+        yield head
+        for chunk in chunks:
+            yield chunk
+        yield tail
+    return HttpResponse(content())
+
+def instrumented(view):
+    """
+    Collect the :mod:`gencal.instrumentation` measurements made while
+    ``view`` runs, if instrumentation is on. The collector is kept in
+    ``request.gencal_metrics`` and its summary is sent in an
+    ``X-Gencal-Metrics`` header if ``CALENDAR_INSTRUMENTATION_HEADER`` is
+    true. Streamed responses are only measured up to the point they start
+    streaming.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not instrumentation.is_enabled():
+            return view(request, *args, **kwargs)
+        collector = instrumentation.start()
+        try:
+            with instrumentation.measure('view'):
+                response = view(request, *args, **kwargs)
+        finally:
+            if collector is not None:
+                instrumentation.stop()
+        if collector is not None:
+            request.gencal_metrics = collector
+            if instrumentation.is_header_enabled():
+                response['X-Gencal-Metrics'] = collector.summary()
+        return response
+    return wrapper
+
+def get_calendar_class(rollups=None):
+    """
+    Return the calendar class the views render with: one built from
+    :class:`gencal.models.DailyCount` rollups if ``rollups`` is true
+    (defaulting to the ``CALENDAR_ROLLUPS`` setting) or the
+    ``CALENDAR_DAY_LIMIT`` setting is set, otherwise one built from the
+    objects themselves.
+    """
+    if rollups is None:
+        rollups = gencal_rollups.is_enabled()
+    if rollups or get_day_limit() is not None:
+        return RollupListCalendar
+    return GenericListCalendar
+
+def get_object_list(calendar, year, month, months=1, rollups=None,
+        concurrent=None, tz=None, filters=()):
+    """
+    Return the :class:`gencal.models.LazyObjectList` the calendar class
+    from :func:`get_calendar_class` expects.
+    """
+    if rollups is None:
+        rollups = gencal_rollups.is_enabled()
+    return LazyObjectList(calendar, year, month, months, rollups=rollups,
+            concurrent=is_concurrent(concurrent), day_limit=get_day_limit(),
+            tz=tz, filters=filters)
+
+def get_filtered_class(rollups, filters):
+    """
+    Return :func:`get_calendar_class`, leaving stored rollups out when
+    there are ``filters``, since they count everything.
+    """
+    if filters:
+        rollups = False
+    return get_calendar_class(rollups)
+
+def get_request_timezone(request, tz=None):
+    """
+    Return the time zone to lay a calendar out in: ``tz`` (from the
+    URLconf) or the ``?tz=`` parameter, such as ``Europe/Paris``, falling
+    back on the current time zone. Unknown time zones raise Http404.
+    """
+    try:
+        return get_timezone(tz or request.GET.get('tz') or None)
+    except ValueError:
+        raise Http404
+
+def get_calendar_or_404(calslug):
+    """
+    Return the calendar ``calslug`` from :mod:`gencal.metadata`, raising
+    Http404 if there isn't one.
+    """
+    try:
+        return metadata.get_calendar(calslug)
+    except GenericCalendar.DoesNotExist:
+        raise Http404
+
+def is_concurrent(concurrent=None):
+    if concurrent is None:
+        return getattr(settings, 'CALENDAR_CONCURRENT_FETCH', False)
+    return concurrent
+
+@instrumented
+def calendar(request, calslug, year=None, month=None, day=None, stream=None,
+        rollups=None, concurrent=None, tz=None):
+    # The undecorated helpers, so the request is only measured once.
+    if day is not None:
+        return _calendar_day(request, calslug, year, month, day, tz=tz)
+    if 'months' in request.GET:
+        return _calendar_range(request, calslug, year, month, stream=stream,
+                rollups=rollups, concurrent=concurrent, tz=tz)
 
-def calendar(request, calslug, year=None, month=None, day=None):
     today = datetime.datetime.today()
     
     if year is None: year = today.year
@@ -21,18 +162,217 @@ def calendar(request, calslug, year=None, month=None, day=None):
     if day is None: day = today.day
     else: day = int(day)
 
-    calendar = GenericCalendar.objects.get(slug=calslug)
-    try:
-        object_list = calendar.get_objects_for_date(year, month)
-    except FieldError:
-        object_list = []
+    calendar = get_calendar_or_404(calslug)
+    # Fetched lazily, so a cached month never hits the database.
+    tz = get_request_timezone(request, tz)
+    filters = gencal_filters.parse_filters(calendar, request.GET)
+    cal_class = get_filtered_class(rollups, filters)
+    object_list = get_object_list(calendar, year, month, rollups=rollups,
+            concurrent=concurrent, tz=tz, filters=filters)
 
     # Populate a dict to be used for the template's context
     d = {'slug':calslug, 'year':year, 'month':month, 'object_list':object_list,
-            'cal_class':GenericListCalendar }
+            'cal_class':cal_class, 'tz':tz }
 
+    if is_streaming(stream):
+        return render_streaming(request, 'gencal/calendar_stream.html', d,
+                iter_gencal(object_list, calslug, year, month, cal_class, tz))
     return render_to_response('gencal/calendar.html', d, context_instance=RequestContext(request))
 
+@instrumented
+def calendar_range(request, calslug, year=None, month=None, stream=None,
+        rollups=None, concurrent=None, tz=None):
+    """
+    Renders several consecutive months: a whole year when no month is
+    given, or ``?months=N`` months (12 by default) starting with ``month``.
+    Objects for the whole range are fetched with one query per content
+    type and bucketed once.
+    """
+    return _calendar_range(request, calslug, year, month, stream=stream,
+            rollups=rollups, concurrent=concurrent, tz=tz)
+
+def _calendar_range(request, calslug, year=None, month=None, stream=None,
+        rollups=None, concurrent=None, tz=None):
+    if year is None: year = datetime.date.today().year
+    else: year = int(year)
+
+    if month is None: month = 1
+    else: month = int(month)
+
+    try:
+        months = int(request.GET.get('months', 12))
+    except ValueError:
+        raise Http404
+    if not 1 <= months <= MAX_RANGE_MONTHS:
+        raise Http404
+
+    calendar = get_calendar_or_404(calslug)
+    tz = get_request_timezone(request, tz)
+    filters = gencal_filters.parse_filters(calendar, request.GET)
+    cal_class = get_filtered_class(rollups, filters)
+    object_list = get_object_list(calendar, year, month, months,
+            rollups=rollups, concurrent=concurrent, tz=tz, filters=filters)
+
+    d = {'slug':calslug, 'year':year, 'month':month, 'months':months,
+            'object_list':object_list, 'cal_class':cal_class, 'tz':tz }
+
+    if is_streaming(stream):
+        return render_streaming(request, 'gencal/calendar_stream.html', d,
+                iter_gencal_range(object_list, calslug, year, month, months,
+                    cal_class, tz))
+    return render_to_response('gencal/calendar_range.html', d, context_instance=RequestContext(request))
+
+@instrumented
+def calendar_day(request, calslug, year, month, day, tz=None):
+    """
+    Lists the objects on one day, skipping the first ``?offset=N`` (the
+    ones already shown in the day's cell), as a fragment that can be
+    fetched to expand a day's "N more" link.
+    """
+    return _calendar_day(request, calslug, year, month, day, tz=tz)
+
+def _calendar_day(request, calslug, year, month, day, tz=None):
+    try:
+        date = datetime.date(int(year), int(month), int(day))
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        raise Http404
+    if offset < 0:
+        raise Http404
+    tz = get_request_timezone(request, tz)
+    calendar = get_calendar_or_404(calslug)
+    filters = gencal_filters.parse_filters(calendar, request.GET)
+    d = {'slug': calslug, 'date': date, 'offset': offset,
+            'object_list': calendar.get_objects_for_day(date, offset, tz,
+                filters)}
+    return render_to_response('gencal/day.html', d, context_instance=RequestContext(request))
+
+@instrumented
+def calendar_schedule(request, calslug, year, month, day, days=7, tz=None):
+    """
+    Renders ``days`` days with their objects laid out by the hour: the
+    week containing the given day (starting on the first weekday) when
+    ``days`` is 7, or just that day when it's 1.
+    """
+    try:
+        start = datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        raise Http404
+    days = int(days)
+    if days == 7:
+        start -= datetime.timedelta(days=(start.weekday() - get_first_weekday()) % 7)
+    tz = get_request_timezone(request, tz)
+    calendar = get_calendar_or_404(calslug)
+    object_list = calendar.get_objects_for_range(start,
+            start + datetime.timedelta(days=days), tz=tz)
+    schedule = GenericScheduleCalendar(object_list, start, days, tz=tz)
+    d = {'slug': calslug, 'start': start, 'days': days, 'tz': tz,
+            'calendar': mark_safe(schedule.formatschedule(calslug))}
+    return render_to_response('gencal/calendar_schedule.html', d, context_instance=RequestContext(request))
+
+@instrumented
+def calendar_density(request, calslug, year=None):
+    """
+    Renders a year of the calendar as a density calendar, each day shaded
+    by how many objects it has.
+    """
+    if year is None: year = datetime.date.today().year
+    else: year = int(year)
+    calendar = get_calendar_or_404(calslug)
+    d = {'slug': calslug, 'year': year,
+            'calendar': DensityCalendar(calendar.get_density(year),
+                year).formatdensity()}
+    return render_to_response('gencal/calendar_density.html', d, context_instance=RequestContext(request))
+
+def _feed_state(request, calslug, year=None, month=None):
+    """
+    Work out (once per request) the calendar, date range and
+    :func:`gencal.feeds.get_feed_state` for a feed view. The range is
+    ``?months=N`` calendar months (1 by default) from the given month.
+    """
+    state = getattr(request, '_gencal_feed_state', None)
+    if state is None:
+        today = datetime.date.today()
+        year = year and int(year) or today.year
+        month = month and int(month) or today.month
+        try:
+            months = int(request.GET.get('months', 1))
+        except ValueError:
+            raise Http404
+        if not 1 <= months <= MAX_RANGE_MONTHS:
+            raise Http404
+        calendar = get_calendar_or_404(calslug)
+        start = datetime.date(year, month, 1)
+        end = datetime.date(*add_months(year, month, months) + (1,))
+        etag, last_modified = feeds.get_feed_state(calendar, start, end)
+        state = request._gencal_feed_state = {'calendar': calendar,
+                'start': start, 'end': end, 'etag': etag,
+                'last_modified': last_modified}
+    return state
+
+def _feed_etag(request, *args, **kwargs):
+    return _feed_state(request, *args, **kwargs)['etag']
+
+def _feed_last_modified(request, *args, **kwargs):
+    return _feed_state(request, *args, **kwargs)['last_modified']
+
+@condition(etag_func=_feed_etag, last_modified_func=_feed_last_modified)
+def calendar_json(request, calslug, year=None, month=None):
+    """
+    The calendar's objects for a month (or ``?months=N``) as JSON. Unchanged
+    ranges are answered with 304 Not Modified.
+    """
+    state = _feed_state(request, calslug, year, month)
+    objects = state['calendar'].get_objects_for_range(state['start'], state['end'])
+    return HttpResponse(feeds.to_json(state['calendar'], state['start'],
+        state['end'], objects), mimetype='application/json')
+
+@condition(etag_func=_feed_etag, last_modified_func=_feed_last_modified)
+def calendar_ics(request, calslug, year=None, month=None):
+    """
+    The calendar's objects for a month (or ``?months=N``) as an iCalendar
+    file. Unchanged ranges are answered with 304 Not Modified.
+    """
+    state = _feed_state(request, calslug, year, month)
+    objects = state['calendar'].get_objects_for_range(state['start'], state['end'])
+    url_prefix = '%s://%s' % (request.is_secure() and 'https' or 'http',
+            request.get_host())
+    response = HttpResponse(feeds.to_ics(state['calendar'], objects,
+        request.get_host().split(':')[0], url_prefix),
+        mimetype='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename=%s.ics' % calslug
+    return response
+
+def calendar_agenda(request, calslug, tz=None):
+    """
+    Lists the calendar's objects from today (or ``?start=YYYY-MM-DD``)
+    onwards in date order, a page at a time. ``?after=`` takes the
+    cursor of the last object on the previous page. The "Later" link
+    keeps ``?start=`` and ``?tz=``, so every page is grouped into the same
+    days.
+    """
+    calendar = get_calendar_or_404(calslug)
+    tz = get_request_timezone(request, tz)
+    try:
+        start = None
+        if 'start' in request.GET:
+            start = datetime.datetime.strptime(request.GET['start'],
+                    '%Y-%m-%d').date()
+        after = None
+        if 'after' in request.GET:
+            after = agenda.parse_cursor(request.GET['after'], tz)
+    except ValueError:
+        raise Http404
+    objects, next_cursor = agenda.get_agenda(calendar, start, after, tz=tz)
+    if next_cursor is not None:
+        next_cursor = agenda.format_cursor(next_cursor)
+    d = {'calendar': calendar, 'slug': calslug,
+            'start': request.GET.get('start'),
+            'tz_name': request.GET.get('tz'),
+            'entries': [(get_item_date(obj), obj) for obj in objects],
+            'next_cursor': next_cursor}
+    return render_to_response('gencal/agenda.html', d, context_instance=RequestContext(request))
+
 def calendar_list(request):
     return list_detail.object_list(
         request,
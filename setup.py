@@ -22,5 +22,6 @@ setup(
         'Framework :: Django',
     ],
     packages=find_packages(),
+    install_requires=['Django>=1.4'],
     zip_safe=False,
 )